@@ -0,0 +1,48 @@
+import os
+import time
+import secrets
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header, Depends
+from pydantic import BaseModel
+from .db import repos
+from .db_async import run_db
+from .integrity import verify_user
+
+# Shared key support tooling sends in the X-Admin-Key header; the admin endpoints are disabled without one
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+
+def require_admin(x_admin_key: Optional[str] = Header(default=None)):
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled (ADMIN_API_KEY is not set)")
+    if x_admin_key is None or not secrets.compare_digest(x_admin_key.encode(), ADMIN_API_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+class VerifyUserRequest(BaseModel):
+    user_id: str
+
+@router.post("/verify-user")
+async def verify_user_balances(request: VerifyUserRequest):
+    """
+    Recompute the expected available amount of each of the user's categories from their
+    transactions and assignments (one query per collection, read concurrently; see
+    api/integrity.py) and return the categories whose stored amount differs, with the amounts
+    and the number of transactions and assignments behind each
+    """
+    try:
+        user_doc = await run_db(repos.users.get, request.user_id)
+        if not user_doc.exists:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        started = time.perf_counter()
+        result = await verify_user(request.user_id, user_doc.to_dict().get("email"))
+        return {
+            **result,
+            "ok": not result["issues"],
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to verify user: {str(e)}")
@@ -0,0 +1,203 @@
+"""
+Read-count benchmark and consistency check for the transaction archive (cold storage).
+
+A throwaway user gets --months months of history with --per-month transactions each. The
+same historical reads are then made through the API before and after the months older than
+--archive-months are compacted into archive blocks:
+- get-allocated-and-spent for one archived month and for the whole archived period
+- paging through every transaction with get-transactions
+- reading the full history (`repos.transactions.for_user`, as validation and exports do)
+Database reads and queries are reported for each; every response must be the same before and
+after compaction. Finally an archived transaction is recategorized and another deleted
+through the API (moving them back out of the archive) and every category balance is checked
+against its recomputed value. The script exits with status 1 on any difference.
+
+Usage (from the backend directory):
+    python api/archive_benchmark.py --months 24 --per-month 300
+"""
+import os
+import sys
+import argparse
+import datetime
+import json
+import random
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+# The benchmark creates its own user; it must not run against a real database
+if os.getenv("DB_BACKEND", "memory") == "firestore":
+    sys.exit("The archive benchmark creates its own data; run it with DB_BACKEND=memory or DB_BACKEND=sqlite")
+os.environ.setdefault("DB_BACKEND", "memory")
+
+from fastapi.testclient import TestClient
+from api.db import repos, Increment
+from api.db_instrumentation import count_operations
+from api.integrity import Ledger
+from api.balance_counters import balance_counters
+from api.transaction_archive import transaction_archive
+from backend.db.schemas import TransactionRecord, read_cents
+
+def month_start(months_ago):
+    today = datetime.date.today().replace(day=1)
+    year, month = divmod(today.year * 12 + today.month - 1 - months_ago, 12)
+    return datetime.date(year, month + 1, 1)
+
+def create_history(client, user_id, months, per_month, seed):
+    """Create the user, three categories and the transactions; returns the category IDs"""
+    rng = random.Random(seed)
+    client.post("/user/create-user", json={"email": f"{user_id}@benchmark.local", "user_id": user_id}).raise_for_status()
+    category_ids = [
+        client.post("/category/create-category", json={"name": f"Category {index}", "user_id": user_id}).json()["category_id"]
+        for index in range(3)
+    ]
+
+    # Written directly in batches; the category balances get the sums of their transactions
+    balances = dict.fromkeys(category_ids, 0)
+    rows = []
+    for months_ago in range(months):
+        start = month_start(months_ago)
+        for _ in range(per_month):
+            category_id = rng.choice(category_ids + [None])
+            record = TransactionRecord(
+                amount_cents=-rng.randint(100, 20000), user_id=user_id, name=f"Merchant {rng.randint(1, 50)}",
+                date=(start + datetime.timedelta(days=rng.randint(0, 27))).isoformat(), category_id=category_id,
+                plaid_transaction_id=f"{user_id}-{len(rows)}",
+            )
+            rows.append(record)
+            if category_id:
+                balances[category_id] += record.amount_cents
+    for start in range(0, len(rows), 400):
+        batch = repos.batch()
+        for record in rows[start:start + 400]:
+            batch.set(repos.transactions.ref(user_id=user_id), record.to_dict())
+        batch.commit()
+    batch = repos.batch()
+    for category_id, balance in balances.items():
+        batch.update(repos.categories.ref(category_id, user_id=user_id), {"available_cents": Increment(balance)})
+    batch.commit()
+    return category_ids
+
+def measured_post(client, path, body):
+    """Response JSON and the database reads/queries the request made (from the response headers)"""
+    response = client.post(path, json=body)
+    response.raise_for_status()
+    return response.json(), {"reads": int(response.headers["x-db-reads"]), "queries": int(response.headers["x-db-queries"])}
+
+def historical_reads(client, user_id, archived_month, archived_period):
+    """Results and database operations of each historical read"""
+    results, operations = {}, {}
+    month_start_date, month_end = archived_month
+    results["month_spent"], operations["month_spent"] = measured_post(client, "/category/get-allocated-and-spent", {
+        "user_id": user_id, "start_date": month_start_date, "end_date": month_end
+    })
+    results["period_spent"], operations["period_spent"] = measured_post(client, "/category/get-allocated-and-spent", {
+        "user_id": user_id, "start_date": archived_period[0], "end_date": archived_period[1]
+    })
+
+    pages, paging = [], {"reads": 0, "queries": 0, "requests": 0}
+    cursor_id = None
+    while True:
+        body = {"user_id": user_id, "limit": 100, **({"cursor_id": cursor_id} if cursor_id else {})}
+        page, counts = measured_post(client, "/transaction/get-transactions", body)
+        pages.extend(transaction["id"] for transaction in page["transactions"])
+        paging["reads"] += counts["reads"]
+        paging["queries"] += counts["queries"]
+        paging["requests"] += 1
+        cursor_id = page["pagination"]["next_cursor"]
+        if not cursor_id:
+            break
+    results["pages"], operations["pages"] = pages, paging
+
+    with count_operations() as counts:
+        history = sorted((doc.id, read_cents(doc.to_dict(), "amount")) for doc in repos.transactions.for_user(user_id))
+    results["history"], operations["history"] = history, {"reads": counts.reads, "queries": counts.queries}
+    return results, operations
+
+def check_balances(user_id):
+    """Categories whose stored balance differs from the one recomputed from the full history"""
+    # Every row is read, rather than the blocks' category totals the integrity check uses
+    ledger = Ledger()
+    for doc in repos.transactions.for_user(user_id):
+        ledger.add_transaction(doc.to_dict())
+    categories_docs = list(repos.categories.for_user(user_id))
+    available = balance_counters.totals(categories_docs)
+    return [
+        doc.id for doc in categories_docs
+        if available[doc.id] != ledger.expected_available(doc.id, doc.to_dict().get("is_unallocated_funds", False))
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare historical read costs before and after compacting transactions")
+    parser.add_argument("--months", type=int, default=24, help="Months of history")
+    parser.add_argument("--per-month", type=int, default=300, help="Transactions per month")
+    parser.add_argument("--archive-months", type=int, default=12, help="Months kept live; older ones are compacted")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated transactions")
+    args = parser.parse_args()
+    if not 0 <= args.archive_months < args.months:
+        parser.error(f"--archive-months must be below --months ({args.months}), or no month is old enough to be compacted")
+
+    import main
+
+    client = TestClient(main.app)
+    user_id = f"archive-benchmark-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+    category_ids = create_history(client, user_id, args.months, args.per_month, args.seed)
+
+    before_month = month_start(args.archive_months - 1).strftime("%Y-%m")
+    archived_month = (month_start(args.archive_months).isoformat(), (month_start(args.archive_months - 1) - datetime.timedelta(days=1)).isoformat())
+    archived_period = (month_start(args.months - 1).isoformat(), archived_month[1])
+
+    print(f"Reading {args.months * args.per_month} transactions before compaction...")
+    results_before, operations_before = historical_reads(client, user_id, archived_month, archived_period)
+    compaction = transaction_archive.compact_user(user_id, before_month)
+    print(f"Compacted {compaction['transactions']} transactions from {compaction['months']} months into {compaction['blocks']} blocks")
+    results_after, operations_after = historical_reads(client, user_id, archived_month, archived_period)
+    differences = [name for name in results_before if results_before[name] != results_after[name]]
+
+    # Editing archived transactions moves them back to the live collection
+    archived_ids = [row.id for row in repos.transaction_archive.transactions(user_id)]
+    unarchived = None
+    if len(archived_ids) < 2:
+        print("Skipping the edit of archived transactions: compaction archived fewer than 2 (raise --per-month or --months)")
+    else:
+        client.post("/transaction/update-transaction-category", json={
+            "user_id": user_id, "transaction_id": archived_ids[0], "category_id": category_ids[1]
+        }).raise_for_status()
+        client.post("/transaction/delete-transaction", json={"user_id": user_id, "transaction_id": archived_ids[1]}).raise_for_status()
+        unarchived = repos.transactions.get(archived_ids[0], user_id=user_id).exists
+    mismatched_categories = check_balances(user_id)
+
+    print(f"\n📊 Database operations before -> after compaction")
+    comparison = {}
+    for name in operations_before:
+        before, after = operations_before[name], operations_after[name]
+        comparison[name] = {"before": before, "after": after, "read_reduction": round(before["reads"] / max(after["reads"], 1), 1)}
+        print(f"  {name}: {before['reads']} -> {after['reads']} reads ({comparison[name]['read_reduction']}x fewer), "
+              f"{before['queries']} -> {after['queries']} queries")
+    print(f"  Results identical: {not differences}{'' if not differences else ' (differs: ' + ', '.join(differences) + ')'}")
+    print(f"  Archived transaction edited back to live: {'skipped' if unarchived is None else unarchived}")
+    print(f"  Categories with a wrong balance: {len(mismatched_categories)}")
+
+    # Save results to a JSON file with timestamp in the archive_benchmarks folder
+    timestamp = datetime.datetime.now()
+    benchmarks_dir = 'archive_benchmarks'
+    os.makedirs(benchmarks_dir, exist_ok=True)
+    filepath = os.path.join(benchmarks_dir, f'archive_benchmark_{timestamp.strftime("%Y%m%d_%H%M%S")}.json')
+    with open(filepath, 'w') as json_file:
+        json.dump({
+            "benchmark_timestamp": timestamp.isoformat(),
+            "settings": vars(args),
+            "compaction": compaction,
+            "operations": comparison,
+            "differences": differences,
+            "unarchived": unarchived,
+            "mismatched_categories": mismatched_categories,
+        }, json_file, indent=4)
+
+    print(f"\nDetailed results saved to: {filepath}")
+    sys.exit(1 if differences or unarchived is False or mismatched_categories else 0)
@@ -1,9 +1,14 @@
 from fastapi import APIRouter, HTTPException
+from google.api_core.exceptions import NotFound
 from pydantic import BaseModel
 from datetime import datetime, timezone
 from decimal import Decimal
-from .db import db
-from backend.db.schemas import Assignment as AssignmentSchema
+from .db import repos
+from .db_async import run_db
+from .unit_of_work import UnitOfWork
+from .balance_counters import balance_counters
+from .user_metadata import user_metadata
+from backend.db.schemas import AssignmentRecord, to_cents
 import logging
 import os
 
@@ -31,74 +36,56 @@ async def create_assignment(assignment: Assignment):
     try:
         # logger.info("Creating a new assignment for user_id: %s and category_id: %s", assignment.user_id, assignment.category_id)
         
-        if assignment.amount == 0:
+        amount_cents = to_cents(assignment.amount)
+        if amount_cents == 0:
             raise HTTPException(status_code=400, detail="Assignment amount cannot be zero")
         
-        user_ref = db.collection("users").document(assignment.user_id)
-        category_ref = db.collection("categories").document(assignment.category_id)
-
-        user_doc = user_ref.get()
-        if not user_doc.exists:
+        # Cached user metadata gives the unallocated funds category ID without a query
+        metadata = await run_db(user_metadata.get, assignment.user_id)
+        if metadata is None:
             raise HTTPException(status_code=404, detail="User not found")
 
-        category_doc = category_ref.get()
-        if not category_doc.exists:
-            raise HTTPException(status_code=404, detail="Category not found")
-        
-        # Create a validated assignment using our schema
-        assignment_schema = AssignmentSchema(
-            amount=assignment.amount,
+        if not metadata["unallocated_category_id"]:
+            raise HTTPException(status_code=404, detail="Unallocated funds category not found")
+
+        # Create a validated assignment record
+        assignment_record = AssignmentRecord(
+            amount_cents=amount_cents,
             user_id=assignment.user_id,
             category_id=assignment.category_id,
             date=assignment.date
         )
-        
-        # Find unallocated funds category before starting batch
-        unallocated_query = db.collection("categories").where("user_id", "==", assignment.user_id).where("is_unallocated_funds", "==", True).limit(1)
-        unallocated_docs = unallocated_query.stream()
-        unallocated_category = None
-        for doc in unallocated_docs:
-            unallocated_category = doc
-            break
 
-        if not unallocated_category:
-            raise HTTPException(status_code=404, detail="Unallocated funds category not found")
-
-        # Get current data for calculations
-        unallocated_data = unallocated_category.to_dict()
-        category_data = category_doc.to_dict()
-        
-        current_available = Decimal(str(unallocated_data.get("available", 0.0)))
-        new_available = current_available - assignment.amount
-        
-        current_category_available = Decimal(str(category_data.get("available", 0.0)))
-        new_category_available = current_category_available + assignment.amount
+        uow = UnitOfWork()
 
-        # Use batch write for atomicity
-        batch = db.batch()
-        
         # 1. Create assignment document
-        assignment_ref = db.collection("assignments").document()
-        batch.set(assignment_ref, assignment_schema.to_dict())
+        assignment_ref = repos.assignments.ref(user_id=assignment.user_id)
+        uow.set(assignment_ref, assignment_record.to_dict())
         
         # 2. Update unallocated funds (subtract assignment amount)
-        batch.update(unallocated_category.reference, {"available": float(new_available)})
+        balance_counters.increment(uow, assignment.user_id, metadata["unallocated_category_id"], -amount_cents)
         
         # 3. Update target category (add assignment amount)
-        batch.update(category_ref, {"available": float(new_category_available)})
+        balance_counters.increment(uow, assignment.user_id, assignment.category_id, amount_cents)
         
-        # Execute all writes atomically
-        batch.commit()
+        # Execute all writes atomically (in a batch shared with concurrent requests); the balances are incremented server-side,
+        # so no category read is needed and concurrent writes can't overwrite each other.
+        # They fail as a whole if either category doesn't exist.
+        try:
+            await uow.commit_coalesced()
+        except NotFound:
+            raise HTTPException(status_code=404, detail="Category not found")
 
         # Get user email for logging
-        user_data = user_doc.to_dict()
-        user_email = user_data.get('email', 'Unknown')
+        user_email = metadata.get('email') or 'Unknown'
 
         # Log the assignment
-        assignment_logger.info(f"Assignment created - ID: {assignment_ref.id}, Amount: ${assignment.amount}, Category: '{category_data.get('name', 'Unknown')}' (ID: {assignment.category_id}), New category available: ${new_category_available}, User ID: {assignment.user_id}, User Email: {user_email}")
+        assignment_logger.info(f"Assignment created - ID: {assignment_ref.id}, Amount: ${assignment.amount}, Category ID: {assignment.category_id}, User ID: {assignment.user_id}, User Email: {user_email}")
 
         # logger.info("Assignment created successfully with ID: %s", assignment_ref.id)
         return {"message": "Assignment created successfully.", "assignment_id": assignment_ref.id}
+    except HTTPException:
+        raise
     except Exception as e:
         # logger.error("Failed to create assignment: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to create assignment: %e")
\ No newline at end of file
@@ -0,0 +1,158 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import AlreadyExists, NotFound
+from .db import repos, Increment
+from backend.db.schemas import read_cents
+
+logger = logging.getLogger(__name__)
+
+# Number of counter shards a hot category is split into
+CATEGORY_SHARD_COUNT = int(os.getenv("CATEGORY_SHARD_COUNT", "10"))
+
+# A category is sharded once this process makes more than this many balance updates to it within the window
+SHARD_PROMOTION_WRITES = int(os.getenv("SHARD_PROMOTION_WRITES", "20"))
+SHARD_PROMOTION_WINDOW_SECONDS = float(os.getenv("SHARD_PROMOTION_WINDOW_SECONDS", "10"))
+
+class BalanceCounters:
+    """
+    Category available amounts (in cents), optionally stored as sharded counters.
+
+    A single document only sustains about one write per second, which busy categories (the
+    unallocated funds category, or any category during a Plaid backfill) exceed. A sharded
+    category keeps the `available_cents` field on its document and adds `available_shards` counter
+    documents in a subcollection; its balance is the document's field plus every shard.
+    Increments go to a random shard, so concurrent writes are spread over the shards.
+
+    Because the balance is always the sum of both, writers that don't know a category is
+    sharded (e.g. another process) still produce correct balances by incrementing the
+    document itself. Categories are promoted automatically once this process updates them
+    more than SHARD_PROMOTION_WRITES times within SHARD_PROMOTION_WINDOW_SECONDS; the
+    promotion runs in the background so it never delays a request.
+    """
+
+    def __init__(self, shard_count=CATEGORY_SHARD_COUNT, promotion_writes=SHARD_PROMOTION_WRITES,
+                 promotion_window_seconds=SHARD_PROMOTION_WINDOW_SECONDS):
+        self.shard_count = shard_count
+        self.promotion_writes = promotion_writes
+        self.promotion_window_seconds = promotion_window_seconds
+        self._shard_counts = {}  # category_id -> number of shards, for categories known to be sharded
+        self._recent_writes = defaultdict(deque)  # category_id -> monotonic times of recent updates
+        self._promoting = set()
+        self._lock = threading.Lock()
+        self._promotion_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shard-promotion")
+
+    @property
+    def sharded_categories(self):
+        """IDs of the categories this process knows to be sharded"""
+        with self._lock:
+            return set(self._shard_counts)
+
+    def increment(self, writer, user_id, category_id, delta_cents):
+        """Add `delta_cents` to the user's category's available amount within `writer` (a write batch or unit of work)"""
+        with self._lock:
+            shard_count = self._shard_counts.get(category_id)
+        if shard_count:
+            target_ref = repos.categories.shard_ref(category_id, random.randrange(shard_count), user_id=user_id)
+        else:
+            target_ref = repos.categories.ref(category_id, user_id=user_id)
+            self._record_write(user_id, category_id)
+        writer.update(target_ref, {"available_cents": Increment(int(delta_cents))})
+
+    def remember(self, category_doc):
+        """Learn from a category snapshot whether it is sharded"""
+        shard_count = (category_doc.to_dict() or {}).get("available_shards")
+        if shard_count:
+            with self._lock:
+                self._shard_counts[category_doc.id] = shard_count
+
+    def totals(self, category_docs):
+        """
+        Available amount in cents of each category snapshot, {category_id: int}, summing the shards of
+        sharded categories. All shards are fetched together in one round trip.
+        """
+        totals = {}
+        shard_categories = {}  # shard document path -> category_id
+        shard_refs = []
+        for category_doc in category_docs:
+            category_data = category_doc.to_dict()
+            totals[category_doc.id] = read_cents(category_data, "available")
+            if category_data.get("available_shards"):
+                self.remember(category_doc)
+                for shard_ref in self.shard_refs(category_doc):
+                    shard_categories[shard_ref.path] = category_doc.id
+                    shard_refs.append(shard_ref)
+
+        if shard_refs:
+            for shard_doc in repos.get_all(shard_refs):
+                if shard_doc.exists:
+                    category_id = shard_categories[shard_doc.reference.path]
+                    totals[category_id] += read_cents(shard_doc.to_dict(), "available")
+        return totals
+
+    def total(self, category_doc):
+        return self.totals([category_doc])[category_doc.id]
+
+    def shard_refs(self, category_doc):
+        """References of the category's shard documents (empty if it isn't sharded), e.g. to delete them with it"""
+        category_data = category_doc.to_dict() or {}
+        shard_count = category_data.get("available_shards")
+        return repos.categories.shard_refs(category_doc.id, shard_count, user_id=category_data["user_id"]) if shard_count else []
+
+    def promote(self, user_id, category_id):
+        """
+        Shard a user's category: create zeroed shards and record the shard count on its document in
+        one batch. The existing amount stays on the document, so no balance is moved.
+        """
+        batch = repos.batch()
+        for shard_ref in repos.categories.shard_refs(category_id, self.shard_count, user_id=user_id):
+            batch.create(shard_ref, {"available_cents": 0})
+        batch.update(repos.categories.ref(category_id, user_id=user_id), {"available_shards": self.shard_count})
+        try:
+            batch.commit()
+            shard_count = self.shard_count
+            logger.info(f"Sharded category {category_id} into {shard_count} counters")
+        except AlreadyExists:
+            # Another process sharded it first; use its shard count
+            category_doc = repos.categories.get(category_id, user_id=user_id)
+            shard_count = category_doc.to_dict().get("available_shards") if category_doc.exists else None
+        except NotFound:
+            # Category was deleted
+            shard_count = None
+
+        with self._lock:
+            if shard_count:
+                self._shard_counts[category_id] = shard_count
+            self._promoting.discard(category_id)
+
+    def forget(self, category_id):
+        with self._lock:
+            self._shard_counts.pop(category_id, None)
+            self._recent_writes.pop(category_id, None)
+
+    def _record_write(self, user_id, category_id):
+        now = time.monotonic()
+        with self._lock:
+            writes = self._recent_writes[category_id]
+            writes.append(now)
+            while writes and writes[0] < now - self.promotion_window_seconds:
+                writes.popleft()
+            if len(writes) <= self.promotion_writes or category_id in self._promoting:
+                return
+            self._promoting.add(category_id)
+            del self._recent_writes[category_id]
+        self._promotion_executor.submit(self._promote_in_background, user_id, category_id)
+
+    def _promote_in_background(self, user_id, category_id):
+        try:
+            self.promote(user_id, category_id)
+        except Exception as e:
+            logger.error(f"Failed to shard category {category_id}: {e}")
+            with self._lock:
+                self._promoting.discard(category_id)
+
+balance_counters = BalanceCounters()
@@ -0,0 +1,131 @@
+"""
+Repairs of the category balances the integrity check finds wrong (`api/db_validation_check.py
+--repair`).
+
+Repairs are meant to run against the live database:
+- A category is only corrected when two checks of its user in a row find it wrong the same way,
+  so a balance read while a write was landing isn't "fixed".
+- The correction increments the category's `available_cents` by the difference to the expected
+  amount instead of overwriting it, so transactions and assignments committed between the check
+  and the repair keep their effect.
+- Each correction is committed with its audit record (`balance_repairs`: the stored, expected
+  and corrected amounts), in batches of up to REPAIR_BATCH_CORRECTIONS, paced to a number of
+  corrections per second.
+- An audit record's ID is derived from the state it corrects (the category, its version and
+  its stored and expected amounts) and is created rather than set, so a correction already made
+  by an earlier or concurrent run fails its batch instead of being applied twice; the batch is
+  then retried one correction at a time.
+"""
+import os
+import time
+from datetime import datetime, timezone
+from google.api_core.exceptions import AlreadyExists, NotFound
+from .db import repos, Increment
+from .balance_counters import balance_counters
+from .integrity import load_ledger
+from backend.db.versions import VERSION_FIELD, to_version
+
+# Corrections per batch; each takes 2 writes (3 for dual-write users), within the batch limit of 500
+REPAIR_BATCH_CORRECTIONS = int(os.getenv("REPAIR_BATCH_CORRECTIONS", "100"))
+
+def find_corrections(user_id, user_email=None):
+    """The corrections the user's wrong balances need"""
+    categories = list(repos.categories.for_user(user_id))
+    stored = balance_counters.totals(categories)
+    ledger = load_ledger(user_id)
+    corrections = []
+    for doc in categories:
+        data = doc.to_dict()
+        expected_cents = ledger.expected_available(doc.id, data.get("is_unallocated_funds", False))
+        if stored[doc.id] != expected_cents:
+            corrections.append({
+                "user_id": user_id,
+                "user_email": user_email,
+                "category_id": doc.id,
+                "category_name": data.get("name", "Unknown"),
+                "version": to_version(data[VERSION_FIELD]) if data.get(VERSION_FIELD) else 0,
+                "before_cents": stored[doc.id],
+                "expected_cents": expected_cents,
+                "correction_cents": expected_cents - stored[doc.id],
+            })
+    return corrections
+
+def stable_corrections(user_id, user_email=None):
+    """The corrections found by two checks of the user in a row (the ones both agree on)"""
+    first = find_corrections(user_id, user_email)
+    if not first:
+        return []
+    return [correction for correction in find_corrections(user_id, user_email) if correction in first]
+
+def audit_id(correction):
+    return f"{correction['category_id']}_{correction['version']}_{correction['before_cents']}_{correction['expected_cents']}"
+
+class BalanceRepairer:
+    """
+    Commits corrections in paced batches: `add` them as they are found and `flush` at the end.
+    Both return the corrections of the batches they committed, each with its `status`
+    ("applied", "already_applied", "category_deleted" or "dry_run").
+    """
+
+    def __init__(self, run_id, dry_run=False, max_per_second=50, batch_corrections=REPAIR_BATCH_CORRECTIONS):
+        self.run_id = run_id
+        self.dry_run = dry_run
+        self.max_per_second = max_per_second
+        self.batch_corrections = batch_corrections
+        self._pending = []
+        self._next_commit = 0.0
+
+    def add(self, correction):
+        self._pending.append(correction)
+        if len(self._pending) >= self.batch_corrections:
+            return self.flush()
+        return []
+
+    def flush(self):
+        corrections, self._pending = self._pending, []
+        if not corrections:
+            return []
+        self._pace(len(corrections))
+        if self.dry_run:
+            return [{**correction, "status": "dry_run"} for correction in corrections]
+        try:
+            self._commit(corrections)
+            return [{**correction, "status": "applied"} for correction in corrections]
+        except (AlreadyExists, NotFound):
+            pass
+        # Some were made by another run, or their category was deleted: commit the others one at a time
+        results = []
+        for correction in corrections:
+            try:
+                self._commit([correction])
+                results.append({**correction, "status": "applied"})
+            except AlreadyExists:
+                results.append({**correction, "status": "already_applied"})
+            except NotFound:
+                results.append({**correction, "status": "category_deleted"})
+        return results
+
+    def _pace(self, count):
+        """Wait until committing `count` more corrections keeps under max_per_second"""
+        now = time.monotonic()
+        if self._next_commit > now:
+            time.sleep(self._next_commit - now)
+        self._next_commit = max(now, self._next_commit) + count / self.max_per_second
+
+    def _commit(self, corrections):
+        batch = repos.batch()
+        for correction in corrections:
+            batch.update(repos.categories.ref(correction["category_id"], user_id=correction["user_id"]), {
+                "available_cents": Increment(correction["correction_cents"]),
+            })
+            batch.create(repos.balance_repairs.ref(audit_id(correction)), {
+                "run_id": self.run_id,
+                "user_id": correction["user_id"],
+                "category_id": correction["category_id"],
+                "category_version": correction["version"],
+                "before_cents": correction["before_cents"],
+                "after_cents": correction["expected_cents"],
+                "correction_cents": correction["correction_cents"],
+                "repaired_at": datetime.now(timezone.utc),
+            })
+        batch.commit()
@@ -0,0 +1,229 @@
+"""
+Concurrency stress test for category balances.
+
+The app runs in-process against a local storage backend with every database round trip delayed
+by --latency-ms, so many requests are in flight in the threadpool at once. A handful of users,
+each with a few "hot" categories, receive a burst of concurrent assignments and transactions,
+followed by a burst of concurrent recategorizations, deletions and more assignments (whose
+writes the write coalescer merges unless --no-coalescing is given). With --migrate-layout the
+users are moved to the partitioned layout (api/migrate_user_partitions.py) while the requests
+run, so the balances also check that no write is lost during the migration. Afterwards
+every category's stored available amount is compared with the amount recomputed from its
+transactions and assignments (the same rule as db_validation_check.py, api/integrity.py). Any lost update shows
+up as a mismatch and the script exits with status 1.
+
+Usage (from the backend directory):
+    python api/balance_stress_test.py --users 3 --operations 300
+    python api/balance_stress_test.py --users 3 --operations 300 --no-coalescing
+    python api/balance_stress_test.py --users 3 --operations 300 --migrate-layout
+"""
+import os
+import sys
+import argparse
+import asyncio
+import datetime
+import json
+import random
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+# The stress test creates its own users; it must not run against a real database
+if os.getenv("DB_BACKEND", "memory") == "firestore":
+    sys.exit("The stress test creates its own data; run it with DB_BACKEND=memory or DB_BACKEND=sqlite")
+os.environ.setdefault("DB_BACKEND", "memory")
+
+import httpx
+from api import db_async
+from api.db import repos
+from api.balance_counters import balance_counters
+from api.load_test import add_round_trip_latency
+from api.integrity import check_user
+from api.write_coalescer import write_coalescer
+from api import migrate_user_partitions
+from backend.db.backends import document_store
+
+def count_committed_writes():
+    """Count the batches committed and the documents they write; returns the counts dict, updated in place"""
+    counts = {"batch_commits": 0, "documents_written": 0}
+    original_commit = document_store.WriteBatch.commit
+
+    def commit(self, *args, **kwargs):
+        write_count = len(self._writes)
+        result = original_commit(self, *args, **kwargs)
+        counts["batch_commits"] += 1
+        counts["documents_written"] += write_count
+        return result
+
+    document_store.WriteBatch.commit = commit
+    return counts
+
+async def post(client, path, body, failures):
+    response = await client.post(path, json=body)
+    if response.status_code != 200:
+        failures.append({"path": path, "status": response.status_code, "detail": response.text})
+        return None
+    return response.json()
+
+async def create_budgets(client, user_count, categories_per_user, failures):
+    """Create the users and their categories through the API; returns {user_id: [category_id, ...]}"""
+    budgets = {}
+    for user_index in range(user_count):
+        user_id = f"stress-test-user-{user_index}"
+        await post(client, "/user/create-user", {"email": f"{user_id}@stress-test.local", "user_id": user_id}, failures)
+        category_ids = []
+        for category_index in range(categories_per_user):
+            result = await post(client, "/category/create-category", {"name": f"Hot {category_index}", "user_id": user_id}, failures)
+            category_ids.append(result["category_id"])
+        budgets[user_id] = category_ids
+    return budgets
+
+def random_amount(rng):
+    return round(rng.uniform(1, 100), 2)
+
+async def run_stress_test(app, budgets, operations, seed, migration_propagation_seconds=None):
+    """Run both rounds; returns the failed requests and the migration stats (None without a migration)"""
+    rng = random.Random(seed)
+    failures = []
+    migration = None
+    if migration_propagation_seconds is not None:
+        migration = asyncio.create_task(asyncio.to_thread(
+            migrate_user_partitions.migrate, list(budgets), propagation_seconds=migration_propagation_seconds, finalize=True
+        ))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress-test", timeout=None) as client:
+        # The app's lifespan doesn't run under ASGITransport, so size the threadpool here
+        db_async.configure_threadpool()
+
+        # Round 1: concurrent assignments and new transactions on the same few categories
+        calls = []
+        call_users = []
+        for _ in range(operations):
+            user_id = rng.choice(list(budgets))
+            call_users.append(user_id)
+            category_id = rng.choice(budgets[user_id])
+            if rng.random() < 0.5:
+                calls.append(post(client, "/assignment/create-assignment", {
+                    "amount": random_amount(rng), "user_id": user_id, "category_id": category_id, "date": "2026-01-01"
+                }, failures))
+            else:
+                calls.append(post(client, "/transaction/create-transaction", {
+                    "amount": rng.choice([-1, 1]) * random_amount(rng), "user_id": user_id, "category_id": category_id,
+                    "name": "Stress test transaction", "date": "2026-01-15"
+                }, failures))
+        results = await asyncio.gather(*calls)
+        transaction_ids = {user_id: [] for user_id in budgets}
+        for user_id, result in zip(call_users, results):
+            if result and "transaction_id" in result:
+                transaction_ids[user_id].append(result["transaction_id"])
+
+        # Round 2: each transaction is recategorized, deleted or left alone, alongside more assignments
+        transactions = {
+            doc.id: doc.to_dict()
+            for user_id, user_transaction_ids in transaction_ids.items()
+            for doc in repos.transactions.get_many(user_transaction_ids, user_id=user_id).values()
+        }
+        calls = []
+        for transaction_id, transaction in transactions.items():
+            user_id = transaction["user_id"]
+            choice = rng.random()
+            if choice < 0.4:
+                new_category_id = rng.choice(budgets[user_id] + ["null"])
+                calls.append(post(client, "/transaction/update-transaction-category", {
+                    "transaction_id": transaction_id, "user_id": user_id, "category_id": new_category_id
+                }, failures))
+            elif choice < 0.7:
+                calls.append(post(client, "/transaction/delete-transaction", {
+                    "transaction_id": transaction_id, "user_id": user_id
+                }, failures))
+            else:
+                calls.append(post(client, "/assignment/create-assignment", {
+                    "amount": random_amount(rng), "user_id": user_id, "category_id": rng.choice(budgets[user_id]), "date": "2026-01-02"
+                }, failures))
+        await asyncio.gather(*calls)
+
+    return failures, (await migration if migration else None)
+
+def check_balances(budgets):
+    """Compare every category's stored available amount with the recomputed one; returns the mismatches"""
+    mismatches = []
+    categories_checked = 0
+    for user_id in budgets:
+        result = check_user(user_id)
+        categories_checked += result["categories"]
+        mismatches += [
+            {key: issue[key] for key in ("user_id", "category_id", "category_name", "stored_available", "expected_available")}
+            for issue in result["issues"]
+        ]
+    return categories_checked, mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check category balances stay correct under concurrent writes")
+    parser.add_argument("--users", type=int, default=3, help="Number of users")
+    parser.add_argument("--categories", type=int, default=3, help="Categories per user (few, so they are contended)")
+    parser.add_argument("--operations", type=int, default=300, help="Concurrent assignments and transactions in the first round")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Simulated database round trip latency")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated operations")
+    parser.add_argument("--no-coalescing", action="store_true", help="Commit each request's writes on its own")
+    parser.add_argument("--migrate-layout", action="store_true", help="Move the users to the partitioned layout during the test")
+    parser.add_argument("--propagation-seconds", type=float, default=1, help="Wait after each layout switch of the migration")
+    args = parser.parse_args()
+
+    if args.no_coalescing:
+        write_coalescer.window_seconds = 0
+
+    import main
+
+    async def setup():
+        failures = []
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://stress-test", timeout=None) as client:
+            budgets = await create_budgets(client, args.users, args.categories, failures)
+        return budgets, failures
+
+    print(f"Creating {args.users} users with {args.categories} categories each...")
+    budgets, setup_failures = asyncio.run(setup())
+    if setup_failures:
+        sys.exit(f"Setup failed: {setup_failures[0]}")
+
+    add_round_trip_latency(args.latency_ms / 1000)
+    commit_counts = count_committed_writes()
+    print(f"Running {args.operations} concurrent operations ({args.latency_ms}ms simulated latency)...")
+    failures, migration = asyncio.run(run_stress_test(
+        main.app, budgets, args.operations, args.seed, args.propagation_seconds if args.migrate_layout else None
+    ))
+    categories_checked, mismatches = check_balances(budgets)
+
+    print(f"  Failed requests: {len(failures)}")
+    print(f"  Documents written: {commit_counts['documents_written']} in {commit_counts['batch_commits']} batch commits")
+    print(f"  Categories sharded during the test: {len(balance_counters.sharded_categories)}")
+    if migration:
+        print(f"  Users moved to the partitioned layout: {len(migration['finalized'])} of {migration['users']} "
+              f"({migration['copied']} documents copied, {migration['repaired_writes']} repair writes)")
+    print(f"  Categories checked: {categories_checked}, mismatched: {len(mismatches)}")
+    for mismatch in mismatches:
+        print(f"    {mismatch['category_name']} ({mismatch['category_id']}): stored {mismatch['stored_available']}, expected {mismatch['expected_available']}")
+
+    # Save results to a JSON file with timestamp in the load_tests folder
+    timestamp = datetime.datetime.now()
+    load_tests_dir = 'load_tests'
+    os.makedirs(load_tests_dir, exist_ok=True)
+    filepath = os.path.join(load_tests_dir, f'balance_stress_test_{timestamp.strftime("%Y%m%d_%H%M%S")}.json')
+    with open(filepath, 'w') as json_file:
+        json.dump({
+            "stress_test_timestamp": timestamp.isoformat(),
+            "settings": vars(args),
+            "failed_requests": failures,
+            "commits": commit_counts,
+            "layout_migration": migration,
+            "categories_checked": categories_checked,
+            "mismatches": mismatches
+        }, json_file, indent=4)
+
+    print(f"\nDetailed results saved to: {filepath}")
+    sys.exit(1 if failures or mismatches or (migration and migration["unverified"]) else 0)
@@ -0,0 +1,62 @@
+import os
+import time
+import random
+import logging
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import AlreadyExists
+
+logger = logging.getLogger(__name__)
+
+# Number of batches committed at the same time during large syncs
+COMMIT_PARALLELISM = int(os.getenv("SYNC_COMMIT_PARALLELISM", "8"))
+COMMIT_MAX_ATTEMPTS = 4
+COMMIT_BASE_DELAY_SECONDS = 0.5
+
+# Outcome of committing one batch: whether it was committed, how many attempts it took and the total seconds spent
+CommitResult = namedtuple("CommitResult", ["committed", "attempts", "seconds"])
+
+def commit_with_retry(batch, label="batch", max_attempts=COMMIT_MAX_ATTEMPTS, base_delay=COMMIT_BASE_DELAY_SECONDS):
+    """
+    Commit a write batch, retrying failures with exponential backoff and jitter.
+
+    Batches are expected to `create` their new documents. If an attempt fails after the server
+    already applied the batch (e.g. a timeout on the response), the replay is rejected with
+    AlreadyExists, which is treated as success, so balance increments are never applied twice.
+    Returns a CommitResult.
+    """
+    start = time.perf_counter()
+    for attempt in range(1, max_attempts + 1):
+        try:
+            batch.commit()
+            return CommitResult(True, attempt, time.perf_counter() - start)
+        except AlreadyExists as e:
+            if attempt > 1:
+                logger.info("%s was already applied by an earlier attempt", label)
+                return CommitResult(True, attempt, time.perf_counter() - start)
+            logger.error("❌ %s failed: %s", label, e)
+            return CommitResult(False, attempt, time.perf_counter() - start)
+        except Exception as e:
+            if attempt == max_attempts:
+                logger.error("❌ %s failed after %d attempts: %s", label, attempt, e)
+                return CommitResult(False, attempt, time.perf_counter() - start)
+            delay = base_delay * (2 ** (attempt - 1)) * (1 + random.random() / 2)
+            logger.warning("⚠️ %s failed (attempt %d/%d), retrying in %.2fs: %s", label, attempt, max_attempts, delay, e)
+            time.sleep(delay)
+
+def commit_batches(batches, parallelism=COMMIT_PARALLELISM):
+    """
+    Commit independent write batches concurrently with at most `parallelism` in flight.
+    Returns one CommitResult per batch, in order.
+    """
+    if len(batches) <= 1 or parallelism <= 1:
+        return [commit_with_retry(batch, f"Batch {i + 1}/{len(batches)}") for i, batch in enumerate(batches)]
+
+    with ThreadPoolExecutor(max_workers=min(parallelism, len(batches))) as executor:
+        # Each commit runs in a copy of the caller's context so per-request instrumentation still applies
+        futures = [
+            executor.submit(contextvars.copy_context().run, commit_with_retry, batch, f"Batch {i + 1}/{len(batches)}")
+            for i, batch in enumerate(batches)
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from decimal import Decimal
+from typing import Optional
+from .db import repos
+from .db_async import run_db, fetch
+from backend.db.schemas import CategorizationRule as CategorizationRuleSchema
+
+router = APIRouter()
+
+# Request models
+class CreateCategorizationRuleRequest(BaseModel):
+    user_id: str
+    category_id: str
+    merchant_name: Optional[str] = None
+    name_contains: Optional[str] = None
+    name_regex: Optional[str] = None
+    personal_finance_category: Optional[str] = None
+    min_amount: Optional[Decimal] = None
+    max_amount: Optional[Decimal] = None
+    priority: int = 0
+
+class DeleteCategorizationRuleRequest(BaseModel):
+    rule_id: str
+    user_id: str
+
+class UserIDRequest(BaseModel):
+    user_id: str
+
+@router.post("/create-categorization-rule")
+async def create_categorization_rule(request: CreateCategorizationRuleRequest):
+    """Create a rule that categorizes matching transactions during Plaid sync"""
+    try:
+        # Verify the category exists and belongs to the user
+        category_doc = await run_db(lambda: repos.categories.get(request.category_id, user_id=request.user_id))
+        if not category_doc.exists:
+            raise HTTPException(status_code=404, detail="Category not found")
+        if category_doc.to_dict().get("user_id") != request.user_id:
+            raise HTTPException(status_code=403, detail="Not authorized to use this category")
+
+        # Create a validated rule using our schema
+        rule = CategorizationRuleSchema(**request.model_dump())
+
+        rule_ref = await run_db(repos.categorization_rules.create, rule.to_dict())
+
+        return {"message": "Categorization rule created successfully.", "rule_id": rule_ref.id}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # This will catch validation errors from the Pydantic model
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create categorization rule: {str(e)}")
+
+@router.post("/get-categorization-rules")
+async def get_categorization_rules(request: UserIDRequest):
+    """Get all categorization rules for a user"""
+    try:
+        rules = []
+        for doc in await fetch(repos.categorization_rules.for_user, request.user_id):
+            rule_data = doc.to_dict()
+            rule_data["id"] = doc.id
+            rules.append(rule_data)
+
+        rules.sort(key=lambda rule: rule.get("priority", 0))
+        return {"categorization_rules": rules}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get categorization rules: {str(e)}")
+
+@router.post("/delete-categorization-rule")
+async def delete_categorization_rule(request: DeleteCategorizationRuleRequest):
+    """Delete a categorization rule"""
+    try:
+        rule_ref = repos.categorization_rules.ref(request.rule_id)
+        rule_doc = await run_db(rule_ref.get)
+
+        if not rule_doc.exists:
+            raise HTTPException(status_code=404, detail="Categorization rule not found")
+        if rule_doc.to_dict().get("user_id") != request.user_id:
+            raise HTTPException(status_code=403, detail="Not authorized to delete this categorization rule")
+
+        await run_db(rule_ref.delete)
+        return {"message": "Categorization rule deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to delete categorization rule: {str(e)}")
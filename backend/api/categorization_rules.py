@@ -0,0 +1,157 @@
+import re
+from collections import deque
+from .db import repos
+from backend.db.schemas import to_cents, read_cents
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton for finding every pattern contained in a text in a single pass.
+    Each pattern carries a payload; `find` returns the payloads of all patterns found.
+    """
+
+    def __init__(self, patterns):
+        # Each node is (transitions, failure link, payloads ending here)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern, payload in patterns:
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append(payload)
+
+        # Breadth-first pass to build failure links and merge outputs
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                if node == 0:
+                    # Children of the root always fall back to the root
+                    self.fail[child] = 0
+                else:
+                    fallback = self.fail[node]
+                    while fallback and char not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            if self.output[node]:
+                found.update(self.output[node])
+        return found
+
+class CompiledRuleSet:
+    """
+    A user's categorization rules compiled into lookup tables and an Aho-Corasick automaton.
+
+    Each rule is indexed under its most selective condition (merchant name, personal finance
+    category, name substring, name regex, then amount range only). Matching a transaction
+    collects candidate rules from the indexes and checks the remaining conditions of the
+    candidates in priority order, so the cost per transaction does not grow with the number
+    of rules that cannot match it.
+    """
+
+    def __init__(self, rules):
+        # Sort once so the first fully matching candidate is the winning rule
+        self.rules = sorted(rules, key=lambda rule: (rule.get("priority", 0), str(rule.get("created_at", ""))))
+        self.category_ids = {rule["category_id"] for rule in self.rules}
+        self.regexes = {}
+        self.by_merchant = {}
+        self.by_finance_category = {}
+        self.regex_rules = []
+        self.amount_only_rules = []
+        self.amount_ranges = {}  # rule index -> (min, max) in cents, either may be None
+        substring_patterns = []
+
+        for index, rule in enumerate(self.rules):
+            if rule.get("min_amount") is not None or rule.get("max_amount") is not None:
+                self.amount_ranges[index] = tuple(
+                    to_cents(rule[field]) if rule.get(field) is not None else None for field in ("min_amount", "max_amount")
+                )
+
+            if rule.get("name_regex"):
+                self.regexes[index] = re.compile(rule["name_regex"], re.IGNORECASE)
+
+            if rule.get("merchant_name"):
+                self.by_merchant.setdefault(rule["merchant_name"].lower(), []).append(index)
+            elif rule.get("personal_finance_category"):
+                self.by_finance_category.setdefault(rule["personal_finance_category"].upper(), []).append(index)
+            elif rule.get("name_contains"):
+                substring_patterns.append((rule["name_contains"].lower(), index))
+            elif rule.get("name_regex"):
+                self.regex_rules.append(index)
+            elif index in self.amount_ranges:
+                self.amount_only_rules.append(index)
+            # A rule without any condition set (e.g. only blank ones) never matches
+
+        self.substrings = AhoCorasick(substring_patterns) if substring_patterns else None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _rule_matches(self, index, name, merchant_name, finance_categories, amount_cents):
+        rule = self.rules[index]
+        if rule.get("merchant_name") and rule["merchant_name"].lower() != merchant_name:
+            return False
+        if rule.get("personal_finance_category") and rule["personal_finance_category"].upper() not in finance_categories:
+            return False
+        if rule.get("name_contains") and rule["name_contains"].lower() not in name:
+            return False
+        if index in self.regexes and not self.regexes[index].search(name):
+            return False
+        if index in self.amount_ranges:
+            min_cents, max_cents = self.amount_ranges[index]
+            if min_cents is not None and amount_cents < min_cents:
+                return False
+            if max_cents is not None and amount_cents > max_cents:
+                return False
+        return True
+
+    def match(self, transaction):
+        """Return the category_id of the highest priority rule matching a transaction dictionary, or None"""
+        if not self.rules:
+            return None
+
+        name = (transaction.get("name") or "").lower()
+        merchant_name = (transaction.get("merchant_name") or "").lower()
+        finance_category = transaction.get("personal_finance_category") or {}
+        finance_categories = {
+            value.upper() for value in (finance_category.get("primary"), finance_category.get("detailed")) if value
+        }
+        amount_cents = abs(read_cents(transaction, "amount"))
+
+        candidates = set(self.amount_only_rules)
+        candidates.update(self.by_merchant.get(merchant_name, []))
+        for value in finance_categories:
+            candidates.update(self.by_finance_category.get(value, []))
+        if self.substrings:
+            candidates.update(self.substrings.find(name))
+        candidates.update(index for index in self.regex_rules if self.regexes[index].search(name))
+
+        for index in sorted(candidates):
+            if self._rule_matches(index, name, merchant_name, finance_categories, amount_cents):
+                return self.rules[index]["category_id"]
+        return None
+
+def load_rule_set(user_id):
+    """Fetch a user's categorization rules and compile them, dropping rules whose category no longer exists"""
+    rules = [doc.to_dict() for doc in repos.categorization_rules.for_user(user_id)]
+    if rules:
+        existing_categories = repos.categories.get_many((rule["category_id"] for rule in rules), user_id=user_id)
+        rules = [rule for rule in rules if rule["category_id"] in existing_categories]
+    return CompiledRuleSet(rules)
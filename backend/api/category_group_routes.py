@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from datetime import datetime, timezone
-from .db import db
+from .db import repos
+from .db_async import run_db, fetch, gather_db
 from backend.db.schemas import CategoryGroup as CategoryGroupSchema
 
 router = APIRouter()
@@ -42,12 +43,12 @@ async def create_category_group(request: CreateCategoryGroupRequest):
             sort_order=request.sort_order
         )
         
-        # Add to Firestore
-        doc_ref = db.collection(CategoryGroupSchema.collection_name()).add(category_group.to_dict())
+        # Add to the database
+        doc_ref = await run_db(repos.category_groups.create, category_group.to_dict())
         
         return {
             "message": "Category group created successfully",
-            "category_group_id": doc_ref[1].id
+            "category_group_id": doc_ref.id
         }
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -59,11 +60,8 @@ async def get_category_groups_by_user(request: UserIDRequest):
     """Get all category groups for a user"""
     try:
         # Query category groups by user_id
-        category_groups_ref = db.collection(CategoryGroupSchema.collection_name())
-        query = category_groups_ref.where("user_id", "==", request.user_id).order_by("sort_order")
-        
         category_groups = []
-        for doc in query.stream():
+        for doc in await fetch(repos.category_groups.for_user, request.user_id):
             category_group_data = doc.to_dict()
             category_group_data["id"] = doc.id
             category_groups.append(CategoryGroupResponse(**category_group_data))
@@ -77,8 +75,12 @@ async def delete_category_group(request: DeleteCategoryGroupRequest):
     """Delete a category group"""
     try:
         # Check if category group exists
-        doc_ref = db.collection(CategoryGroupSchema.collection_name()).document(request.category_group_id)
-        doc = doc_ref.get()
+        doc_ref = repos.category_groups.ref(request.category_group_id, user_id=request.user_id)
+        # Fetch the group and check whether any categories are still assigned to it concurrently
+        doc, group_in_use = await gather_db(
+            doc_ref.get,
+            lambda: repos.categories.any_in_group(request.user_id, request.category_group_id)
+        )
         
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Category group not found")
@@ -88,18 +90,14 @@ async def delete_category_group(request: DeleteCategoryGroupRequest):
         if category_group_data.get("user_id") != request.user_id:
             raise HTTPException(status_code=403, detail="Not authorized to delete this category group")
         
-        # Check if any categories are still assigned to this group
-        categories_ref = db.collection("categories")
-        categories_with_group = categories_ref.where("group_id", "==", request.category_group_id).limit(1).stream()
-        
-        if any(categories_with_group):
+        if group_in_use:
             raise HTTPException(
                 status_code=400, 
                 detail="Cannot delete category group: categories are still assigned to this group"
             )
         
         # Delete the category group
-        doc_ref.delete()
+        await run_db(doc_ref.delete)
         
         return {"message": "Category group deleted successfully"}
     except HTTPException:
@@ -111,8 +109,8 @@ async def delete_category_group(request: DeleteCategoryGroupRequest):
 async def get_category_group(request: GetCategoryGroupRequest):
     """Get a specific category group by ID"""
     try:
-        doc_ref = db.collection(CategoryGroupSchema.collection_name()).document(request.category_group_id)
-        doc = doc_ref.get()
+        doc_ref = repos.category_groups.ref(request.category_group_id, user_id=request.user_id)
+        doc = await run_db(doc_ref.get)
         
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Category group not found")
@@ -1,10 +1,15 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from collections import defaultdict
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal
 from typing import Optional
-from .db import db
-from backend.db.schemas import Category as CategorySchema
+from .db import repos, DELETE_FIELD
+from .db_async import run_db, fetch, gather_db
+from .user_metadata import user_metadata
+from .balance_counters import balance_counters
+from backend.db.schemas import Category as CategorySchema, to_cents, from_cents, read_cents, dollar_amounts
+from backend.db.layouts import write_count
 
 router = APIRouter()
 
@@ -63,14 +68,19 @@ async def get_categories(request: UserIDRequest):
         
         # Query categories with a `user` field equal to `user_ref`
         # logger.info("Querying categories for user_ref: %s", request.user_id)
-        categories_query = db.collection("categories").where("user_id", "==", request.user_id)
-        categories_docs = categories_query.stream()
+        categories_docs = await fetch(repos.categories.for_user, request.user_id)
+        # Available amounts, including the counter shards of sharded categories (one read for all shards)
+        available = await run_db(balance_counters.totals, categories_docs)
 
         # Collect categories into a list, converting each document to a dictionary
         categories = []
         for doc in categories_docs:
             category_data = doc.to_dict()
             category_data["id"] = doc.id  # Add the category ID to the response
+            category_data = dollar_amounts(category_data, "goal_amount")  # Stored in cents, returned in dollars
+            category_data["available"] = from_cents(available[doc.id])
+            category_data.pop("available_cents", None)
+            category_data.pop("available_shards", None)
             
             # Remove or handle any unserializable fields here, if necessary
             
@@ -86,153 +96,69 @@ async def get_categories(request: UserIDRequest):
 
 @router.post("/get-allocated-and-spent")
 async def get_allocated_and_spent(request: CategoriesWithAllocatedRequest):
-    try:        # Debug request information
-        # print(f"DEBUG - get-allocated-and-spent called with user_id: {request.user_id}")
-        # print(f"DEBUG - Start date: {request.start_date}")
-        # print(f"DEBUG - End date: {request.end_date}")
-        
-        # Query categories with a `user_id` field equal to `request.user_id`
-        categories_query = db.collection("categories").where("user_id", "==", request.user_id)
-        categories_docs = categories_query.stream()
-        
-        # print(f"DEBUG - Categories query: {categories_query._query.to_dict()}")
-        
-        # Count categories for debugging
-        category_count = 0
-        
-        # Collect categories into a list, converting each document to a dictionary
-        allocated_and_spent = []
-        for doc in categories_docs:
-            category_count += 1
-            category_data = doc.to_dict()
-            # print(f"DEBUG - Processing category: {doc.id}, name: {category_data.get('name', 'Unknown')}")
-            
-            category_result = {}
-            category_result["category_id"] = doc.id  # Add the category ID to the response
-            
-            # Calculate allocated amount for the category
-            # Using helper function to get the next day for inclusive end date
-            next_day_str = get_next_day_str(request.end_date)
-            assignments_query = db.collection("assignments").where("category_id", "==", doc.id).where("date", ">=", request.start_date).where("date", "<", next_day_str)
-            # print(f"DEBUG - Using date range: {request.start_date} to {request.end_date} (exclusive upper bound: {next_day_str})")
+    try:
+        # Using helper function to get the next day for inclusive end date
+        next_day_str = get_next_day_str(request.end_date)
 
-            # Try to catch any issues with the stream operation
-            try:
-                # print(f"DEBUG - About to stream assignments for category {doc.id}")
-                assignments_docs = assignments_query.stream()
-                # print(f"DEBUG - Stream operation completed for category {doc.id}")
-                
-                # Count assignments for debugging
-                assignment_count = 0
-                assignment_total = Decimal('0.0')
-                
-                for assignment in assignments_docs:
-                    assignment_count += 1
-                    assignment_data = assignment.to_dict()
-                    # print(f"DEBUG - Assignment found: {assignment_data}")
-                    amount = Decimal(str(assignment_data.get("amount", 0.0)))
-                    assignment_total += amount
-                    # print(f"DEBUG - Running total: {assignment_total}")
-                
-                # print(f"DEBUG - Found {assignment_count} assignments for category {doc.id}")
-                allocated_amount = float(assignment_total)
-                
-            except Exception as stream_error:
-                # print(f"DEBUG - Error streaming assignments: {str(stream_error)}")
-                # Fallback to ensure we continue processing
-                allocated_amount = 0.0
-                
-            category_result["allocated"] = allocated_amount
+        # Archive blocks are only read when the period reaches the user's archived months (cached user metadata)
+        metadata = await run_db(user_metadata.get, request.user_id)
+        archived_through = (metadata or {}).get("archived_through")
 
-            # Calculate spent amount for the category (transactions in the time period)
-            spent_amount = Decimal('0.0')
-            try:
-                # Skip spending calculation for unallocated funds category
-                if not category_data.get("is_unallocated_funds", False):
-                    transactions_query = db.collection("transactions").where("category_id", "==", doc.id).where("date", ">=", request.start_date).where("date", "<", next_day_str)
-                    transactions_docs = transactions_query.stream()
-                    
-                    for transaction in transactions_docs:
-                        transaction_data = transaction.to_dict()
-                        amount = Decimal(str(transaction_data.get("amount", 0.0)))
-                        # If amount is negative, it's spending (add to total)
-                        # If amount is positive, it's a refund/return (subtract from total)
-                        if amount < 0:
-                            spent_amount += abs(amount)
-                        else:
-                            spent_amount -= amount
-                    
-                    # Allow negative spent amounts (when refunds exceed spending)
-                    
-            except Exception as spent_error:
-                # print(f"DEBUG - Error calculating spent amount: {str(spent_error)}")
-                spent_amount = Decimal('0.0')
-            
-            category_result["spent"] = float(spent_amount)
-            allocated_and_spent.append(category_result)
+        # One query per collection for the whole period, summed per category (instead of a query per category)
+        categories_docs, assignments, transactions = await gather_db(
+            lambda: list(repos.categories.for_user(request.user_id)),
+            lambda: list(repos.assignments.in_range(request.user_id, request.start_date, next_day_str)),
+            lambda: list(repos.transactions.in_range(request.user_id, request.start_date, next_day_str, archived_through=archived_through)),
+        )
+        allocated = defaultdict(int)
+        for assignment in assignments:
+            allocated[assignment.get("category_id")] += read_cents(assignment.to_dict(), "amount")
+        transaction_sums = defaultdict(int)
+        for transaction in transactions:
+            transaction_sums[transaction.get("category_id")] += read_cents(transaction.to_dict(), "amount")
+
+        # Collect categories into a list with their allocated and spent amounts
+        allocated_and_spent = []
+        unallocated_income = 0
+        for doc in categories_docs:
+            if doc.to_dict().get("is_unallocated_funds", False):
+                # No spending for the unallocated funds category; its transactions are income (should be positive)
+                spent_cents = 0
+                unallocated_income = transaction_sums[doc.id]
+            else:
+                # Negative amounts are spending and positive ones refunds/returns, so spending is the negated sum
+                # (negative when refunds exceed spending)
+                spent_cents = -transaction_sums[doc.id]
+            allocated_and_spent.append({
+                "category_id": doc.id,  # Add the category ID to the response
+                "allocated": from_cents(allocated[doc.id]),
+                "spent": from_cents(spent_cents)
+            })
 
-        # print(f"DEBUG - Processed {category_count} categories, returning {len(allocated_and_spent)} allocation records")
-        
-        # Calculate unallocated funds (sum of transactions in unallocated funds category)
-        unallocated_income = Decimal('0.0')
-        try:
-            # Find the unallocated funds category for this user
-            unallocated_query = db.collection("categories").where("user_id", "==", request.user_id).where("is_unallocated_funds", "==", True).limit(1)
-            unallocated_docs = unallocated_query.stream()
-            
-            unallocated_category = None
-            for doc in unallocated_docs:
-                unallocated_category = doc
-                break
-            
-            if unallocated_category:
-                # Get transactions for the unallocated funds category within the date range
-                next_day_str = get_next_day_str(request.end_date)
-                unallocated_transactions_query = db.collection("transactions").where("category_id", "==", unallocated_category.id).where("date", ">=", request.start_date).where("date", "<", next_day_str)
-                unallocated_transactions_docs = unallocated_transactions_query.stream()
-                
-                # Sum up the transaction amounts (income should be positive)
-                for transaction in unallocated_transactions_docs:
-                    transaction_data = transaction.to_dict()
-                    amount = Decimal(str(transaction_data.get("amount", 0.0)))
-                    unallocated_income += amount
-                    
-        except Exception as unallocated_error:
-            # Don't fail the entire request if unallocated funds calculation fails
-            print(f"DEBUG - Error calculating unallocated funds: {str(unallocated_error)}")
-            unallocated_income = Decimal('0.0')
-        
-        # Debug the final result structure before returning
-        # print(f"DEBUG - Final response structure: {{'allocated_and_spent': {allocated_and_spent}, 'unallocated_income': {unallocated_income}}}")
-        
         # logger.info("Successfully fetched allocated amounts and spent amounts for user_id: %s", request.user_id)
-        return {"allocated_and_spent": allocated_and_spent, "unallocated_income": float(unallocated_income)}
+        return {"allocated_and_spent": allocated_and_spent, "unallocated_income": from_cents(unallocated_income)}
     
     except Exception as e:
-        # print(f"DEBUG - Exception in get-allocated-and-spent: {str(e)}")
-        # print(f"DEBUG - Exception type: {type(e)}")
         # logger.error("Failed to get categories with allocated and spent amounts for user_id: %s, error: %s", request.user_id, e)
         raise HTTPException(status_code=500, detail=f"Failed to get categories with allocated and spent amounts: {str(e)}")
 
 @router.post("/create-category")
 async def create_category(category: Category):
     try:
-        user_ref = db.collection("users").document(category.user_id)
-        user_doc = user_ref.get()
-        if not user_doc.exists:
+        if await run_db(user_metadata.get, category.user_id) is None:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Create a validated category using our schema
         category_data = CategorySchema(
             name=category.name,
             user_id=category.user_id,
-            available=0.0,
+            available_cents=0,
             is_unallocated_funds=False
         )
         
         # logger.info("Creating a new category with name: %s", category.name)
-        category_ref = db.collection("categories").document()
-        category_ref.set(category_data.to_dict())
+        category_ref = repos.categories.ref(user_id=category.user_id)
+        await run_db(category_ref.set, category_data.to_dict())
         
         # logger.info("Category created successfully with ID: %s", category_ref.id)
         return {"message": "Category created successfully.", "category_id": category_ref.id}
@@ -247,8 +173,8 @@ async def create_category(category: Category):
 async def update_category_name(request: UpdateCategoryNameRequest):
     try:
         # Verify the category exists and belongs to the user
-        category_ref = db.collection("categories").document(request.category_id)
-        category_doc = category_ref.get()
+        category_ref = repos.categories.ref(request.category_id, user_id=request.user_id)
+        category_doc = await run_db(category_ref.get)
         
         if not category_doc.exists:
             raise HTTPException(status_code=404, detail="Category not found")
@@ -258,7 +184,7 @@ async def update_category_name(request: UpdateCategoryNameRequest):
             raise HTTPException(status_code=403, detail="Not authorized to update this category")
         
         # Update the category name
-        category_ref.update({"name": request.name})
+        await run_db(category_ref.update, {"name": request.name})
         
         return {"message": "Category name updated successfully"}
     
@@ -271,8 +197,8 @@ async def update_category_name(request: UpdateCategoryNameRequest):
 async def update_category_goal(request: UpdateCategoryGoalRequest):
     try:
         # Verify the category exists and belongs to the user
-        category_ref = db.collection("categories").document(request.category_id)
-        category_doc = category_ref.get()
+        category_ref = repos.categories.ref(request.category_id, user_id=request.user_id)
+        category_doc = await run_db(category_ref.get)
         
         if not category_doc.exists:
             raise HTTPException(status_code=404, detail="Category not found")
@@ -286,8 +212,11 @@ async def update_category_goal(request: UpdateCategoryGoalRequest):
             raise HTTPException(status_code=400, detail="Goal amount cannot be negative")
         
         # Update the category goal amount
-        goal_amount = None if request.goal_amount == 0 else float(request.goal_amount)
-        category_ref.update({"goal_amount": goal_amount})
+        goal_amount_cents = None if request.goal_amount == 0 else to_cents(request.goal_amount)
+        await run_db(category_ref.update, {
+            "goal_amount_cents": goal_amount_cents,
+            "goal_amount": DELETE_FIELD  # Legacy float goal of documents not migrated yet
+        })
         
         return {"message": "Category goal updated successfully"}
     
@@ -300,8 +229,13 @@ async def update_category_goal(request: UpdateCategoryGoalRequest):
 async def update_category_group(request: UpdateCategoryGroupRequest):
     try:
         # Verify the category exists and belongs to the user
-        category_ref = db.collection("categories").document(request.category_id)
-        category_doc = category_ref.get()
+        category_ref = repos.categories.ref(request.category_id, user_id=request.user_id)
+        # Fetch the category and the requested group (if any) concurrently
+        group_ref = repos.category_groups.ref(request.group_id, user_id=request.user_id) if request.group_id else None
+        category_doc, group_doc = await gather_db(
+            category_ref.get,
+            lambda: group_ref.get() if group_ref else None
+        )
         
         if not category_doc.exists:
             raise HTTPException(status_code=404, detail="Category not found")
@@ -312,9 +246,6 @@ async def update_category_group(request: UpdateCategoryGroupRequest):
         
         # If group_id is provided, verify it exists and belongs to the user
         if request.group_id:
-            group_ref = db.collection("category_groups").document(request.group_id)
-            group_doc = group_ref.get()
-            
             if not group_doc.exists:
                 raise HTTPException(status_code=404, detail="Category group not found")
                 
@@ -323,7 +254,7 @@ async def update_category_group(request: UpdateCategoryGroupRequest):
                 raise HTTPException(status_code=403, detail="Not authorized to use this category group")
         
         # Update the category group
-        category_ref.update({"group_id": request.group_id})
+        await run_db(category_ref.update, {"group_id": request.group_id})
         
         return {"message": "Category group updated successfully"}
     
@@ -332,12 +263,29 @@ async def update_category_group(request: UpdateCategoryGroupRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update category group: {str(e)}")
 
+def delete_in_batches(references):
+    """Delete the documents in order, in as few batches as they fit in (tombstones and dual writes included)"""
+    batch, batch_writes = repos.batch(), 0
+    for reference in references:
+        writes = write_count(reference, "delete")
+        if batch_writes + writes > repos.max_batch_writes:
+            batch.commit()
+            batch, batch_writes = repos.batch(), 0
+        batch.delete(reference)
+        batch_writes += writes
+    batch.commit()
+
 @router.post("/delete-category")
 async def delete_category(request: DeleteCategoryRequest):
     try:
         # Verify the category exists and belongs to the user
-        category_ref = db.collection("categories").document(request.category_id)
-        category_doc = category_ref.get()
+        category_ref = repos.categories.ref(request.category_id, user_id=request.user_id)
+        # Fetch the category, whether any transactions use it and its assignments concurrently
+        category_doc, has_transactions, assignments = await gather_db(
+            category_ref.get,
+            lambda: repos.transactions.any_for_category(request.user_id, request.category_id),
+            lambda: list(repos.assignments.for_category(request.user_id, request.category_id))
+        )
         
         if not category_doc.exists:
             raise HTTPException(status_code=404, detail="Category not found")
@@ -347,33 +295,22 @@ async def delete_category(request: DeleteCategoryRequest):
             raise HTTPException(status_code=403, detail="Not authorized to delete this category")
         
         # Check if any transactions use this category
-        transactions_query = db.collection("transactions").where("category_id", "==", request.category_id)
-        transactions = list(transactions_query.stream())
-        
-        if transactions:
+        if has_transactions:
             raise HTTPException(status_code=400, detail="Cannot delete category with associated transactions")
         
         # Check if category has non-zero available amount
-        available_amount = category_data.get("available", 0.0)
+        available_amount = await run_db(balance_counters.total, category_doc)
         if available_amount != 0:
             raise HTTPException(status_code=400, detail="Cannot delete category with non-zero available amount. Please allocate or move the funds first.")
         
-        # Delete all assignments associated with this category
-        assignments_query = db.collection("assignments").where("category_id", "==", request.category_id)
-        assignments = list(assignments_query.stream())
-        
-        # Use batch write for atomicity
-        batch = db.batch()
-        
-        # Delete each assignment
-        for assignment_doc in assignments:
-            batch.delete(assignment_doc.reference)
-        
-        # Delete the category
-        batch.delete(category_ref)
-        
-        # Execute all deletions atomically
-        batch.commit()
+        # Delete all assignments associated with this category, then the category and its counter
+        # shards if it is sharded. Every delete also writes a tombstone, so many assignments take
+        # several batches; the category is deleted in the last one, so a deletion that fails
+        # partway can be retried to finish it
+        references = [repos.assignments.ref(assignment_doc.id, user_id=request.user_id) for assignment_doc in assignments]
+        references += list(balance_counters.shard_refs(category_doc)) + [category_ref]
+        await run_db(delete_in_batches, references)
+        balance_counters.forget(request.category_id)
         return {"message": "Category deleted successfully"}
     
     except HTTPException as e:
@@ -0,0 +1,347 @@
+import os
+import asyncio
+import logging
+import threading
+from functools import partial
+from datetime import datetime, timezone
+from .db import repos
+from .user_metadata import user_metadata
+from backend.db.layouts import read_layout
+from backend.db.archive import month_of
+from backend.db.schemas import from_cents, read_cents, dollar_amounts
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per connection; a client that falls further behind is told to resync instead
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "1000"))
+
+# Listeners that must deliver their first snapshot before a feed is ready
+INITIAL_WATCHES = ("categories", "transactions", "sync_runs")
+
+def category_payload(category_id, data, available_cents):
+    """A category as returned by get-categories: amounts in dollars, shards summed into `available`"""
+    payload = dollar_amounts(data, "goal_amount")
+    payload["id"] = category_id
+    payload["available"] = from_cents(available_cents)
+    payload.pop("available_cents", None)
+    payload.pop("available_shards", None)
+    return payload
+
+def transaction_payload(transaction_id, data):
+    """A transaction as returned by get-transactions"""
+    payload = dollar_amounts(data, "amount")
+    payload["id"] = transaction_id
+    return payload
+
+class Subscriber:
+    """One client connection of a feed: the queue of events it still has to send"""
+
+    def __init__(self, feed, loop, max_events=CHANGE_FEED_QUEUE_SIZE):
+        self.feed = feed
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+        self._loop = loop
+        self._max_events = max_events
+
+    def send(self, event):
+        """Queue an event for the connection; called from the listener threads"""
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.overflowed:
+            return
+        if self.queue.qsize() >= self._max_events:
+            # Too far behind to catch up from deltas: the client has to fetch everything again
+            self.overflowed = True
+            event = {"type": "resync"}
+        self.queue.put_nowait(event)
+
+class UserFeed:
+    """
+    Change feed of one user: the snapshot listeners on the user's categories (and the counter
+    shards of sharded ones), transactions and sync runs, shared by every connection of the
+    user to this process. The feed keeps the last state it saw of each document, so it turns
+    listener snapshots into deltas for the clients:
+    - `category`: a category added or changed, with its available amount including its shards
+    - `category_removed`
+    - `transaction`: a transaction added or changed, with its `previous` version (None if new)
+      so clients can adjust their totals without re-running queries
+    - `transaction_removed`, with its `previous` version
+    - `sync`: a Plaid sync finished (its sync run record)
+    - `ready` once the listeners have their initial state (nothing before it is sent), and
+      `resync` when a client has fallen too far behind and must fetch everything again
+    Transactions moved into or out of the archive (see transaction_archive.py) are not changes:
+    they are skipped, as archived transactions are still returned by the transaction reads.
+
+    The listeners watch the user's read layout at the time they start; `refresh()` restarts
+    them when a layout migration has since switched the user's reads. Removals are checked
+    against the user document first, as finalizing a migration deletes the previous copies:
+    snapshots of a layout the user has left are ignored until the restart, whose first
+    snapshots catch up with whatever changed in between.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.subscribers = set()
+        self.ready = False
+        self.layout = None
+        self._lock = threading.RLock()
+        self._generation = 0  # Incremented when the listeners restart; snapshots of older listeners are ignored
+        self._watches = {}  # "categories", "transactions", "sync_runs" and "shards/<category_id>"
+        self._loaded = set()  # Watches whose first snapshot has arrived
+        self._started_at = None
+        self._categories = {}  # category_id -> data
+        self._shards = {}  # category_id -> {shard_id: cents}
+        self._published_categories = {}  # category_id -> payload last sent
+        self._transactions = {}  # transaction_id -> data
+        self._sync_run_ids = set()
+        self._stale = False  # The user's reads moved to another layout; the listeners must restart
+
+    def start(self):
+        with self._lock:
+            self._started_at = datetime.now(timezone.utc)
+            self._watches["sync_runs"] = repos.sync_runs.listen_since(self.user_id, self._started_at, self._on_sync_runs)
+            self._start_layout_watches()
+
+    def _start_layout_watches(self):
+        self.layout = read_layout(repos.layouts.get(self.user_id))
+        generation = self._generation
+        self._watches["categories"] = repos.categories.listen(self.user_id, partial(self._on_categories, generation))
+        self._watches["transactions"] = repos.transactions.listen(self.user_id, partial(self._on_transactions, generation))
+
+    def _stop_layout_watches(self):
+        for name in [name for name in self._watches if name != "sync_runs"]:
+            self._watches.pop(name).unsubscribe()
+            self._loaded.discard(name)
+
+    def stop(self):
+        with self._lock:
+            self._generation += 1
+            for watch in self._watches.values():
+                watch.unsubscribe()
+            self._watches.clear()
+
+    def refresh(self):
+        """Restart the listeners if the user's read layout changed since they started"""
+        if not self._stale and read_layout(repos.layouts.get(self.user_id)) == self.layout:
+            return
+        with self._lock:
+            logger.info(f"Restarting change feed listeners of user_id: {self.user_id} after a layout change")
+            self._stop_layout_watches()
+            self._generation += 1
+            self._stale = False
+            self._start_layout_watches()
+
+    def _left_layout(self):
+        """Whether the user's reads have moved to another layout, from a fresh read of the user document"""
+        if not self._stale:
+            user_doc = repos.users.get(self.user_id)
+            repos.layouts.prime(self.user_id, user_doc.to_dict() or {})
+            self._stale = read_layout(repos.layouts.get(self.user_id)) != self.layout
+        return self._stale
+
+    def add(self, subscriber):
+        with self._lock:
+            self.subscribers.add(subscriber)
+            if self.ready:
+                subscriber.send({"type": "ready"})
+
+    def remove(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def _publish(self, event):
+        # Before the feed is ready, snapshots only build its state
+        if self.ready:
+            for subscriber in self.subscribers:
+                subscriber.send(event)
+
+    def _check_ready(self):
+        if not self.ready and self._loaded.issuperset(INITIAL_WATCHES):
+            self.ready = True
+            self._publish({"type": "ready"})
+
+    @staticmethod
+    def _delta(loaded, docs, changes, state):
+        """
+        ({id: data} upserted, {id: data} removed) from a snapshot: the first snapshot of a listener
+        is compared with the known state (which is kept across restarts), later ones give changes
+        """
+        if not loaded:
+            current = {doc.id: doc.to_dict() for doc in docs}
+            upserted = {doc_id: data for doc_id, data in current.items() if state.get(doc_id) != data}
+            return upserted, {doc_id: data for doc_id, data in state.items() if doc_id not in current}
+        upserted, removed = {}, {}
+        for change in changes:
+            if change.type.name == "REMOVED":
+                removed[change.document.id] = state.get(change.document.id, change.document.to_dict())
+            else:
+                upserted[change.document.id] = change.document.to_dict()
+        return upserted, removed
+
+    # Categories and their shards
+    def _on_categories(self, generation, docs, changes, read_time):
+        with self._lock:
+            if generation != self._generation or self._stale:
+                return
+            upserted, removed = self._delta("categories" in self._loaded, docs, changes, self._categories)
+            if removed and self.ready and self._left_layout():
+                return
+            self._loaded.add("categories")
+            for category_id in removed:
+                self._categories.pop(category_id, None)
+                self._stop_shards(category_id)
+                if self._published_categories.pop(category_id, None) is not None:
+                    self._publish({"type": "category_removed", "id": category_id})
+            for category_id, data in upserted.items():
+                self._categories[category_id] = data
+            # Every sharded category needs its shards listener (again, after a restart)
+            for category_id, data in self._categories.items():
+                if data.get("available_shards"):
+                    self._watch_shards(category_id)
+            for category_id in upserted:
+                self._publish_category(category_id)
+            self._check_ready()
+
+    def _publish_category(self, category_id):
+        data = self._categories.get(category_id)
+        if data is None:
+            return
+        available = read_cents(data, "available")
+        if data.get("available_shards"):
+            if f"shards/{category_id}" not in self._loaded:
+                return  # The balance is incomplete until the shards arrive
+            available += sum(self._shards.get(category_id, {}).values())
+        payload = category_payload(category_id, data, available)
+        if self._published_categories.get(category_id) != payload:
+            self._published_categories[category_id] = payload
+            self._publish({"type": "category", "category": payload})
+
+    def _watch_shards(self, category_id):
+        name = f"shards/{category_id}"
+        if name not in self._watches:
+            self._watches[name] = repos.categories.listen_shards(
+                category_id, partial(self._on_shards, self._generation, category_id), user_id=self.user_id
+            )
+
+    def _stop_shards(self, category_id):
+        watch = self._watches.pop(f"shards/{category_id}", None)
+        if watch is not None:
+            watch.unsubscribe()
+            self._loaded.discard(f"shards/{category_id}")
+            self._shards.pop(category_id, None)
+
+    def _on_shards(self, generation, category_id, docs, changes, read_time):
+        with self._lock:
+            if generation != self._generation or self._stale or f"shards/{category_id}" not in self._watches:
+                return
+            if any(change.type.name == "REMOVED" for change in changes) and self._left_layout():
+                return
+            self._loaded.add(f"shards/{category_id}")
+            self._shards[category_id] = {doc.id: read_cents(doc.to_dict(), "available") for doc in docs}
+            self._publish_category(category_id)
+
+    # Transactions
+    def _on_transactions(self, generation, docs, changes, read_time):
+        with self._lock:
+            if generation != self._generation or self._stale:
+                return
+            upserted, removed = self._delta("transactions" in self._loaded, docs, changes, self._transactions)
+            if removed and self.ready and self._left_layout():
+                return
+            self._loaded.add("transactions")
+            archived, moved_back = self._archive_moves({**upserted, **removed}) if self.ready else (set(), set())
+
+            for transaction_id, data in removed.items():
+                self._transactions.pop(transaction_id, None)
+                if transaction_id not in archived:
+                    self._publish({
+                        "type": "transaction_removed",
+                        "id": transaction_id,
+                        "previous": transaction_payload(transaction_id, data),
+                    })
+            for transaction_id, data in upserted.items():
+                previous = self._transactions.get(transaction_id)
+                self._transactions[transaction_id] = data
+                if previous == data or (previous is None and transaction_id in moved_back):
+                    continue  # Unchanged, or moved back from the archive unchanged (its edit follows as a change)
+                self._publish({
+                    "type": "transaction",
+                    "transaction": transaction_payload(transaction_id, data),
+                    "previous": transaction_payload(transaction_id, previous) if previous is not None else None,
+                })
+            self._check_ready()
+
+    def _archive_moves(self, transactions):
+        """
+        (IDs archived, IDs moved back from the archive) among {id: data} of transactions added or
+        removed in archived months; one query for the blocks of those months, none otherwise
+        """
+        archived_through = (user_metadata.get(self.user_id) or {}).get("archived_through")
+        months = [
+            month_of(data["date"]) for data in transactions.values()
+            if archived_through and data.get("date") and month_of(data["date"]) <= archived_through
+        ]
+        archived, moved_back = set(), set()
+        if months:
+            for block in repos.transaction_archive.blocks(self.user_id, min(months), max(months)):
+                block_data = block.to_dict()
+                unarchived = block_data.get("unarchived") or {}
+                for transaction_id in block_data.get("transaction_ids", []):
+                    (moved_back if transaction_id in unarchived else archived).add(transaction_id)
+        return archived, moved_back
+
+    # Sync runs
+    def _on_sync_runs(self, docs, changes, read_time):
+        with self._lock:
+            for change in changes:
+                if change.type.name != "ADDED" or change.document.id in self._sync_run_ids:
+                    continue
+                self._sync_run_ids.add(change.document.id)
+                data = change.document.to_dict()
+                self._publish({"type": "sync", "sync_run": {
+                    "id": change.document.id,
+                    "status": data.get("status"),
+                    "error": data.get("error"),
+                    "started_at": data.get("started_at"),
+                    "duration_seconds": data.get("duration_seconds"),
+                    "totals": data.get("totals", {}),
+                }})
+            self._loaded.add("sync_runs")
+            self._check_ready()
+
+class ChangeFeeds:
+    """
+    The change feeds of this process, one per user with at least one connection: the first
+    connection of a user starts the feed's listeners and the last one to close stops them, so a
+    user with several open clients costs a single set of listeners.
+    """
+
+    def __init__(self):
+        self._feeds = {}  # user_id -> UserFeed
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, loop):
+        """Connect to the user's feed (starting it if needed); returns the Subscriber"""
+        with self._lock:
+            feed = self._feeds.get(user_id)
+            if feed is None:
+                feed = self._feeds[user_id] = UserFeed(user_id)
+                feed.start()
+            subscriber = Subscriber(feed, loop)
+            feed.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            feed = subscriber.feed
+            feed.remove(subscriber)
+            if not feed.subscribers and self._feeds.get(feed.user_id) is feed:
+                del self._feeds[feed.user_id]
+                feed.stop()
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._feeds), "subscribers": sum(len(feed.subscribers) for feed in self._feeds.values())}
+
+change_feeds = ChangeFeeds()
@@ -0,0 +1,55 @@
+import os
+import json
+import asyncio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from .db_async import run_db
+from .user_metadata import user_metadata
+from .change_feed import change_feeds
+
+router = APIRouter()
+
+# Seconds between keep-alive comments on an idle stream; the user's storage layout is re-checked as often
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+
+def sse_message(event):
+    return f"event: {event['type']}\ndata: {json.dumps(jsonable_encoder(event))}\n\n"
+
+@router.get("/stream")
+async def stream_changes(user_id: str, request: Request):
+    """
+    Server-Sent Events stream of the user's changes (see UserFeed in change_feed.py for the
+    events). Clients should open the stream before fetching, wait for the `ready` event, then
+    fetch once and apply the following events as deltas; on `resync` (or a reconnect) they
+    fetch again.
+    """
+    metadata = await run_db(user_metadata.get, user_id)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    loop = asyncio.get_running_loop()
+    subscriber = await run_db(change_feeds.subscribe, user_id, loop)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), CHANGE_FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    await run_db(subscriber.feed.refresh)
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_message(event)
+                if event["type"] == "resync":
+                    break
+        finally:
+            # Not awaited: the task may be cancelled (client gone), and stopping listeners can block
+            loop.run_in_executor(None, change_feeds.unsubscribe, subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Don't let proxies buffer the stream
+    })
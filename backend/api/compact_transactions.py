@@ -0,0 +1,79 @@
+"""
+Compact old transactions into monthly archive blocks (cold storage, see db/archive.py).
+
+Transactions dated before --before-month (default: the month TRANSACTION_ARCHIVE_AFTER_DAYS
+ago) are moved into compressed blocks of up to a batch worth of transactions per user-month.
+Range queries, transaction pages and full reads (validation, exports) read the blocks
+transparently, and editing an archived transaction moves it back to the live collection.
+
+Servers learn which months a user has archived from the `archived_through` field of the user
+document, which they cache for USER_METADATA_TTL_SECONDS. The script raises it for every user
+first and waits that long (--propagation-seconds) before moving any transaction, so no server
+misses the archived transactions. Re-running the script is safe; each block is written
+together with the deletion of its transactions.
+
+Usage (from the backend directory):
+    python api/compact_transactions.py --dry-run
+    python api/compact_transactions.py --users USER_ID [USER_ID ...] --before-month 2025-01
+"""
+import os
+import sys
+import argparse
+import time
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+from api.db import repos
+from api.user_metadata import USER_METADATA_TTL_SECONDS
+from api.transaction_archive import transaction_archive, archive_cutoff_month
+
+def compact(user_ids=None, before_month=None, propagation_seconds=USER_METADATA_TTL_SECONDS, dry_run=False):
+    before_month = before_month or archive_cutoff_month()
+    if user_ids is None:
+        user_ids = [doc.id for doc in repos.users.collection.stream()]
+
+    planned = {user_id: transaction_archive.compact_user(user_id, before_month, dry_run=True) for user_id in user_ids}
+    stats = {"before_month": before_month, "users": 0, "transactions": 0, "blocks": 0, "months": 0}
+    if dry_run:
+        for user_stats in planned.values():
+            stats["users"] += 1 if user_stats["transactions"] else 0
+            stats["transactions"] += user_stats["transactions"]
+            stats["months"] += user_stats["months"]
+        return stats
+
+    marked = [
+        user_id for user_id, user_stats in planned.items()
+        if user_stats["newest_month"] and transaction_archive.mark_archived_through(user_id, user_stats["newest_month"])
+    ]
+    if marked and propagation_seconds > 0:
+        print(f"Waiting {propagation_seconds}s for every server to see the archived months of {len(marked)} users...")
+        time.sleep(propagation_seconds)
+
+    for user_id, user_stats in planned.items():
+        if not user_stats["transactions"]:
+            continue
+        user_stats = transaction_archive.compact_user(user_id, before_month)
+        stats["users"] += 1
+        for field in ("transactions", "blocks", "months"):
+            stats[field] += user_stats[field]
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact old transactions into monthly archive blocks")
+    parser.add_argument("--users", nargs="+", help="User IDs to compact (default: every user)")
+    parser.add_argument("--before-month", help="Archive transactions dated before this month (YYYY-MM)")
+    parser.add_argument("--propagation-seconds", type=float, default=USER_METADATA_TTL_SECONDS,
+                        help="Wait after raising archived_through (the servers' USER_METADATA_TTL_SECONDS)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be archived without writing")
+    args = parser.parse_args()
+
+    stats = compact(args.users, args.before_month, args.propagation_seconds, args.dry_run)
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}Transactions dated before {stats['before_month']}: {stats['transactions']} from {stats['users']} users "
+          f"in {stats['months']} user-months, archived into {stats['blocks']} blocks")
@@ -1,13 +1,49 @@
-from google.cloud import firestore
-from google.oauth2 import service_account
+import os
+from .db_instrumentation import InstrumentedClient
+from backend.db.repositories import Repositories
+
+# Storage backend: firestore (default), memory (in-process, for tests and benchmarks) or sqlite
+DB_BACKEND = os.getenv("DB_BACKEND", "firestore").lower()
 
 # Path to your service account key file
 SERVICE_ACCOUNT_FILE = "./budgeting-app-firebase-adminsdk.json"
 
-# Initialize Firestore client
-credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE)
-db = firestore.Client(credentials=credentials)
+# Path of the database file when DB_BACKEND=sqlite
+SQLITE_PATH = os.getenv("SQLITE_PATH", "budgeting-app.sqlite3")
+
+if DB_BACKEND == "firestore":
+    from google.cloud import firestore
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE)
+    client = firestore.Client(credentials=credentials)
+
+    # Export constants for special Firestore values
+    DELETE_FIELD = firestore.DELETE_FIELD
+    Increment = firestore.Increment
+    SERVER_TIMESTAMP = firestore.SERVER_TIMESTAMP
+elif DB_BACKEND in ("memory", "sqlite"):
+    from backend.db import backends
+
+    client = backends.MemoryClient() if DB_BACKEND == "memory" else backends.SQLiteClient(SQLITE_PATH)
+    DELETE_FIELD = backends.DELETE_FIELD
+    Increment = backends.Increment
+    SERVER_TIMESTAMP = backends.SERVER_TIMESTAMP
+else:
+    raise ValueError(f"Unknown DB_BACKEND '{DB_BACKEND}', expected firestore, memory or sqlite")
+
+# Client wrapped so reads, writes and batch commits can be counted per sync/request
+db = InstrumentedClient(client)
+
+# How long each user's storage layout is cached; a migration phase change reaches every process within it
+USER_LAYOUT_TTL_SECONDS = float(os.getenv("USER_LAYOUT_TTL_SECONDS", "60"))
+
+# Storage layout (flat or partitioned, see db/layouts.py) of users created from now on
+DATA_LAYOUT = os.getenv("DATA_LAYOUT", "flat").lower()
+if DATA_LAYOUT not in ("flat", "partitioned"):
+    raise ValueError(f"Unknown DATA_LAYOUT '{DATA_LAYOUT}', expected flat or partitioned")
+
+# Repositories for every collection; routes go through these rather than the client
+repos = Repositories(db, layout_ttl_seconds=USER_LAYOUT_TTL_SECONDS, server_timestamp=SERVER_TIMESTAMP)
 
-# Export constants for special Firestore values
-DELETE_FIELD = firestore.DELETE_FIELD
-NULL_VALUE = None  # Python's None will be stored as a null value in Firestore
\ No newline at end of file
+NULL_VALUE = None  # Python's None will be stored as a null value in Firestore
@@ -0,0 +1,31 @@
+import os
+import asyncio
+import anyio.to_thread
+from fastapi.concurrency import run_in_threadpool
+
+# The Firestore client and the local backends are synchronous. Route handlers are async, so every
+# blocking database (or Plaid) call is run in the threadpool instead of on the event loop; one slow
+# query then only occupies a worker thread rather than stalling every other request on the process.
+# The caller's context is copied into the worker thread, so operation counting still applies.
+
+# Worker threads available for blocking calls (anyio's default of 40 is easily used up by fan-out reads)
+THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "100"))
+
+def configure_threadpool(size=THREADPOOL_SIZE):
+    """Set the number of worker threads; must be called from within the running event loop"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = size
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking call in the threadpool and return its result"""
+    return await run_in_threadpool(func, *args, **kwargs)
+
+async def fetch(func, *args, **kwargs):
+    """Run a query in the threadpool and return all of its documents as a list"""
+    return await run_in_threadpool(lambda: list(func(*args, **kwargs)))
+
+async def gather_db(*calls):
+    """
+    Run independent blocking calls concurrently and return their results in order.
+    Each call is a zero-argument callable, e.g. `user_ref.get` or `lambda: list(query.stream())`.
+    """
+    return await asyncio.gather(*(run_in_threadpool(call) for call in calls))
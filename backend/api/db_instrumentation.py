@@ -0,0 +1,221 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .db_trace import traced_call, query_shape
+
+class OperationCounts:
+    """Firestore operations recorded while a `count_operations()` block is active"""
+
+    def __init__(self, parent=None):
+        self.reads = 0  # Documents read (single gets, get_all and query results)
+        self.writes = 0  # Documents created, set, updated or deleted
+        self.queries = 0  # Query executions (stream/get on a query)
+        self.batch_commits = 0
+        self.parent = parent  # Enclosing block, which also sees these operations
+        self.lock = threading.Lock()  # Batches may be committed from worker threads
+
+    def as_dict(self):
+        return {"reads": self.reads, "writes": self.writes, "queries": self.queries, "batch_commits": self.batch_commits}
+
+_current_counts = ContextVar("firestore_operation_counts", default=None)
+
+def start_counting():
+    """Start a counting block; returns the counts and a token for `stop_counting`"""
+    counts = OperationCounts(parent=_current_counts.get())
+    return counts, _current_counts.set(counts)
+
+def stop_counting(token):
+    _current_counts.reset(token)
+
+@contextmanager
+def count_operations():
+    """Count every operation made through an InstrumentedClient inside the block (blocks can be nested)"""
+    counts, token = start_counting()
+    try:
+        yield counts
+    finally:
+        stop_counting(token)
+
+def record(reads=0, writes=0, queries=0, batch_commits=0):
+    counts = _current_counts.get()
+    while counts is not None:
+        with counts.lock:
+            counts.reads += reads
+            counts.writes += writes
+            counts.queries += queries
+            counts.batch_commits += batch_commits
+        counts = counts.parent
+
+def _unwrap(value):
+    return getattr(value, "_wrapped", value)
+
+def _collection_of(reference):
+    return reference.path.rsplit("/", 2)[-2]
+
+def _filter_of(args, kwargs):
+    """(field, operator) of a `where` call, positional or keyword, or with a FieldFilter"""
+    field_filter = kwargs.get("filter")
+    if field_filter is not None:
+        return getattr(field_filter, "field_path", "filter"), getattr(field_filter, "op_string", "")
+    field = args[0] if args else kwargs.get("field_path")
+    op = args[1] if len(args) > 1 else kwargs.get("op_string")
+    return field, op
+
+class _Wrapper:
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+class InstrumentedSnapshot(_Wrapper):
+    @property
+    def reference(self):
+        return InstrumentedDocument(self._wrapped.reference)
+
+class InstrumentedQuery(_Wrapper):
+    """A query, which also keeps its shape (collection, filtered fields, ordering) for db_trace"""
+
+    def __init__(self, wrapped, collection=None, filters=(), order_by=(), limit=None):
+        super().__init__(wrapped)
+        self._collection = collection
+        self._filters = filters
+        self._order_by = order_by
+        self._limit = limit
+
+    def _derive(self, wrapped, **shape):
+        shape = {"collection": self._collection, "filters": self._filters, "order_by": self._order_by, "limit": self._limit, **shape}
+        return InstrumentedQuery(wrapped, **shape)
+
+    def _shape(self):
+        return query_shape(self._collection, self._filters, self._order_by, self._limit)
+
+    def where(self, *args, **kwargs):
+        return self._derive(self._wrapped.where(*args, **kwargs), filters=self._filters + (_filter_of(args, kwargs),))
+
+    def order_by(self, field_path, *args, **kwargs):
+        return self._derive(self._wrapped.order_by(field_path, *args, **kwargs), order_by=self._order_by + (field_path,))
+
+    def limit(self, count):
+        return self._derive(self._wrapped.limit(count), limit=count)
+
+    def offset(self, *args, **kwargs):
+        return self._derive(self._wrapped.offset(*args, **kwargs))
+
+    def select(self, *args, **kwargs):
+        return self._derive(self._wrapped.select(*args, **kwargs))
+
+    def start_after(self, document):
+        return self._derive(self._wrapped.start_after(_unwrap(document)))
+
+    def start_at(self, document):
+        return self._derive(self._wrapped.start_at(_unwrap(document)))
+
+    def stream(self, *args, **kwargs):
+        record(queries=1)
+        with traced_call("query", self._shape) as call:
+            for snapshot in self._wrapped.stream(*args, **kwargs):
+                record(reads=1)
+                call["documents"] = call.get("documents", 0) + 1
+                yield InstrumentedSnapshot(snapshot)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+class InstrumentedDocument(_Wrapper):
+    def _shape(self):
+        return _collection_of(self._wrapped)
+
+    def get(self, *args, **kwargs):
+        record(reads=1)
+        with traced_call("get", self._shape) as call:
+            call["documents"] = 1
+            return InstrumentedSnapshot(self._wrapped.get(*args, **kwargs))
+
+    def _write(self, operation, *args, **kwargs):
+        record(writes=1)
+        with traced_call("write", self._shape) as call:
+            call["documents"] = 1
+            return getattr(self._wrapped, operation)(*args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._write("create", *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._write("set", *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._write("update", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._write("delete", *args, **kwargs)
+
+    def collection(self, name):
+        return InstrumentedCollection(self._wrapped.collection(name))
+
+class InstrumentedCollection(InstrumentedQuery):
+    def __init__(self, wrapped):
+        super().__init__(wrapped, collection=wrapped.id)
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        record(writes=1)
+        with traced_call("write", lambda: self._collection) as call:
+            call["documents"] = 1
+            update_time, document = self._wrapped.add(*args, **kwargs)
+        return update_time, InstrumentedDocument(document)
+
+class InstrumentedBatch(_Wrapper):
+    def __init__(self, wrapped):
+        super().__init__(wrapped)
+        self._pending_writes = 0
+
+    def create(self, reference, *args, **kwargs):
+        self._pending_writes += 1
+        return self._wrapped.create(_unwrap(reference), *args, **kwargs)
+
+    def set(self, reference, *args, **kwargs):
+        self._pending_writes += 1
+        return self._wrapped.set(_unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        self._pending_writes += 1
+        return self._wrapped.update(_unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        self._pending_writes += 1
+        return self._wrapped.delete(_unwrap(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        with traced_call("commit", lambda: "batch") as call:
+            call["documents"] = self._pending_writes
+            result = self._wrapped.commit(*args, **kwargs)
+        record(writes=self._pending_writes, batch_commits=1)
+        self._pending_writes = 0
+        return result
+
+class InstrumentedClient(_Wrapper):
+    """
+    Wraps a Firestore client so every read, write, query and batch commit made through it
+    is counted against the active `count_operations()` block (if any).
+    """
+
+    def collection(self, name):
+        return InstrumentedCollection(self._wrapped.collection(name))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def batch(self):
+        return InstrumentedBatch(self._wrapped.batch())
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        describe = lambda: ", ".join(sorted({_collection_of(reference) for reference in references}))
+        with traced_call("get_all", describe) as call:
+            for snapshot in self._wrapped.get_all(references, *args, **kwargs):
+                record(reads=1)
+                call["documents"] = call.get("documents", 0) + 1
+                yield InstrumentedSnapshot(snapshot)
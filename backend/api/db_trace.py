@@ -0,0 +1,170 @@
+"""
+Per-request trace of Firestore calls, for finding N+1 query patterns.
+
+With DB_TRACE set to `log` or `header`, the request middleware in main.py traces every call a
+request makes through the instrumented client (api/db_instrumentation.py): its kind (query,
+get, get_all, write, commit), collection, filters, document count and duration. Calls are
+grouped by shape (kind, collection, filtered fields and operators, ordering and limit; not the
+values), and a shape repeated DB_TRACE_REPEAT_THRESHOLD times or more in one request (a query
+per transaction, a get per category) is flagged:
+- `log`: a summary of every traced request is logged, as a warning when a shape is flagged
+- `header`: the summary is also returned in the `X-DB-Trace` response header (JSON)
+
+For tests and checks, `assert_max_queries` traces the requests (and direct calls) made inside
+it and fails when one makes more read round trips than allowed or repeats a shape, whatever
+DB_TRACE says; see api/query_budget_check.py.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DB_TRACE = os.getenv("DB_TRACE", "off").lower()
+
+# Calls of one shape in one request from which the shape is flagged as repeated
+DB_TRACE_REPEAT_THRESHOLD = int(os.getenv("DB_TRACE_REPEAT_THRESHOLD", "5"))
+
+# Shapes listed in a summary, most called first
+TRACE_SUMMARY_SHAPES = 10
+
+# Call kinds that are a read round trip
+READ_KINDS = ("query", "get", "get_all")
+
+logger = logging.getLogger("db_trace")
+
+_current_trace = ContextVar("firestore_trace", default=None)
+_collectors = []  # Lists receiving the (method, route, trace) of requests traced by `assert_max_queries`
+
+def query_shape(collection, filters=(), order_by=(), limit=None):
+    """Description of a query without its values, e.g. `transactions where user_id ==, date >= order by date`"""
+    shape = collection
+    if filters:
+        shape += " where " + ", ".join(f"{field} {op}" for field, op in filters)
+    if order_by:
+        shape += " order by " + ", ".join(order_by)
+    if limit is not None:
+        shape += " limit"
+    return shape
+
+class RequestTrace:
+    """The Firestore calls of one request (or block), recorded from any thread"""
+
+    def __init__(self):
+        self.calls = []  # (kind, shape, documents, seconds)
+        self._lock = threading.Lock()
+
+    def add(self, kind, shape, documents, seconds):
+        with self._lock:
+            self.calls.append((kind, shape, documents, seconds))
+
+    @property
+    def read_round_trips(self):
+        return sum(1 for kind, _, _, _ in self.calls if kind in READ_KINDS)
+
+    def shapes(self):
+        """{"kind shape": {"calls", "documents", "ms"}}, most called first"""
+        shapes = defaultdict(lambda: {"calls": 0, "documents": 0, "ms": 0.0})
+        for kind, shape, documents, seconds in self.calls:
+            totals = shapes[f"{kind} {shape}"]
+            totals["calls"] += 1
+            totals["documents"] += documents
+            totals["ms"] += seconds * 1000
+        for totals in shapes.values():
+            totals["ms"] = round(totals["ms"], 2)
+        return dict(sorted(shapes.items(), key=lambda item: -item[1]["calls"]))
+
+    def repeated(self, threshold=DB_TRACE_REPEAT_THRESHOLD):
+        """The read shapes called `threshold` times or more"""
+        return {
+            shape: totals for shape, totals in self.shapes().items()
+            if totals["calls"] >= threshold and shape.split(" ", 1)[0] in READ_KINDS
+        }
+
+    def summary(self, threshold=DB_TRACE_REPEAT_THRESHOLD):
+        shapes = self.shapes()
+        return {
+            "calls": len(self.calls),
+            "read_round_trips": self.read_round_trips,
+            "documents": sum(documents for _, _, documents, _ in self.calls),
+            "ms": round(sum(seconds for _, _, _, seconds in self.calls) * 1000, 2),
+            "repeated": list(self.repeated(threshold)),
+            "shapes": dict(list(shapes.items())[:TRACE_SUMMARY_SHAPES]),
+        }
+
+def tracing():
+    """Whether requests are traced (DB_TRACE is on, or an `assert_max_queries` block is active)"""
+    return DB_TRACE in ("log", "header") or bool(_collectors)
+
+@contextmanager
+def trace_operations():
+    """Trace every call made through an InstrumentedClient inside the block (in this context and the threads it starts)"""
+    trace = RequestTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+@contextmanager
+def traced_call(kind, describe):
+    """
+    Time one call for the active trace, if any; `describe()` gives its shape (only called when
+    tracing) and the block sets the number of `documents` on the yielded dict
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield {}
+        return
+    call = {"documents": 0}
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        trace.add(kind, describe(), call["documents"], time.perf_counter() - started)
+
+def finish_request(method, route, trace):
+    """Report a traced request: log its summary (and return it for the X-DB-Trace header in `header` mode)"""
+    for collected in list(_collectors):
+        collected.append((method, route, trace))
+    if DB_TRACE not in ("log", "header"):
+        return None
+    summary = trace.summary()
+    if summary["repeated"]:
+        logger.warning(f"Repeated Firestore calls in {method} {route}: {json.dumps(summary)}")
+    else:
+        logger.info(f"Firestore calls of {method} {route}: {json.dumps(summary)}")
+    return json.dumps(summary, separators=(",", ":")) if DB_TRACE == "header" else None
+
+def check_trace(label, trace, max_queries, max_repeated=None):
+    """Error message when a trace exceeds the budget, or None"""
+    summary = trace.summary(threshold=(max_repeated or 0) + 1)
+    if summary["read_round_trips"] > max_queries:
+        return f"{label} made {summary['read_round_trips']} read round trips (at most {max_queries}): {summary['shapes']}"
+    if max_repeated is not None and summary["repeated"]:
+        return f"{label} repeated {summary['repeated']} more than {max_repeated} times: {summary['shapes']}"
+    return None
+
+@contextmanager
+def assert_max_queries(max_queries, max_repeated=None):
+    """
+    Fail with an AssertionError if a request handled inside the block (e.g. by a TestClient), or
+    the block's own calls, make more than `max_queries` read round trips (queries, gets and
+    get_all calls) or call one read shape more than `max_repeated` times. Yields the list the
+    traced requests are collected in, as (method, route, trace).
+    """
+    collected = []
+    _collectors.append(collected)
+    try:
+        with trace_operations() as block_trace:
+            yield collected
+    finally:
+        _collectors.remove(collected)
+    traces = [(f"{method} {route}", trace) for method, route, trace in collected]
+    if block_trace.calls:
+        traces.append(("block", block_trace))
+    errors = [error for error in (check_trace(label, trace, max_queries, max_repeated) for label, trace in traces) if error]
+    assert not errors, "\n".join(errors)
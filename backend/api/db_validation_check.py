@@ -1,343 +1,247 @@
+"""
+Database integrity validation: checks that every category's stored available amount matches
+the one recomputed from the user's transactions and assignments (see api/integrity.py).
+
+Users are checked in parallel by a pool of --workers threads (the checks wait on database
+reads), or of processes with --processes, each with its own database client. Each user's
+documents are read with one query per collection and summed in one pass. Issues are printed and
+appended to a JSON Lines file in db_validations/ as users finish, so memory use doesn't grow
+with the number of issues; the file ends with a summary line.
+
+With --incremental, users are reconciled from the documents changed since their last run (see
+api/reconciliation.py), falling back to the full check where the changes can't be trusted.
+
+With --repair, the balances found wrong are corrected (see api/balance_repair.py): each
+correction is appended to the results file, and recorded with its before and after amounts in
+`balance_repairs`. --dry-run lists the corrections without making them, and
+--max-repairs-per-second paces them. Combine with --users to repair a few users.
+
+Usage (from the backend directory):
+    python api/db_validation_check.py
+    python api/db_validation_check.py --workers 64
+    python api/db_validation_check.py --processes 8
+    python api/db_validation_check.py --incremental
+    python api/db_validation_check.py --repair --dry-run
+    python api/db_validation_check.py --repair --users USER_ID --max-repairs-per-second 10
+    python api/db_validation_check.py --users USER_ID [USER_ID ...]
+"""
 import os
 import sys
+import argparse
+import multiprocessing
 from dotenv import load_dotenv
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 import json
+import time
 import datetime
 
 # Change to the backend directory so the relative paths work correctly
 backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 os.chdir(backend_dir)
 
-# Add the current directory to Python path
+# Add the backend and repository directories to Python path
 sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
 
-# Now import the database connection
-from api.db import db
+# Now import the database repositories
+from api.db import repos
+from api.integrity import check_user
+from api.reconciliation import reconcile_user
+from api.balance_repair import BalanceRepairer, stable_corrections
 
 # Load environment variables
 load_dotenv()
 
+# Users handed to a worker process at a time (threads take one user at a time)
+USERS_PER_PROCESS_TASK = 50
+
 def custom_serializer(obj):
     """Custom serializer for datetime objects"""
     if isinstance(obj, (datetime.date, datetime.datetime)):
         return obj.isoformat()
     raise TypeError(f"Type {type(obj)} not serializable")
 
-def get_all_users():
-    """Get all users from the database"""
-    users_query = db.collection("users")
-    users_docs = users_query.stream()
-    
-    users = []
-    for doc in users_docs:
-        user_data = doc.to_dict()
-        user_data['id'] = doc.id
-        users.append(user_data)
-    
-    return users
-
-def get_categories_for_user(user_id):
-    """Get all categories for a specific user"""
-    categories_query = db.collection("categories").where("user_id", "==", user_id)
-    categories_docs = categories_query.stream()
-    
-    categories = {}
-    for doc in categories_docs:
-        category_data = doc.to_dict()
-        category_data['id'] = doc.id
-        categories[doc.id] = category_data
-    
-    return categories
+def iter_users(user_ids=None):
+    """(user_id, email) of the given users, or of every user streamed from the database"""
+    if user_ids:
+        for user_id, doc in repos.users.get_many(user_ids).items():
+            yield user_id, doc.to_dict().get("email", "No email")
+        return
+    for doc in repos.users.collection.stream():
+        yield doc.id, doc.to_dict().get("email", "No email")
 
-def get_transactions_for_user(user_id):
-    """Get all transactions for a specific user"""
-    transactions_query = db.collection("transactions").where("user_id", "==", user_id)
-    transactions_docs = transactions_query.stream()
-    
-    transactions = []
-    for doc in transactions_docs:
-        transaction_data = doc.to_dict()
-        transaction_data['id'] = doc.id
-        transactions.append(transaction_data)
-    
-    return transactions
+def check_users(users, incremental=False, repair=False):
+    """
+    Check a batch of (user_id, email); runs in the worker threads or processes. With `repair`,
+    the results of users with issues get the `corrections` their balances need.
+    """
+    results = []
+    for user_id, email in users:
+        result = reconcile_user(user_id, email) if incremental else check_user(user_id, email)
+        if repair and result['issues']:
+            result['corrections'] = stable_corrections(user_id, email)
+        results.append(result)
+    return results
 
-def get_assignments_for_user(user_id):
-    """Get all assignments for a specific user"""
-    assignments_query = db.collection("assignments").where("user_id", "==", user_id)
-    assignments_docs = assignments_query.stream()
-    
-    assignments = []
-    for doc in assignments_docs:
-        assignment_data = doc.to_dict()
-        assignment_data['id'] = doc.id
-        assignments.append(assignment_data)
-    
-    return assignments
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
-def calculate_expected_available(category_id, transactions, assignments, is_unallocated_funds=False):
+def run_checks(users, workers, processes=False, incremental=False, repair=False):
     """
-    Calculate what the available amount should be for a category based on transactions and assignments.
-    
-    For regular categories:
-    Available = Sum of assignments TO the category + Sum of transaction amounts FOR the category
-    
-    For unallocated funds category:
-    Available = Sum of transaction amounts FOR unallocated funds - Sum of ALL assignments for the user
-    
-    This reflects that unallocated funds:
-    - Receive money from transactions (income goes to unallocated first)
-    - Lose money when assignments are made to other categories
-    - Do NOT receive direct assignments (money is assigned FROM unallocated TO other categories)
-    
-    Note: Transaction amounts are stored as negative for expenses and positive for income.
-    Assignment amounts are always positive (money being allocated TO a category).
+    Yield each user's check result as it finishes. Users are submitted as the pool frees up,
+    so at most a few tasks per worker are pending at a time.
     """
-    
-    if is_unallocated_funds:
-        # For unallocated funds: transactions assigned to it minus all assignments
-        total_transactions = 0.0
-        for transaction in transactions:
-            if transaction.get('category_id') == category_id:
-                total_transactions += transaction.get('amount', 0.0)
-        
-        # Sum ALL assignments for the user (regardless of category)
-        total_all_assignments = 0.0
-        for assignment in assignments:
-            total_all_assignments += assignment.get('amount', 0.0)
-        
-        # Unallocated available = transactions to unallocated - all assignments
-        expected_available = total_transactions - total_all_assignments
-        
-        return expected_available, 0.0, total_transactions, total_all_assignments
+    if processes:
+        # Spawned rather than forked: database clients don't survive a fork
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
     else:
-        # Regular category logic
-        # Sum all assignments TO this category
-        total_assignments = 0.0
-        for assignment in assignments:
-            if assignment.get('category_id') == category_id:
-                total_assignments += assignment.get('amount', 0.0)
-        
-        # Sum all transaction amounts FOR this category
-        total_transactions = 0.0
-        for transaction in transactions:
-            if transaction.get('category_id') == category_id:
-                total_transactions += transaction.get('amount', 0.0)
-        
-        # Available = Assignments + Transactions
-        # (Assignments add money, negative transactions subtract money, positive transactions add money)
-        expected_available = total_assignments + total_transactions
-        
-        return expected_available, total_assignments, total_transactions
+        executor = ThreadPoolExecutor(max_workers=workers)
+    batch_size = USERS_PER_PROCESS_TASK if processes else 1
+    with executor:
+        pending = set()
+        for batch in batched(users, batch_size):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(executor.submit(check_users, batch, incremental, repair))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
 
-def validate_database_integrity():
+def print_issue(issue):
+    print(f"❌ ISSUE: {issue['category_name']} (ID: {issue['category_id']}) of {issue['user_email']} (ID: {issue['user_id']})"
+          f" ({'Unallocated Funds' if issue['is_unallocated_funds'] else 'Regular Category'})")
+    print(f"   Stored: ${issue['stored_available']:.2f} | Expected: ${issue['expected_available']:.2f} | Diff: ${issue['discrepancy']:.2f}")
+    if issue['is_unallocated_funds']:
+        print(f"   (Transactions to Unallocated: ${issue['total_transactions']:.2f}, Total User Assignments: ${issue['total_all_assignments']:.2f})")
+    else:
+        print(f"   (Assignments: ${issue['total_assignments']:.2f}, Transactions: ${issue['total_transactions']:.2f})")
+
+def validate_database_integrity(user_ids=None, workers=32, processes=False, progress_every=1000, incremental=False,
+                                repair=False, dry_run=False, max_repairs_per_second=50):
     """
     Main function to validate database integrity.
     Checks that all category available amounts match the calculated values from transactions and assignments.
+    Returns (passed, path of the results file).
     """
-    
-    print("Starting database integrity validation...")
+    print(f"Starting database integrity validation ({workers} {'processes' if processes else 'threads'})...")
     print("=" * 60)
-    
-    # Get all users
-    users = get_all_users()
-    print(f"Found {len(users)} users in the database")
-    
-    all_issues = []
+
     summary_stats = {
-        'total_users': len(users),
+        'total_users': 0,
         'total_categories_checked': 0,
+        'total_transactions': 0,
+        'total_assignments': 0,
         'categories_with_issues': 0,
-        'total_discrepancy_amount': 0.0
+        'total_discrepancy_amount': 0.0,
+        'incremental_users': 0,
+        'full_fallbacks': {},
+        'repairs': {},
     }
-    
-    # Check each user's data
-    for user in users:
-        user_id = user['id']
-        user_email = user.get('email', 'No email')
-        
-        print(f"\n--- Checking User: {user_email} (ID: {user_id}) ---")
-        
-        # Get user's categories, transactions, and assignments
-        categories = get_categories_for_user(user_id)
-        transactions = get_transactions_for_user(user_id)
-        assignments = get_assignments_for_user(user_id)
-        
-        print(f"  Categories: {len(categories)}")
-        print(f"  Transactions: {len(transactions)}")
-        print(f"  Assignments: {len(assignments)}")
-        
-        user_issues = []
-        
-        # Check each category
-        for category_id, category_data in categories.items():
-            summary_stats['total_categories_checked'] += 1
-            
-            category_name = category_data.get('name', 'Unknown')
-            stored_available = category_data.get('available', 0.0)
-            is_unallocated = category_data.get('is_unallocated_funds', False)
-            
-            # Calculate expected available amount
-            if is_unallocated:
-                expected_available, total_assignments, total_transactions, total_all_assignments = calculate_expected_available(
-                    category_id, transactions, assignments, is_unallocated_funds=True
-                )
-            else:
-                expected_available, total_assignments, total_transactions = calculate_expected_available(
-                    category_id, transactions, assignments, is_unallocated_funds=False
-                )
-                total_all_assignments = None  # Not applicable for regular categories
-            
-            # Check for discrepancy
-            discrepancy = abs(stored_available - expected_available)
-            tolerance = 0.01  # Allow for small floating point differences
-            
-            if discrepancy > tolerance:
-                issue = {
-                    'user_id': user_id,
-                    'user_email': user_email,
-                    'category_id': category_id,
-                    'category_name': category_name,
-                    'is_unallocated_funds': is_unallocated,
-                    'stored_available': stored_available,
-                    'expected_available': expected_available,
-                    'discrepancy': discrepancy,
-                    'total_assignments': total_assignments,
-                    'total_transactions': total_transactions
-                }
-                
-                # Add total_all_assignments for unallocated funds
-                if is_unallocated:
-                    issue['total_all_assignments'] = total_all_assignments
-                
-                user_issues.append(issue)
-                all_issues.append(issue)
+
+    # Issues are streamed to a JSON Lines file with timestamp in the db_validations folder
+    timestamp = datetime.datetime.now()
+    validations_dir = 'db_validations'
+    os.makedirs(validations_dir, exist_ok=True)
+    filepath = os.path.join(validations_dir, f'db_validation_results_{timestamp.strftime("%Y%m%d_%H%M%S")}.jsonl')
+
+    repairer = BalanceRepairer(f'db_validation_{timestamp.strftime("%Y%m%d_%H%M%S")}', dry_run, max_repairs_per_second)
+
+    def record_repairs(corrections):
+        for correction in corrections:
+            summary_stats['repairs'][correction['status']] = summary_stats['repairs'].get(correction['status'], 0) + 1
+            results_file.write(json.dumps({'type': 'repair', **correction}) + "\n")
+            print(f"🔧 {'Would correct' if dry_run else 'Corrected'} {correction['category_name']} (ID: {correction['category_id']}): "
+                  f"{correction['before_cents']} -> {correction['expected_cents']} cents ({correction['status']})")
+
+    started = time.perf_counter()
+    with open(filepath, 'w') as results_file:
+        for result in run_checks(iter_users(user_ids), workers, processes, incremental, repair):
+            summary_stats['total_users'] += 1
+            summary_stats['total_categories_checked'] += result['categories']
+            summary_stats['total_transactions'] += result['transactions']
+            summary_stats['total_assignments'] += result['assignments']
+            if result.get('mode') == 'incremental':
+                summary_stats['incremental_users'] += 1
+            elif result.get('fallback_reason'):
+                fallbacks = summary_stats['full_fallbacks']
+                fallbacks[result['fallback_reason']] = fallbacks.get(result['fallback_reason'], 0) + 1
+            for issue in result['issues']:
                 summary_stats['categories_with_issues'] += 1
-                summary_stats['total_discrepancy_amount'] += discrepancy
-                
-                print(f"    ❌ ISSUE: {category_name} (ID: {category_id})")
-                print(f"       Stored Available: ${stored_available:.2f}")
-                print(f"       Expected Available: ${expected_available:.2f}")
-                print(f"       Discrepancy: ${discrepancy:.2f}")
-                if is_unallocated:
-                    print(f"       (Transactions to Unallocated: ${total_transactions:.2f}, Total User Assignments: ${total_all_assignments:.2f})")
-                else:
-                    print(f"       (Assignments: ${total_assignments:.2f}, Transactions: ${total_transactions:.2f})")
-            else:
-                print(f"    ✅ OK: {category_name} (ID: {category_id}) - ${stored_available:.2f}")
-        
-        if not user_issues:
-            print(f"  ✅ All categories for {user_email} are correct!")
-    
-    # Print summary
+                summary_stats['total_discrepancy_amount'] += issue['discrepancy']
+                results_file.write(json.dumps({'type': 'issue', **issue}, default=custom_serializer) + "\n")
+                print_issue(issue)
+            for correction in result.get('corrections', []):
+                record_repairs(repairer.add(correction))
+            if summary_stats['total_users'] % progress_every == 0:
+                print(f"  ... {summary_stats['total_users']} users checked ({time.perf_counter() - started:.1f}s)")
+
+        record_repairs(repairer.flush())
+        summary_stats['total_discrepancy_amount'] = round(summary_stats['total_discrepancy_amount'], 2)
+        summary_stats['duration_seconds'] = round(time.perf_counter() - started, 2)
+        results_file.write(json.dumps({
+            'type': 'summary',
+            'validation_timestamp': timestamp.isoformat(),
+            'workers': workers,
+            'processes': processes,
+            'incremental': incremental,
+            'repair': repair,
+            'dry_run': dry_run,
+            **summary_stats,
+        }) + "\n")
+
     print("\n" + "=" * 60)
     print("VALIDATION SUMMARY")
     print("=" * 60)
-    print(f"Total Users: {summary_stats['total_users']}")
+    print(f"Total Users: {summary_stats['total_users']} in {summary_stats['duration_seconds']}s")
     print(f"Total Categories Checked: {summary_stats['total_categories_checked']}")
+    print(f"Transactions / Assignments Read: {summary_stats['total_transactions']} / {summary_stats['total_assignments']}")
+    if incremental:
+        print(f"Reconciled Incrementally: {summary_stats['incremental_users']} | Full Recomputes: {summary_stats['full_fallbacks']}")
     print(f"Categories with Issues: {summary_stats['categories_with_issues']}")
     print(f"Total Discrepancy Amount: ${summary_stats['total_discrepancy_amount']:.2f}")
-    
-    if all_issues:
-        print(f"\n❌ Found {len(all_issues)} categories with availability discrepancies!")
-        print("\nDETAILED ISSUES:")
-        print("-" * 40)
-        
-        for issue in all_issues:
-            print(f"User: {issue['user_email']}")
-            print(f"Category: {issue['category_name']} (ID: {issue['category_id']}) ({'Unallocated Funds' if issue['is_unallocated_funds'] else 'Regular Category'})")
-            print(f"Stored: ${issue['stored_available']:.2f} | Expected: ${issue['expected_available']:.2f} | Diff: ${issue['discrepancy']:.2f}")
-            
-            if issue['is_unallocated_funds']:
-                print(f"Breakdown - Transactions to Unallocated: ${issue['total_transactions']:.2f}, Total User Assignments: ${issue.get('total_all_assignments', 0.0):.2f}")
-            else:
-                print(f"Breakdown - Assignments: ${issue['total_assignments']:.2f}, Transactions: ${issue['total_transactions']:.2f}")
-            print("-" * 40)
+    if repair:
+        print(f"Repairs: {summary_stats['repairs']}")
+    if summary_stats['categories_with_issues']:
+        print(f"\n❌ Found {summary_stats['categories_with_issues']} categories with availability discrepancies!")
     else:
         print("\n✅ All category available amounts are correct!")
-    
-    # Save detailed results to JSON file with timestamp in db_validations folder
-    timestamp = datetime.datetime.now()
-    timestamp_str = timestamp.strftime("%Y%m%d_%H%M%S")
-    
-    # Create db_validations directory if it doesn't exist
-    validations_dir = 'db_validations'
-    os.makedirs(validations_dir, exist_ok=True)
-    
-    filename = f'db_validation_results_{timestamp_str}.json'
-    filepath = os.path.join(validations_dir, filename)
-    
-    results = {
-        'validation_timestamp': timestamp.isoformat(),
-        'summary': summary_stats,
-        'issues': all_issues
-    }
-    
-    with open(filepath, 'w') as json_file:
-        json.dump(results, json_file, indent=4, default=custom_serializer)
-    
     print(f"\nDetailed results saved to: {filepath}")
-    
-    return len(all_issues) == 0
-
-def get_transaction_details_for_category(category_id, transactions):
-    """Get detailed breakdown of transactions for a specific category"""
-    category_transactions = [t for t in transactions if t.get('category_id') == category_id]
-    
-    print(f"\nTransaction details for category {category_id}:")
-    total = 0.0
-    for transaction in category_transactions:
-        amount = transaction.get('amount', 0.0)
-        name = transaction.get('name', 'Unknown')
-        date = transaction.get('date', 'Unknown')
-        total += amount
-        print(f"  {date}: {name} - ${amount:.2f}")
-    
-    print(f"Total transaction amount: ${total:.2f}")
-    return total
-
-def get_assignment_details_for_category(category_id, assignments):
-    """Get detailed breakdown of assignments for a specific category"""
-    category_assignments = [a for a in assignments if a.get('category_id') == category_id]
-    
-    print(f"\nAssignment details for category {category_id}:")
-    total = 0.0
-    for assignment in category_assignments:
-        amount = assignment.get('amount', 0.0)
-        date = assignment.get('date', 'Unknown')
-        total += amount
-        print(f"  {date}: Assignment - ${amount:.2f}")
-    
-    print(f"Total assignment amount: ${total:.2f}")
-    return total
 
-def get_all_assignment_details_for_user(assignments):
-    """Get detailed breakdown of ALL assignments for a user (useful for unallocated funds debugging)"""
-    print(f"\nAll assignment details for user:")
-    total = 0.0
-    for assignment in assignments:
-        amount = assignment.get('amount', 0.0)
-        date = assignment.get('date', 'Unknown')
-        category_id = assignment.get('category_id', 'Unknown')
-        total += amount
-        print(f"  {date}: Assignment to {category_id} - ${amount:.2f}")
-    
-    print(f"Total ALL assignments amount: ${total:.2f}")
-    return total
+    return summary_stats['categories_with_issues'] == 0, filepath
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check every category's available amount against its transactions and assignments")
+    parser.add_argument("--users", nargs="+", help="User IDs to check (default: every user)")
+    parser.add_argument("--workers", type=int, default=32, help="Users checked in parallel")
+    parser.add_argument("--processes", action="store_true",
+                        help="Use worker processes instead of threads (not with DB_BACKEND=memory, whose data is per process)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only read what changed since each user's last reconciliation (see api/reconciliation.py)")
+    parser.add_argument("--repair", action="store_true", help="Correct the wrong balances found (see api/balance_repair.py)")
+    parser.add_argument("--dry-run", action="store_true", help="With --repair, list the corrections without making them")
+    parser.add_argument("--max-repairs-per-second", type=float, default=50, help="Pace of the corrections")
+    args = parser.parse_args()
+
     try:
         # Run the validation
-        is_valid = validate_database_integrity()
-        
+        is_valid, _ = validate_database_integrity(
+            args.users, args.workers, args.processes, incremental=args.incremental,
+            repair=args.repair, dry_run=args.dry_run, max_repairs_per_second=args.max_repairs_per_second,
+        )
+
         if is_valid:
             print("\n🎉 Database integrity check PASSED!")
             exit(0)
         else:
             print("\n⚠️  Database integrity check FAILED!")
             exit(1)
-            
+
     except Exception as e:
         print(f"\n❌ Error during validation: {e}")
         import traceback
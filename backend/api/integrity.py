@@ -0,0 +1,137 @@
+"""
+Balance integrity checks: every category's stored available amount (shards included) must equal
+the one recomputed from the user's transactions and assignments.
+
+- Regular categories: sum of the assignments to the category + sum of its transactions
+- Unallocated Funds: sum of its transactions - sum of ALL of the user's assignments (money is
+  assigned from Unallocated Funds to the other categories, which never receive it directly)
+
+Transaction amounts are negative for expenses and positive for income; assignment amounts are
+what was moved into a category. All amounts are integer cents, so balances must match exactly.
+
+A user's documents are summed per category in one pass (`Ledger`), so checking a user is
+linear in their documents; archived transactions are counted from their blocks' category
+totals, without decompressing the blocks. `check_user` is safe to call from several threads;
+`verify_user` is its async counterpart for the API (`POST /admin/verify-user`), reading the
+collections concurrently.
+"""
+from collections import defaultdict
+from .db import repos
+from .db_async import run_db, gather_db
+from .balance_counters import balance_counters
+from backend.db.schemas import read_cents, from_cents
+
+class Ledger:
+    """Per-category sums in cents of one user's transactions and assignments"""
+
+    def __init__(self):
+        self.transactions = defaultdict(int)  # category_id -> summed transaction amounts
+        self.assignments = defaultdict(int)  # category_id -> summed assignment amounts
+        self.transaction_counts = defaultdict(int)  # category_id -> number of transactions
+        self.assignment_counts = defaultdict(int)  # category_id -> number of assignments
+        self.assigned_total = 0
+        self.transaction_count = 0
+        self.assignment_count = 0
+
+    def add_transaction(self, data):
+        self.transactions[data.get("category_id")] += read_cents(data, "amount")
+        self.transaction_counts[data.get("category_id")] += 1
+        self.transaction_count += 1
+
+    def add_archive_block(self, block_data):
+        """Count the transactions still held by an archive block, from its category totals"""
+        for category_id, totals in (block_data.get("category_totals") or {}).items():
+            self.transactions[category_id] += totals.get("amount_cents", 0)
+            self.transaction_counts[category_id] += totals.get("count", 0)
+            self.transaction_count += totals.get("count", 0)
+
+    def add_assignment(self, data):
+        amount_cents = read_cents(data, "amount")
+        self.assignments[data.get("category_id")] += amount_cents
+        self.assignment_counts[data.get("category_id")] += 1
+        self.assigned_total += amount_cents
+        self.assignment_count += 1
+
+    def expected_available(self, category_id, is_unallocated_funds=False):
+        if is_unallocated_funds:
+            return self.transactions.get(category_id, 0) - self.assigned_total
+        return self.assignments.get(category_id, 0) + self.transactions.get(category_id, 0)
+
+def build_ledger(transaction_docs, block_docs, assignment_docs):
+    ledger = Ledger()
+    for doc in transaction_docs:
+        ledger.add_transaction(doc.to_dict())
+    for block in block_docs:
+        ledger.add_archive_block(block.to_dict())
+    for doc in assignment_docs:
+        ledger.add_assignment(doc.to_dict())
+    return ledger
+
+def load_ledger(user_id):
+    """The user's Ledger, from one query per collection (archived transactions come from their blocks)"""
+    return build_ledger(
+        repos.transactions.where(user_id=user_id).stream(),
+        repos.transaction_archive.blocks(user_id),
+        repos.assignments.for_user(user_id),
+    )
+
+def category_issue(user_id, user_email, category_id, category_data, stored_cents, ledger):
+    """Description of a category whose stored balance is wrong, or None when it is right"""
+    is_unallocated = category_data.get("is_unallocated_funds", False)
+    expected_cents = ledger.expected_available(category_id, is_unallocated)
+    if stored_cents == expected_cents:
+        return None
+    issue = {
+        "user_id": user_id,
+        "user_email": user_email,
+        "category_id": category_id,
+        "category_name": category_data.get("name", "Unknown"),
+        "is_unallocated_funds": is_unallocated,
+        "stored_available": from_cents(stored_cents),
+        "expected_available": from_cents(expected_cents),
+        "discrepancy": from_cents(abs(stored_cents - expected_cents)),
+        "total_assignments": from_cents(0 if is_unallocated else ledger.assignments.get(category_id, 0)),
+        "total_transactions": from_cents(ledger.transactions.get(category_id, 0)),
+        "transaction_count": ledger.transaction_counts.get(category_id, 0),
+        "assignment_count": ledger.assignment_count if is_unallocated else ledger.assignment_counts.get(category_id, 0),
+    }
+    if is_unallocated:
+        issue["total_all_assignments"] = from_cents(ledger.assigned_total)
+    return issue
+
+def category_issues(user_id, user_email, categories, stored, ledger):
+    """Issues of the categories (snapshots) whose stored balance in {category_id: cents} is wrong"""
+    return [
+        issue for issue in (
+            category_issue(user_id, user_email, doc.id, doc.to_dict(), stored[doc.id], ledger) for doc in categories
+        ) if issue
+    ]
+
+def user_result(user_id, user_email, categories, stored, ledger):
+    return {
+        "user_id": user_id,
+        "categories": len(categories),
+        "transactions": ledger.transaction_count,
+        "assignments": ledger.assignment_count,
+        "issues": category_issues(user_id, user_email, categories, stored, ledger),
+    }
+
+def check_user(user_id, user_email=None):
+    """
+    Check every category of the user; returns the counts of what was read and the issues found
+    ({"user_id", "categories", "transactions", "assignments", "issues"})
+    """
+    categories = list(repos.categories.for_user(user_id))
+    stored = balance_counters.totals(categories)
+    return user_result(user_id, user_email, categories, stored, load_ledger(user_id))
+
+async def verify_user(user_id, user_email=None):
+    """`check_user`, with the user's categories, transactions, archive blocks and assignments read concurrently"""
+    categories, transaction_docs, block_docs, assignment_docs = await gather_db(
+        lambda: list(repos.categories.for_user(user_id)),
+        lambda: list(repos.transactions.where(user_id=user_id).stream()),
+        lambda: list(repos.transaction_archive.blocks(user_id)),
+        lambda: list(repos.assignments.for_user(user_id)),
+    )
+    stored = await run_db(balance_counters.totals, categories)
+    return user_result(user_id, user_email, categories, stored, build_ledger(transaction_docs, block_docs, assignment_docs))
@@ -0,0 +1,202 @@
+"""
+Benchmark of the database integrity check (api/db_validation_check.py) on generated users.
+
+--users users get a few categories, --transactions transactions and some assignments each,
+written directly in batches with consistent balances; --corrupt of their categories then get a
+wrong balance. Every read and query is delayed by --latency-ms (a simulated round trip, as in
+load_test.py). The check runs over every user with --workers threads, and over the first
+--baseline-users users with a single worker, for comparison; it must report exactly the
+corrupted categories. Results go to integrity_benchmarks/; the script exits with status 1 if
+an issue is missed or spurious.
+
+With --incremental, the users are then reconciled twice (api/reconciliation.py): a first run
+records their watermarks, --changed-users of them get a new transaction, and the second run,
+timed, must read only the changes and report the same issues. Its time is reported next to the
+full check's: it reads far fewer documents but makes more round trips per user, so it is only
+faster when the users' histories are large.
+
+Usage (from the backend directory):
+    python api/integrity_benchmark.py --users 10000 --workers 64
+    python api/integrity_benchmark.py --incremental --changed-users 500
+"""
+import os
+import sys
+import argparse
+import datetime
+import json
+import random
+import time
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+# The benchmark creates its own users; it must not run against a real database
+if os.getenv("DB_BACKEND", "memory") == "firestore":
+    sys.exit("The integrity benchmark creates its own data; run it with DB_BACKEND=memory or DB_BACKEND=sqlite")
+os.environ.setdefault("DB_BACKEND", "memory")
+
+from api.db import repos, Increment
+from api.load_test import add_round_trip_latency
+from api.db_validation_check import run_checks
+from backend.db.schemas import TransactionRecord, AssignmentRecord
+
+def create_users(user_count, transactions_per_user, seed):
+    """Create the users with consistent balances; returns their (user_id, email) and {category_id: user_id}"""
+    rng = random.Random(seed)
+    users, category_owners = [], {}
+    batch, pending = repos.batch(), 0
+
+    def write(operation, reference, data):
+        nonlocal batch, pending
+        getattr(batch, operation)(reference, data)
+        pending += 1
+        if pending >= repos.max_batch_writes:
+            batch.commit()
+            batch, pending = repos.batch(), 0
+
+    for index in range(user_count):
+        user_id = f"integrity-benchmark-{index:05d}"
+        users.append((user_id, f"{user_id}@benchmark.local"))
+        repos.users.ref(user_id).set({"email": users[-1][1], "data_layout": "flat"})
+        unallocated_id = f"{user_id}-unallocated"
+        categories = [f"{user_id}-category-{number}" for number in range(3)]
+        balances = dict.fromkeys([unallocated_id] + categories, 0)
+
+        for number in range(transactions_per_user):
+            category_id = rng.choice(categories) if rng.random() < 0.8 else unallocated_id
+            amount_cents = rng.randint(-20_000, 5_000)
+            balances[category_id] += amount_cents
+            write("set", repos.transactions.ref(f"{user_id}-t{number}", user_id=user_id, layout="flat"), TransactionRecord(
+                amount_cents=amount_cents, user_id=user_id, name=f"Merchant {rng.randint(1, 50)}",
+                date=f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d}", category_id=category_id,
+            ).to_dict())
+        for number, category_id in enumerate(categories):
+            amount_cents = rng.randint(1, 100_000)
+            balances[category_id] += amount_cents
+            balances[unallocated_id] -= amount_cents
+            write("set", repos.assignments.ref(f"{user_id}-a{number}", user_id=user_id, layout="flat"), AssignmentRecord(
+                amount_cents=amount_cents, user_id=user_id, category_id=category_id, date="2026-01-01",
+            ).to_dict())
+        for category_id, available_cents in balances.items():
+            write("set", repos.categories.ref(category_id, user_id=user_id, layout="flat"), {
+                "user_id": user_id, "name": category_id.rsplit("-", 2)[-2].title(), "available_cents": available_cents,
+                "is_unallocated_funds": category_id == unallocated_id,
+            })
+        category_owners.update(dict.fromkeys(balances, user_id))
+    batch.commit()
+    return users, category_owners
+
+def timed_check(users, workers, incremental=False):
+    started = time.perf_counter()
+    results = list(run_checks(iter(users), workers, incremental=incremental))
+    return results, time.perf_counter() - started
+
+def add_transactions(users, seed):
+    """Give each user a new transaction in their first category, with its balance updated in the same batch"""
+    rng = random.Random(seed)
+    for user_id, _ in users:
+        category_id = f"{user_id}-category-0"
+        amount_cents = rng.randint(-20_000, 5_000)
+        batch = repos.batch()
+        batch.set(repos.transactions.ref(f"{user_id}-changed", user_id=user_id), TransactionRecord(
+            amount_cents=amount_cents, user_id=user_id, name="Changed", date="2026-10-01", category_id=category_id,
+        ).to_dict())
+        batch.update(repos.categories.ref(category_id, user_id=user_id), {"available_cents": Increment(amount_cents)})
+        batch.commit()
+
+def issue_ids(results):
+    return {issue["category_id"] for result in results for issue in result["issues"]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the parallel database integrity check")
+    parser.add_argument("--users", type=int, default=2000, help="Generated users")
+    parser.add_argument("--transactions", type=int, default=50, help="Transactions per user")
+    parser.add_argument("--corrupt", type=int, default=20, help="Categories given a wrong balance")
+    parser.add_argument("--workers", type=int, default=64, help="Threads of the parallel check")
+    parser.add_argument("--baseline-users", type=int, default=100, help="Users checked with a single worker for comparison")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Simulated database round trip latency")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated data")
+    parser.add_argument("--incremental", action="store_true", help="Also benchmark the incremental reconciliation")
+    parser.add_argument("--changed-users", type=int, default=200, help="Users changed between the reconciliation runs")
+    args = parser.parse_args()
+
+    print(f"Creating {args.users} users with {args.transactions} transactions each...")
+    users, category_owners = create_users(args.users, args.transactions, args.seed)
+    corrupted = set(random.Random(args.seed).sample(sorted(category_owners), args.corrupt))
+    for category_id in corrupted:
+        repos.categories.update(category_id, {"available_cents": Increment(1)}, user_id=category_owners[category_id])
+    add_round_trip_latency(args.latency_ms / 1000)
+
+    print(f"Checking {len(users)} users with {args.workers} workers ({args.latency_ms}ms simulated latency)...")
+    results, parallel_seconds = timed_check(users, args.workers)
+    baseline_users = users[:args.baseline_users]
+    print(f"Checking {len(baseline_users)} users with 1 worker...")
+    _, serial_seconds = timed_check(baseline_users, 1)
+
+    found = issue_ids(results)
+    missed, spurious = sorted(corrupted - found), sorted(found - corrupted)
+    users_per_second = len(users) / parallel_seconds
+    serial_users_per_second = len(baseline_users) / serial_seconds
+    summary = {
+        "users_checked": len(results),
+        "categories_checked": sum(result["categories"] for result in results),
+        "transactions_read": sum(result["transactions"] for result in results),
+        "parallel_seconds": round(parallel_seconds, 2),
+        "users_per_second": round(users_per_second, 1),
+        "serial_users_per_second": round(serial_users_per_second, 1),
+        "speedup": round(users_per_second / serial_users_per_second, 1),
+        "projected_minutes_for_10k_users": round(10_000 / users_per_second / 60, 2),
+        "issues_found": len(found),
+        "missed": missed,
+        "spurious": spurious,
+    }
+
+    if args.incremental:
+        print(f"Recording reconciliation watermarks of {len(users)} users...")
+        timed_check(users, args.workers, incremental=True)
+        add_transactions(users[:args.changed_users], args.seed + 1)
+        print(f"Reconciling {len(users)} users incrementally ({args.changed_users} changed)...")
+        incremental_results, incremental_seconds = timed_check(users, args.workers, incremental=True)
+        incremental_found = issue_ids(incremental_results)
+        summary["incremental"] = {
+            "seconds": round(incremental_seconds, 2),
+            "users_per_second": round(len(users) / incremental_seconds, 1),
+            "full_check_seconds": round(parallel_seconds, 2),
+            "transactions_read": sum(result["transactions"] for result in incremental_results),
+            "transactions_read_by_full_check": summary["transactions_read"],
+            "incremental_users": sum(1 for result in incremental_results if result["mode"] == "incremental"),
+            "full_fallbacks": sum(1 for result in incremental_results if result["mode"] == "full"),
+            "missed": sorted(corrupted - incremental_found),
+            "spurious": sorted(incremental_found - corrupted),
+        }
+        missed += summary["incremental"]["missed"]
+        spurious += summary["incremental"]["spurious"]
+
+    print(f"\n📊 Integrity check")
+    print(f"  Users: {summary['users_checked']} in {summary['parallel_seconds']}s ({summary['users_per_second']} users/s, "
+          f"{summary['speedup']}x the single worker's {summary['serial_users_per_second']} users/s)")
+    print(f"  Projected for 10k users: {summary['projected_minutes_for_10k_users']} minutes")
+    print(f"  Corrupted categories found: {len(corrupted) - len(summary['missed'])} of {len(corrupted)}, spurious issues: {len(summary['spurious'])}")
+    if args.incremental:
+        incremental = summary["incremental"]
+        print(f"  Incremental: {incremental['seconds']}s ({incremental['users_per_second']} users/s; full check "
+              f"{incremental['full_check_seconds']}s), {incremental['transactions_read']} transactions read "
+              f"(full check: {incremental['transactions_read_by_full_check']}), {incremental['full_fallbacks']} full recomputes")
+        print(f"  Corrupted categories found incrementally: {len(corrupted) - len(incremental['missed'])} of {len(corrupted)}, "
+              f"spurious issues: {len(incremental['spurious'])}")
+
+    # Save results to a JSON file with timestamp in the integrity_benchmarks folder
+    timestamp = datetime.datetime.now()
+    benchmarks_dir = 'integrity_benchmarks'
+    os.makedirs(benchmarks_dir, exist_ok=True)
+    filepath = os.path.join(benchmarks_dir, f'integrity_benchmark_{timestamp.strftime("%Y%m%d_%H%M%S")}.json')
+    with open(filepath, 'w') as json_file:
+        json.dump({"benchmark_timestamp": timestamp.isoformat(), "settings": vars(args), "summary": summary}, json_file, indent=4)
+
+    print(f"\nDetailed results saved to: {filepath}")
+    sys.exit(1 if missed or spurious else 0)
@@ -0,0 +1,222 @@
+"""
+Load test for the read-heavy budget endpoints with concurrent users.
+
+The app runs in-process on one event loop (like a single uvicorn worker) against a local
+storage backend seeded with one budget per virtual user. Every database round trip is delayed
+by --latency-ms to model Firestore network latency, which is what blocks the event loop when
+handlers call the synchronous client directly.
+
+Each virtual user repeatedly loads its budget screen (get-categories, get-allocated-and-spent,
+get-transactions) for --duration seconds. Pass --blocking to run the database calls inline on
+the event loop instead of in the threadpool, reproducing the behaviour before handlers were
+made non-blocking, and compare throughput and latency between the two runs.
+
+Usage (from the backend directory):
+    python api/load_test.py --users 50 --duration 20
+    python api/load_test.py --users 50 --duration 20 --blocking
+"""
+import os
+import sys
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+from collections import defaultdict
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+# Seeded data must not reach a real database
+if os.getenv("DB_BACKEND", "memory") == "firestore":
+    sys.exit("The load test seeds its own data; run it with DB_BACKEND=memory or DB_BACKEND=sqlite")
+os.environ.setdefault("DB_BACKEND", "memory")
+
+import httpx
+from api import db_async
+from api.db import repos
+from backend.db.backends import document_store
+from backend.db.schemas import User as UserSchema, Category as CategorySchema, TransactionRecord, AssignmentRecord
+
+START_DATE = "2026-01-01"
+END_DATE = "2026-01-31"
+
+def add_round_trip_latency(latency_seconds):
+    """Delay every read, query and commit of the local backends by one simulated network round trip"""
+    if latency_seconds <= 0:
+        return
+
+    original_get = document_store.DocumentReference.get
+    original_run = document_store.Query._run
+    original_commit = document_store.WriteBatch.commit
+
+    def get(self, *args, **kwargs):
+        time.sleep(latency_seconds)
+        return original_get(self, *args, **kwargs)
+
+    def run(self):
+        time.sleep(latency_seconds)
+        return original_run(self)
+
+    def commit(self, *args, **kwargs):
+        time.sleep(latency_seconds)
+        return original_commit(self, *args, **kwargs)
+
+    def get_all(self, references, *args, **kwargs):
+        # One round trip for the whole set of documents
+        time.sleep(latency_seconds)
+        for reference in references:
+            yield original_get(reference)
+
+    document_store.DocumentReference.get = get
+    document_store.Query._run = run
+    document_store.WriteBatch.commit = commit
+    document_store.DocumentStoreClient.get_all = get_all
+
+def run_database_calls_inline():
+    """Run database calls directly on the event loop, as the handlers did before"""
+    async def run_inline(func, *args, **kwargs):
+        return func(*args, **kwargs)
+    db_async.run_in_threadpool = run_inline
+
+def seed_users(user_count, categories_per_user, transactions_per_user, seed):
+    """Create one budget per virtual user; returns the user IDs"""
+    rng = random.Random(seed)
+    user_ids = []
+    for user_index in range(user_count):
+        user_id = f"load-test-user-{user_index}"
+        repos.users.create(UserSchema(email=f"{user_id}@load-test.local").to_dict(), document_id=user_id)
+
+        category_ids = []
+        batch = repos.batch()
+        for category_index in range(categories_per_user):
+            category_ref = repos.categories.ref(user_id=user_id)
+            batch.set(category_ref, CategorySchema(
+                name=f"Category {category_index}",
+                user_id=user_id,
+                available_cents=0,
+                is_unallocated_funds=category_index == 0
+            ).to_dict())
+            category_ids.append(category_ref.id)
+        batch.commit()
+
+        batch = repos.batch()
+        for category_id in category_ids[1:]:
+            batch.set(repos.assignments.ref(user_id=user_id), AssignmentRecord(
+                amount_cents=10000, user_id=user_id, category_id=category_id, date="2026-01-01"
+            ).to_dict())
+        batch.commit()
+
+        for start in range(0, transactions_per_user, 400):
+            batch = repos.batch()
+            for _ in range(start, min(start + 400, transactions_per_user)):
+                batch.set(repos.transactions.ref(user_id=user_id), TransactionRecord(
+                    amount_cents=-rng.randint(100, 20000),
+                    name="Load test transaction",
+                    date=f"2026-01-{rng.randint(1, 31):02d}",
+                    user_id=user_id,
+                    category_id=rng.choice(category_ids + [None]),
+                ).to_dict())
+            batch.commit()
+        user_ids.append(user_id)
+    return user_ids
+
+async def virtual_user(client, user_id, deadline, latencies, errors):
+    """Load the budget screen repeatedly until the deadline"""
+    requests = [
+        ("/category/get-categories", {"user_id": user_id}),
+        ("/category/get-allocated-and-spent", {"user_id": user_id, "start_date": START_DATE, "end_date": END_DATE}),
+        ("/transaction/get-transactions", {"user_id": user_id, "limit": 20}),
+    ]
+    while time.perf_counter() < deadline:
+        for path, body in requests:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies[path].append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors[path] += 1
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+async def run_load_test(app, user_ids, duration):
+    # The app's lifespan doesn't run under ASGITransport, so size the threadpool here
+    db_async.configure_threadpool()
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(virtual_user(client, user_id, deadline, latencies, errors) for user_id in user_ids))
+        elapsed = time.perf_counter() - start
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": len(all_latencies),
+        "throughput_rps": round(len(all_latencies) / elapsed, 2),
+        "p50_ms": round(percentile(all_latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(all_latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(all_latencies, 0.99) * 1000, 1),
+        "errors": sum(errors.values()),
+        "endpoints": {
+            path: {
+                "requests": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "errors": errors[path],
+            }
+            for path, values in latencies.items()
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the budget endpoints with concurrent users")
+    parser.add_argument("--users", type=int, default=50, help="Number of concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run the load for")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Simulated database round trip latency")
+    parser.add_argument("--categories", type=int, default=10, help="Categories per user")
+    parser.add_argument("--transactions", type=int, default=300, help="Transactions per user")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated transactions")
+    parser.add_argument("--blocking", action="store_true", help="Run database calls on the event loop (pre-change behaviour)")
+    args = parser.parse_args()
+
+    print(f"Seeding {args.users} users...")
+    user_ids = seed_users(args.users, args.categories, args.transactions, args.seed)
+
+    add_round_trip_latency(args.latency_ms / 1000)
+    if args.blocking:
+        run_database_calls_inline()
+
+    import main
+    mode = "blocking" if args.blocking else "threadpool"
+    print(f"Running {args.users} users for {args.duration}s ({mode}, {args.latency_ms}ms simulated latency)...")
+    results = asyncio.run(run_load_test(main.app, user_ids, args.duration))
+
+    print(f"  Throughput: {results['throughput_rps']} req/s ({results['requests']} requests, {results['errors']} errors)")
+    print(f"  Latency:    p50 {results['p50_ms']}ms, p95 {results['p95_ms']}ms, p99 {results['p99_ms']}ms")
+    for path, endpoint in results["endpoints"].items():
+        print(f"    {path}: {endpoint['requests']} requests, p50 {endpoint['p50_ms']}ms, p95 {endpoint['p95_ms']}ms")
+
+    # Save results to a JSON file with timestamp in the load_tests folder
+    timestamp = datetime.datetime.now()
+    load_tests_dir = 'load_tests'
+    os.makedirs(load_tests_dir, exist_ok=True)
+    filepath = os.path.join(load_tests_dir, f'load_test_{mode}_{timestamp.strftime("%Y%m%d_%H%M%S")}.json')
+    with open(filepath, 'w') as json_file:
+        json.dump({
+            "load_test_timestamp": timestamp.isoformat(),
+            "mode": mode,
+            "settings": vars(args),
+            "results": results
+        }, json_file, indent=4)
+
+    print(f"\nDetailed results saved to: {filepath}")
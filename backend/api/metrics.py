@@ -0,0 +1,105 @@
+"""
+Request metrics in the Prometheus text exposition format, served at `GET /metrics`.
+
+The request middleware in main.py records, per route template (`/transaction/get-transactions`,
+not the raw path, so the series stay few) and method:
+- `http_requests_total`: requests by response status
+- `http_request_duration_seconds`: latency histogram; streaming responses (the change feed,
+  snapshots) are timed up to their headers
+- `http_requests_in_flight`: requests being handled
+- `firestore_document_reads_total`, `firestore_document_writes_total`, `firestore_queries_total`
+  and `firestore_batch_commits_total`: the operations the requests made through the
+  instrumented client (api/db_instrumentation.py), so the cost of each route is its share of
+  these (and the cost per request, their ratio to `http_requests_total`)
+
+Metrics are per process and reset on restart; Prometheus sums the processes it scrapes.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+# Upper bounds of the latency histogram buckets, in seconds (Plaid syncs can take a minute)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Firestore operation counters: (OperationCounts attribute, metric name, help text)
+OPERATION_METRICS = (
+    ("reads", "firestore_document_reads_total", "Firestore documents read by requests"),
+    ("writes", "firestore_document_writes_total", "Firestore documents written by requests"),
+    ("queries", "firestore_queries_total", "Firestore queries run by requests"),
+    ("batch_commits", "firestore_batch_commits_total", "Firestore batches committed by requests"),
+)
+
+# Route label of requests that matched no route (e.g. 404s for arbitrary paths)
+UNMATCHED_ROUTE = "unmatched"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class RequestMetrics:
+    """Thread-safe totals of the requests a process handled"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = defaultdict(int)  # (method, route, status) -> requests
+        self.latency_counts = defaultdict(lambda: [0] * (len(buckets) + 1))  # (method, route) -> per bucket, then +Inf
+        self.latency_sums = defaultdict(float)  # (method, route) -> summed seconds
+        self.operations = defaultdict(lambda: defaultdict(int))  # (method, route) -> {operation: count}
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, method, route, status, seconds, operations=None):
+        """Record a finished request, with its OperationCounts"""
+        key = (method, route or UNMATCHED_ROUTE)
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[key + (status,)] += 1
+            self.latency_counts[key][bisect_left(self.buckets, seconds)] += 1
+            self.latency_sums[key] += seconds
+            if operations is not None:
+                for attribute, _, _ in OPERATION_METRICS:
+                    self.operations[key][attribute] += getattr(operations, attribute)
+
+    def render(self):
+        """The metrics in the Prometheus text format"""
+        with self._lock:
+            lines = [
+                "# HELP http_requests_in_flight Requests being handled",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+                "# HELP http_requests_total Requests handled, by route and status",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+            lines += [
+                "# HELP http_request_duration_seconds Request latency, by route",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (method, route), counts in sorted(self.latency_counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    labels = _labels(method=method, route=route, le=_number(bound))
+                    lines.append(f"http_request_duration_seconds_bucket{labels} {cumulative}")
+                labels = _labels(method=method, route=route)
+                lines.append(f"http_request_duration_seconds_sum{labels} {_number(self.latency_sums[(method, route)])}")
+                lines.append(f"http_request_duration_seconds_count{labels} {cumulative}")
+
+            for attribute, name, help_text in OPERATION_METRICS:
+                lines += [f"# HELP {name} {help_text}, by route", f"# TYPE {name} counter"]
+                for (method, route), counts in sorted(self.operations.items()):
+                    lines.append(f"{name}{_labels(method=method, route=route)} {counts[attribute]}")
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,99 @@
+"""
+Migration: convert stored money amounts from float dollars to integer cents.
+
+Documents written before amounts were stored as cents hold them as floats in `amount`
+(transactions and assignments), `available` and `goal_amount` (categories) and `available`
+(category counter shards). Each one is rewritten in batches of up to 500 documents so the
+amount lives only in the matching `<field>_cents` field. Documents without a legacy field are
+skipped, so the migration can be re-run safely.
+
+Balances (`available`) are moved with an increment of `available_cents`, so the migration can
+run while the app is serving requests: balance increments made meanwhile are kept. The code
+reading amounts (`read_cents`) sums both fields, so run the migration only once every server
+runs that code. Transaction amounts are overwritten, so avoid running it during a Plaid sync.
+Only the flat layout is converted, so run it before moving users to the partitioned layout
+(`api/migrate_user_partitions.py`).
+
+Usage (from the backend directory):
+    python api/migrate_money_to_cents.py --dry-run
+    python api/migrate_money_to_cents.py
+"""
+import os
+import sys
+import argparse
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+from api.db import repos, Increment, DELETE_FIELD
+from backend.db.schemas import to_cents
+
+BATCH_SIZE = 500
+
+def cents_update(data, amount_fields=(), balance_fields=()):
+    """Update moving each legacy float field of a document to its `_cents` field, or None if there is nothing to move"""
+    update = {}
+    for field in amount_fields:
+        if field in data:
+            update[f"{field}_cents"] = None if data[field] is None else to_cents(data[field])
+            update[field] = DELETE_FIELD
+    for field in balance_fields:
+        if field in data:
+            update[f"{field}_cents"] = Increment(to_cents(data[field] or 0))
+            update[field] = DELETE_FIELD
+    return update or None
+
+def migrate(dry_run=False):
+    stats = {"documents": 0, "already_migrated": 0, "updated": 0}
+    pending = []
+
+    def flush():
+        if pending and not dry_run:
+            batch = repos.batch()
+            for reference, update in pending:
+                batch.update(reference, update)
+            batch.commit()
+        pending.clear()
+
+    def migrate_document(doc, **fields):
+        stats["documents"] += 1
+        update = cents_update(doc.to_dict(), **fields)
+        if update is None:
+            stats["already_migrated"] += 1
+            return
+        pending.append((doc.reference, update))
+        stats["updated"] += 1
+        if len(pending) >= BATCH_SIZE:
+            flush()
+
+    for doc in repos.transactions.collection.stream():
+        migrate_document(doc, amount_fields=("amount",))
+    for doc in repos.assignments.collection.stream():
+        migrate_document(doc, amount_fields=("amount",))
+
+    for doc in repos.categories.collection.stream():
+        migrate_document(doc, amount_fields=("goal_amount",), balance_fields=("available",))
+        shard_count = doc.to_dict().get("available_shards")
+        if shard_count:
+            shard_refs = [doc.reference.collection(repos.categories.shards_collection_name).document(str(i)) for i in range(shard_count)]
+            for shard_doc in repos.client.get_all(shard_refs):
+                if shard_doc.exists:
+                    migrate_document(shard_doc, balance_fields=("available",))
+    flush()
+
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored money amounts from float dollars to integer cents")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    stats = migrate(dry_run=args.dry_run)
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}Documents: {stats['documents']}, already migrated: {stats['already_migrated']}, "
+          f"updated: {stats['updated']}")
@@ -0,0 +1,75 @@
+"""
+Migration: record each user's unallocated funds category ID on the user document.
+
+Users created before `unallocated_category_id` was added to the user schema don't have it.
+The unallocated funds categories of all users are read with a single query, then the missing
+IDs are written in batches of up to 500 users. Users that already have the field are skipped,
+so the migration can be re-run safely. (Users missed by the migration are also backfilled
+lazily the first time their metadata is loaded.)
+
+Usage (from the backend directory):
+    python api/migrate_unallocated_category_ids.py --dry-run
+    python api/migrate_unallocated_category_ids.py
+"""
+import os
+import sys
+import argparse
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+from api.db import repos
+
+BATCH_SIZE = 500
+
+def migrate(dry_run=False):
+    # One query for every user's unallocated funds category
+    unallocated_by_user = {}
+    for doc in repos.categories.find(is_unallocated_funds=True):
+        unallocated_by_user.setdefault(doc.to_dict().get("user_id"), doc.id)
+
+    stats = {"users": 0, "already_migrated": 0, "updated": 0, "missing_category": 0}
+    pending = []
+
+    def flush():
+        if pending and not dry_run:
+            batch = repos.batch()
+            for user_id, category_id in pending:
+                batch.update(repos.users.ref(user_id), {"unallocated_category_id": category_id})
+            batch.commit()
+        pending.clear()
+
+    for user_doc in repos.users.collection.stream():
+        stats["users"] += 1
+        if user_doc.to_dict().get("unallocated_category_id"):
+            stats["already_migrated"] += 1
+            continue
+
+        category_id = unallocated_by_user.get(user_doc.id)
+        if not category_id:
+            print(f"⚠️ No unallocated funds category for user {user_doc.id}")
+            stats["missing_category"] += 1
+            continue
+
+        pending.append((user_doc.id, category_id))
+        stats["updated"] += 1
+        if len(pending) >= BATCH_SIZE:
+            flush()
+    flush()
+
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record each user's unallocated funds category ID on the user document")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    stats = migrate(dry_run=args.dry_run)
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}Users: {stats['users']}, already migrated: {stats['already_migrated']}, "
+          f"updated: {stats['updated']}, missing unallocated category: {stats['missing_category']}")
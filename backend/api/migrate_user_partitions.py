@@ -0,0 +1,280 @@
+"""
+Migration: move users' categories, transactions, assignments and transaction archive blocks
+from the flat top-level collections to per-user subcollections (`users/{uid}/...`, see
+db/layouts.py), online.
+
+Each user goes through the layouts flat -> dual_write -> partitioned_dual_write -> partitioned:
+1. The user is switched to `dual_write`: from then on every write goes to both copies, while
+   reads still use the flat one.
+2. The user's flat documents (and category counter shards) are copied to the partitioned
+   layout in resumable batches; the last copied document of each collection is checkpointed in
+   `layout_migrations/{uid}`, so an interrupted run continues where it stopped.
+3. Both copies are verified: document counts, amount sums per category and category balances
+   must match. A mismatch (a write that raced with the copy of its document) is repaired by
+   re-copying the collection, up to --verify-rounds times; a user that still doesn't match
+   stays in `dual_write` and is reported.
+4. The user is switched to `partitioned_dual_write`: reads use the partitioned copies and the
+   flat ones are still written, so switching back to `flat` remains possible.
+5. With --finalize, users in `partitioned_dual_write` are switched to `partitioned` and their
+   flat copies are deleted.
+
+Every server caches layouts for USER_LAYOUT_TTL_SECONDS, so the migration waits that long
+(--propagation-seconds) after each switch before relying on it: no request still using the
+previous layout is in flight once the copy starts or the flat copies are deleted.
+
+Usage (from the backend directory):
+    python api/migrate_user_partitions.py --dry-run
+    python api/migrate_user_partitions.py --users USER_ID [USER_ID ...]
+    python api/migrate_user_partitions.py --finalize
+"""
+import os
+import sys
+import argparse
+import time
+from collections import defaultdict
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+from api.db import repos, USER_LAYOUT_TTL_SECONDS
+from backend.db.layouts import FLAT, PARTITIONED, DUAL_WRITE, PARTITIONED_DUAL_WRITE
+from backend.db.schemas import read_cents
+
+BATCH_SIZE = 250
+
+def user_repositories():
+    return [repos.categories, repos.transactions, repos.assignments, repos.transaction_archive]
+
+def flat_query(repository, user_id):
+    return repository.collection_in(FLAT, user_id).where("user_id", "==", user_id)
+
+def partitioned_category(user_id, category_id):
+    return repos.categories.collection_in(PARTITIONED, user_id).document(category_id)
+
+def shard_documents(repository, docs):
+    """(category ID, snapshot) of the counter shards of the sharded categories among the documents"""
+    if repository is not repos.categories:
+        return []
+    refs, category_ids = [], {}
+    for doc in docs:
+        for shard_index in range(doc.to_dict().get("available_shards") or 0):
+            shard_ref = doc.reference.collection(repos.categories.shards_collection_name).document(str(shard_index))
+            refs.append(shard_ref)
+            category_ids[shard_ref.path] = doc.id
+    if not refs:
+        return []
+    return [(category_ids[shard.reference.path], shard) for shard in repos.client.get_all(refs) if shard.exists]
+
+def partitioned_copies(repository, user_id, docs):
+    """(flat snapshot, partitioned reference) of each flat document and its counter shards"""
+    docs = list(docs)
+    copies = [(doc, repository.collection_in(PARTITIONED, user_id).document(doc.id)) for doc in docs]
+    copies += [
+        (shard, partitioned_category(user_id, category_id).collection(repos.categories.shards_collection_name).document(shard.id))
+        for category_id, shard in shard_documents(repository, docs)
+    ]
+    return copies
+
+class BatchWriter:
+    """Writes to a batch that is committed whenever it is full"""
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.writes = 0
+        self._batch = None
+        self._pending = 0
+
+    def _add(self, operation, *args):
+        self.writes += 1
+        if self.dry_run:
+            return
+        if self._batch is None:
+            self._batch = repos.client.batch()
+        getattr(self._batch, operation)(*args)
+        self._pending += 1
+        if self._pending >= repos.max_batch_writes:
+            self.flush()
+
+    def set(self, reference, data, merge=False):
+        self._add("set", reference, data, merge)
+
+    def delete(self, reference):
+        self._add("delete", reference)
+
+    def flush(self):
+        if self._batch is not None:
+            self._batch.commit()
+        self._batch = None
+        self._pending = 0
+
+def set_layout(user_ids, layout, dry_run):
+    if dry_run or not user_ids:
+        return
+    for user_id in user_ids:
+        repos.users.update(user_id, {"data_layout": layout})
+        repos.layouts.invalidate(user_id)
+
+def copy_user(user_id, batch_size, dry_run):
+    """Copy the user's flat documents to the partitioned layout, resuming from the checkpoint; returns the documents copied"""
+    checkpoint_ref = repos.layout_migrations.ref(user_id)
+    checkpoint_doc = checkpoint_ref.get()
+    cursors = (checkpoint_doc.to_dict() if checkpoint_doc.exists else {}).get("copied_through", {})
+    copied = 0
+    for repository in user_repositories():
+        name = repository.collection_name
+        if cursors.get(name) == "done":
+            continue
+        cursor_id = cursors.get(name)
+        while True:
+            query = flat_query(repository, user_id).limit(batch_size)
+            if cursor_id:
+                cursor = repository.collection.document(cursor_id).get()
+                # A deleted cursor document restarts the collection; copies are idempotent
+                if cursor.exists:
+                    query = query.start_after(cursor)
+            docs = list(query.stream())
+            writer = BatchWriter(dry_run)
+            for doc, reference in partitioned_copies(repository, user_id, docs):
+                writer.set(reference, doc.to_dict())
+            copied += len(docs)
+            cursor_id = docs[-1].id if len(docs) == batch_size else "done"
+            cursors[name] = cursor_id
+            writer.set(checkpoint_ref, {"copied_through": dict(cursors)})
+            writer.flush()
+            if cursor_id == "done":
+                break
+    return copied
+
+def recopy_collection(user_id, repository, dry_run):
+    """Make the user's partitioned copy of a collection equal the flat one; returns the writes made"""
+    writer = BatchWriter(dry_run)
+    copied_paths = set()
+    for doc, reference in partitioned_copies(repository, user_id, flat_query(repository, user_id).stream()):
+        copied_paths.add(reference.path)
+        writer.set(reference, doc.to_dict())
+    partitioned_docs = list(repository.collection_in(PARTITIONED, user_id).stream())
+    for doc in partitioned_docs + [shard for _, shard in shard_documents(repository, partitioned_docs)]:
+        if doc.reference.path not in copied_paths:
+            writer.delete(doc.reference)
+    writer.flush()
+    return writer.writes
+
+def summarize(repository, docs):
+    """Counts and cent sums of one copy of a user's collection, keyed so the copies can be compared"""
+    docs = list(docs)
+    if repository is repos.categories:
+        available = {doc.id: read_cents(doc.to_dict(), "available") for doc in docs}
+        for category_id, shard in shard_documents(repository, docs):
+            available[category_id] += read_cents(shard.to_dict(), "available")
+        return {"count": len(docs), "available_cents": available}
+    if repository is repos.transaction_archive:
+        return {"count": len(docs), "blocks": {doc.id: (doc.get("count"), doc.to_dict().get("unarchived")) for doc in docs}}
+    by_category = defaultdict(lambda: [0, 0])
+    for doc in docs:
+        data = doc.to_dict()
+        by_category[data.get("category_id")][0] += 1
+        by_category[data.get("category_id")][1] += read_cents(data, "amount")
+    return {"count": len(docs), "amount_cents": sum(total for _, total in by_category.values()), "by_category": dict(by_category)}
+
+def verify_user(user_id):
+    """Names of the collections whose flat and partitioned copies differ for the user"""
+    mismatched = []
+    for repository in user_repositories():
+        flat = summarize(repository, flat_query(repository, user_id).stream())
+        partitioned = summarize(repository, repository.collection_in(PARTITIONED, user_id).stream())
+        if flat != partitioned:
+            mismatched.append(repository.collection_name)
+    return mismatched
+
+def delete_flat_copies(user_id, dry_run):
+    writer = BatchWriter(dry_run)
+    for repository in user_repositories():
+        for doc, _ in partitioned_copies(repository, user_id, flat_query(repository, user_id).stream()):
+            writer.delete(doc.reference)
+    writer.delete(repos.layout_migrations.ref(user_id))
+    writer.flush()
+    return writer.writes
+
+def wait_for_propagation(seconds, dry_run):
+    if not dry_run and seconds > 0:
+        print(f"Waiting {seconds}s for every server to pick up the new layouts...")
+        time.sleep(seconds)
+
+def migrate(user_ids=None, batch_size=BATCH_SIZE, verify_rounds=3, propagation_seconds=USER_LAYOUT_TTL_SECONDS,
+            finalize=False, dry_run=False):
+    if user_ids is None:
+        users = list(repos.users.collection.stream())
+    else:
+        users = [doc for doc in (repos.users.get(user_id) for user_id in user_ids) if doc.exists]
+    layouts = {doc.id: (doc.to_dict().get("data_layout") or FLAT) for doc in users}
+    stats = {"users": len(layouts), "copied": 0, "repaired_writes": 0, "switched_reads": [], "unverified": {},
+             "finalized": [], "deleted": 0}
+
+    to_copy = [user_id for user_id, layout in layouts.items() if layout in (FLAT, DUAL_WRITE)]
+    set_layout([user_id for user_id in to_copy if layouts[user_id] == FLAT], DUAL_WRITE, dry_run)
+    if any(layouts[user_id] == FLAT for user_id in to_copy):
+        wait_for_propagation(propagation_seconds, dry_run)
+
+    verified = []
+    for user_id in to_copy:
+        stats["copied"] += copy_user(user_id, batch_size, dry_run)
+        if dry_run:
+            continue
+        mismatched = verify_user(user_id)
+        for _ in range(verify_rounds):
+            if not mismatched:
+                break
+            for repository in user_repositories():
+                if repository.collection_name in mismatched:
+                    stats["repaired_writes"] += recopy_collection(user_id, repository, dry_run)
+            mismatched = verify_user(user_id)
+        if mismatched:
+            stats["unverified"][user_id] = mismatched
+        else:
+            verified.append(user_id)
+    set_layout(verified, PARTITIONED_DUAL_WRITE, dry_run)
+    stats["switched_reads"] = verified
+    for user_id in verified:
+        layouts[user_id] = PARTITIONED_DUAL_WRITE
+
+    if finalize:
+        # A user already partitioned with a checkpoint left was interrupted before their flat copies were deleted
+        to_finalize = [
+            user_id for user_id, layout in layouts.items()
+            if layout == PARTITIONED_DUAL_WRITE or (layout == PARTITIONED and repos.layout_migrations.get(user_id).exists)
+        ]
+        if verified:
+            wait_for_propagation(propagation_seconds, dry_run)
+        set_layout([user_id for user_id in to_finalize if layouts[user_id] != PARTITIONED], PARTITIONED, dry_run)
+        wait_for_propagation(propagation_seconds, dry_run)
+        for user_id in to_finalize:
+            stats["deleted"] += delete_flat_copies(user_id, dry_run)
+        stats["finalized"] = to_finalize
+
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move users' documents from the flat layout to per-user subcollections")
+    parser.add_argument("--users", nargs="+", help="User IDs to migrate (default: every user)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Documents copied per batch")
+    parser.add_argument("--verify-rounds", type=int, default=3, help="Times a mismatched collection is re-copied before giving up")
+    parser.add_argument("--propagation-seconds", type=float, default=USER_LAYOUT_TTL_SECONDS,
+                        help="Wait after each layout switch (the servers' USER_LAYOUT_TTL_SECONDS)")
+    parser.add_argument("--finalize", action="store_true", help="Switch migrated users to the partitioned layout and delete their flat copies")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be copied without writing")
+    args = parser.parse_args()
+
+    stats = migrate(args.users, args.batch_size, args.verify_rounds, args.propagation_seconds, args.finalize, args.dry_run)
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}Users: {stats['users']}, documents copied: {stats['copied']}, repair writes: {stats['repaired_writes']}")
+    print(f"{prefix}Reading from the partitioned layout: {len(stats['switched_reads'])} users")
+    for user_id, collections in stats["unverified"].items():
+        print(f"  {user_id}: copies still differ in {', '.join(collections)}; the user stays in {DUAL_WRITE}, re-run to retry")
+    if args.finalize:
+        print(f"{prefix}Finalized: {len(stats['finalized'])} users, flat documents deleted: {stats['deleted']}")
+    sys.exit(1 if stats["unverified"] else 0)
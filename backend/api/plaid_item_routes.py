@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from .db import db
+from .db import repos
+from .db_async import run_db, fetch
 
 router = APIRouter()
 
@@ -14,8 +15,7 @@ class DeletePlaidItemRequest(BaseModel):
 async def get_plaid_items(request: UserIDRequest):
     try:
         # Query plaid_items with a `user_id` field equal to `request.user_id`
-        plaid_items_query = db.collection("plaid_items").where("user_id", "==", request.user_id)
-        plaid_items_docs = plaid_items_query.stream()
+        plaid_items_docs = await fetch(repos.plaid_items.for_user, request.user_id)
 
         # Collect plaid_items into a list, converting each document to a dictionary
         plaid_items = []
@@ -32,7 +32,7 @@ async def get_plaid_items(request: UserIDRequest):
 async def delete_plaid_item(request: DeletePlaidItemRequest):
     try:
         # Delete the plaid_item with the given ID
-        db.collection("plaid_items").document(request.item_id).delete()
+        await run_db(repos.plaid_items.delete, request.item_id)
         return {"success": True, "message": "Plaid item deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete plaid item: {e}")
\ No newline at end of file
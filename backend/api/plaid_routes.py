@@ -1,9 +1,9 @@
-from .db import db
+from .db import repos
+from .db_async import run_db
+from .plaid_utils import link_client as client  # Plaid API client for the environment selected by PLAID_ENV
 import time
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import plaid
-from plaid.api import plaid_api
 from plaid.model.link_token_create_request import LinkTokenCreateRequest
 from plaid.model.products import Products
 from plaid.model.country_code import CountryCode
@@ -32,19 +32,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.info(f'plaidd {PLAID_CLIENT_ID} {PLAID_SECRET_PRODUCTION} {PLAID_SECRET_SANDBOX}')
 
-# Initialize Plaid API client
-configuration = plaid.Configuration(
-    host=plaid.Environment.Production,
-    api_key={
-        'clientId': PLAID_CLIENT_ID,
-        'secret': PLAID_SECRET_PRODUCTION,
-        'plaidVersion': '2020-09-14'
-    }
-)
-
-api_client = plaid.ApiClient(configuration)
-client = plaid_api.PlaidApi(api_client)
-
 class LinkTokenResponse(BaseModel):
     link_token: str
 
@@ -77,7 +64,7 @@ async def get_link_token():
             user=LinkTokenCreateRequestUser(client_user_id=str(time.time())),
         )
         # Create link token
-        response = client.link_token_create(request)
+        response = await run_db(client.link_token_create, request)
         # logger.info(f"Link token created: {response.link_token}")
 
         return {"link_token": response.link_token}
@@ -89,14 +76,14 @@ async def get_link_token():
 async def create_account(account: Account, user_id: str, access_token: str):
     try:
         # Ensure the user exists
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
+        user_ref = repos.users.ref(user_id)
+        user_doc = await run_db(user_ref.get)
         if not user_doc.exists:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Create a new account document in the 'accounts' collection
-        account_ref = db.collection("accounts").document()
-        account_ref.set({
+        account_ref = repos.accounts.ref()
+        await run_db(account_ref.set, {
             "user_id": user_id,
             "account_id": account.account_id,
             "name": account.name,
@@ -114,8 +101,8 @@ async def create_account(account: Account, user_id: str, access_token: str):
 async def create_plaid_item(request: ExchangePublicTokenRequest, access_token: str, item_id: str):
     try:
         # Ensure the user exists
-        user_ref = db.collection("users").document(request.user_id)
-        user_doc = user_ref.get()
+        user_ref = repos.users.ref(request.user_id)
+        user_doc = await run_db(user_ref.get)
         if not user_doc.exists:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -131,8 +118,7 @@ async def create_plaid_item(request: ExchangePublicTokenRequest, access_token: s
         )
         
         # Create a new plaid item document in the 'plaid_items' collection
-        plaid_item_ref = db.collection("plaid_items").document()
-        plaid_item_ref.set(plaid_item_schema.to_dict())
+        plaid_item_ref = await run_db(repos.plaid_items.create, plaid_item_schema.to_dict())
 
         return {"message": "Plaid item created successfully.", "plaid_item_id": plaid_item_ref.id}
     
@@ -152,7 +138,7 @@ async def exchange_public_token(request: ExchangePublicTokenRequest):
         exchange_request = ItemPublicTokenExchangeRequest(public_token=request.public_token)
         
         # Call Plaid API to exchange the public token for an access token
-        response: ItemPublicTokenExchangeResponse = client.item_public_token_exchange(exchange_request)
+        response: ItemPublicTokenExchangeResponse = await run_db(client.item_public_token_exchange, exchange_request)
         
         access_token = response.access_token
         item_id = response.item_id
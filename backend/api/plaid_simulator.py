@@ -0,0 +1,166 @@
+import random
+import hashlib
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+# (merchant name, transaction name, primary category, detailed category, min amount, max amount)
+MERCHANTS = [
+    ("Starbucks", "STARBUCKS STORE 1234", "FOOD_AND_DRINK", "FOOD_AND_DRINK_COFFEE", 3.5, 12.0),
+    ("Chipotle", "CHIPOTLE 0912", "FOOD_AND_DRINK", "FOOD_AND_DRINK_FAST_FOOD", 9.0, 25.0),
+    ("Whole Foods", "WHOLEFDS MKT 10234", "FOOD_AND_DRINK", "FOOD_AND_DRINK_GROCERIES", 20.0, 180.0),
+    ("Amazon", "AMZN Mktp US*2K4", "GENERAL_MERCHANDISE", "GENERAL_MERCHANDISE_ONLINE_MARKETPLACES", 5.0, 250.0),
+    ("Target", "TARGET 00012345", "GENERAL_MERCHANDISE", "GENERAL_MERCHANDISE_SUPERSTORES", 10.0, 200.0),
+    ("Shell", "SHELL OIL 57444", "TRANSPORTATION", "TRANSPORTATION_GAS", 25.0, 80.0),
+    ("Uber", "UBER *TRIP", "TRANSPORTATION", "TRANSPORTATION_TAXIS_AND_RIDE_SHARES", 8.0, 60.0),
+    ("Netflix", "NETFLIX.COM", "ENTERTAINMENT", "ENTERTAINMENT_TV_AND_MOVIES", 15.49, 22.99),
+    ("Spotify", "Spotify USA", "ENTERTAINMENT", "ENTERTAINMENT_MUSIC_AND_AUDIO", 10.99, 16.99),
+    ("Comcast", "COMCAST CABLE", "RENT_AND_UTILITIES", "RENT_AND_UTILITIES_INTERNET_AND_CABLE", 60.0, 120.0),
+    ("CVS", "CVS/PHARMACY #0841", "MEDICAL", "MEDICAL_PHARMACIES_AND_SUPPLEMENTS", 5.0, 60.0),
+    (None, "ACH Electronic Credit PAYROLL", "INCOME", "INCOME_WAGES", -3500.0, -1200.0),
+]
+
+PENDING_DAYS = 3  # Transactions from the last few days are still pending
+
+def parse_access_token(access_token, default_history_size, default_seed):
+    """Simulated access tokens look like `access-sim-<history size>-<seed>`; anything else uses the defaults"""
+    parts = access_token.split("-")
+    if len(parts) == 4 and parts[:2] == ["access", "sim"] and parts[2].isdigit() and parts[3].isdigit():
+        return int(parts[2]), int(parts[3])
+    return default_history_size, default_seed
+
+class SimulatedItem:
+    """Transaction history and update generations for one simulated access token"""
+
+    def __init__(self, access_token, history_size, seed, updates_per_sync):
+        self.rng = random.Random(f"{seed}:{access_token}")
+        self.item_id = "item-sim-" + hashlib.sha1(access_token.encode()).hexdigest()[:12]
+        self.accounts = [
+            {"account_id": f"{self.item_id}-checking", "name": "Simulated Checking", "type": "depository"},
+            {"account_id": f"{self.item_id}-credit", "name": "Simulated Credit Card", "type": "credit"},
+        ]
+        self.updates_per_sync = updates_per_sync
+        self.today = date.today()
+        self.next_id = 0
+        self.live = {}  # transaction_id -> transaction currently visible to the client
+        self.generations = [self._history(history_size)]
+
+    def _new_id(self):
+        self.next_id += 1
+        return f"{self.item_id}-txn-{self.next_id:08d}"
+
+    def _transaction(self, on_date, pending=False, pending_transaction_id=None, template=None):
+        merchant_name, name, primary, detailed, low, high = template or self.rng.choice(MERCHANTS)
+        return {
+            "transaction_id": self._new_id(),
+            "account_id": self.rng.choice(self.accounts)["account_id"],
+            "amount": round(self.rng.uniform(low, high), 2),  # Plaid sign: positive is money leaving the account
+            "name": name,
+            "merchant_name": merchant_name,
+            "date": on_date,
+            "pending": pending,
+            "pending_transaction_id": pending_transaction_id,
+            "personal_finance_category": {"primary": primary, "detailed": detailed, "confidence_level": "HIGH"},
+        }
+
+    def _history(self, history_size):
+        """Generation 0: the full history returned by the first sync, with the most recent days pending"""
+        span_days = max(30, history_size // 5)
+        added = []
+        for _ in range(history_size):
+            on_date = self.today - timedelta(days=self.rng.randint(0, span_days))
+            transaction = self._transaction(on_date, pending=(self.today - on_date).days < PENDING_DAYS)
+            self.live[transaction["transaction_id"]] = transaction
+            added.append(transaction)
+        added.sort(key=lambda transaction: transaction["date"])
+        return {"added": added, "modified": [], "removed": []}
+
+    def next_generation(self):
+        """Updates for the following sync: pending flips plus new, modified and removed transactions"""
+        added, modified, removed = [], [], []
+
+        # Every pending transaction posts: the pending one is removed and a posted one added in its place
+        for transaction in [t for t in self.live.values() if t["pending"]]:
+            del self.live[transaction["transaction_id"]]
+            removed.append({"transaction_id": transaction["transaction_id"], "account_id": transaction["account_id"]})
+            posted = dict(transaction)
+            posted.update({
+                "transaction_id": self._new_id(),
+                "pending": False,
+                "pending_transaction_id": transaction["transaction_id"],
+                # Tips and holds mean the posted amount can differ from the pending one
+                "amount": round(transaction["amount"] * self.rng.choice([1.0, 1.0, 1.0, 1.15, 1.2]), 2),
+            })
+            self.live[posted["transaction_id"]] = posted
+            added.append(posted)
+
+        posted_ids = [transaction_id for transaction_id, t in self.live.items() if not t["pending"]]
+        changed_ids = self.rng.sample(posted_ids, min(len(posted_ids), self.updates_per_sync // 5 * 2))
+        for transaction_id in changed_ids[:len(changed_ids) // 2]:
+            transaction = dict(self.live[transaction_id])
+            transaction["amount"] = round(transaction["amount"] + self.rng.uniform(-2.0, 2.0), 2)
+            self.live[transaction_id] = transaction
+            modified.append(transaction)
+        for transaction_id in changed_ids[len(changed_ids) // 2:]:
+            transaction = self.live.pop(transaction_id)
+            removed.append({"transaction_id": transaction_id, "account_id": transaction["account_id"]})
+
+        for _ in range(self.updates_per_sync - len(changed_ids)):
+            transaction = self._transaction(self.today, pending=self.rng.random() < 0.5)
+            self.live[transaction["transaction_id"]] = transaction
+            added.append(transaction)
+
+        self.generations.append({"added": added, "modified": modified, "removed": removed})
+
+class PlaidSimulator:
+    """
+    Local stand-in for the Plaid API client serving realistic `transactions_sync` pages.
+
+    The first sync for an access token returns a seeded history of `history_size` transactions
+    in pages of `page_size`. Every later sync from the latest cursor returns a new generation of
+    updates: pending transactions flip to posted (removed + added with `pending_transaction_id`),
+    and a few transactions are modified, removed or newly added. Cursors have the form
+    `sim-<generation>-<offset>`, so re-syncing from an older cursor replays the same pages.
+    """
+
+    def __init__(self, history_size=1000, page_size=100, seed=0, updates_per_sync=25):
+        self.history_size = history_size
+        self.page_size = page_size
+        self.seed = seed
+        self.updates_per_sync = updates_per_sync
+        self.items = {}
+
+    def item(self, access_token):
+        if access_token not in self.items:
+            history_size, seed = parse_access_token(access_token, self.history_size, self.seed)
+            self.items[access_token] = SimulatedItem(access_token, history_size, seed, self.updates_per_sync)
+        return self.items[access_token]
+
+    def transactions_sync(self, request):
+        item = self.item(request["access_token"])
+        cursor = request.get("cursor")
+        generation, offset = (0, 0) if not cursor else map(int, cursor.split("-")[1:])
+
+        if generation >= len(item.generations):
+            if not self.updates_per_sync:
+                return {"added": [], "modified": [], "removed": [], "next_cursor": cursor, "has_more": False, "accounts": item.accounts}
+            while generation >= len(item.generations):
+                item.next_generation()
+
+        updates = item.generations[generation]
+        events = [("added", t) for t in updates["added"]] + [("modified", t) for t in updates["modified"]] + [("removed", t) for t in updates["removed"]]
+        count = request.get("count") or self.page_size
+        page = events[offset:offset + count]
+        has_more = offset + count < len(events)
+        next_cursor = f"sim-{generation}-{offset + count}" if has_more else f"sim-{generation + 1}-0"
+
+        response = {"added": [], "modified": [], "removed": [], "next_cursor": next_cursor, "has_more": has_more, "accounts": item.accounts}
+        for kind, transaction in page:
+            response[kind].append(transaction)
+        return response
+
+    def link_token_create(self, request):
+        return SimpleNamespace(link_token=f"link-sim-{self.seed}")
+
+    def item_public_token_exchange(self, request):
+        access_token = f"access-sim-{self.history_size}-{self.seed}"
+        return SimpleNamespace(access_token=access_token, item_id=self.item(access_token).item_id)
@@ -5,29 +5,55 @@ import os
 from dotenv import load_dotenv
 import json
 import datetime
+import logging
+from .plaid_simulator import PlaidSimulator
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Available environments are
-# 'Production'
-# 'Sandbox'
-configuration = plaid.Configuration(
-    host=plaid.Environment.Production,
-    api_key={
+# 'production'
+# 'sandbox'
+# 'simulator' (local stand-in from plaid_simulator.py, no bank links or credentials needed)
+PLAID_ENV = os.getenv("PLAID_ENV", "production").lower()
+
+def create_plaid_client(plaid_version=None):
+    """Create the Plaid API client for the environment selected by PLAID_ENV, pinned to `plaid_version` if given"""
+    if PLAID_ENV == "simulator":
+        return PlaidSimulator(
+            history_size=int(os.getenv("PLAID_SIMULATOR_HISTORY_SIZE", "1000")),
+            seed=int(os.getenv("PLAID_SIMULATOR_SEED", "0")),
+        )
+
+    if PLAID_ENV == "sandbox":
+        host = plaid.Environment.Sandbox
+        secret = os.getenv("PLAID_SECRET_SANDBOX")
+    else:
+        host = plaid.Environment.Production
+        secret = os.getenv("PLAID_SECRET_PRODUCTION")
+
+    api_key = {
         'clientId': os.getenv("PLAID_CLIENT_ID"),
-        'secret': os.getenv("PLAID_SECRET_PRODUCTION"),
+        'secret': secret,
     }
-)
+    if plaid_version:
+        api_key['plaidVersion'] = plaid_version
+    configuration = plaid.Configuration(host=host, api_key=api_key)
+    return plaid_api.PlaidApi(plaid.ApiClient(configuration))
+
+client = create_plaid_client()
 
-api_client = plaid.ApiClient(configuration)
-client = plaid_api.PlaidApi(api_client)
+# Link token and public token exchange calls (api/plaid_routes.py) are pinned to the API version
+# they were written against; transaction syncs use the account's default version
+link_client = client if PLAID_ENV == "simulator" else create_plaid_client(plaid_version='2020-09-14')
 
 def get_plaid_transactions(access_token: str, cursor=None):
     request_data = {"access_token": access_token}
     if cursor is not None:
         request_data["cursor"] = cursor  # Include cursor only if it's not None
 
-    print("Request data:", request_data)
+    logger.debug("Requesting Plaid transactions sync (cursor: %s)", cursor)
     request = TransactionsSyncRequest(**request_data)
     response = client.transactions_sync(request)
 
@@ -0,0 +1,51 @@
+"""
+Delete the tombstones of documents deleted more than TOMBSTONE_RETENTION_DAYS ago (see
+db/versions.py). Clients whose version is older than that are told to fetch everything again
+by `POST /sync/get-changes`, so they never miss a deletion whose tombstone is gone.
+
+Usage (from the backend directory):
+    python api/purge_tombstones.py --dry-run
+    python api/purge_tombstones.py --retention-days 30
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+from api.db import repos
+from api.sync_routes import TOMBSTONE_RETENTION_DAYS
+
+def purge(retention_days=TOMBSTONE_RETENTION_DAYS, dry_run=False):
+    """Delete expired tombstones a batch at a time; returns how many there were"""
+    before = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    if dry_run:
+        return sum(1 for _ in repos.tombstones.deleted_before(before))
+    purged = 0
+    while True:
+        docs = list(repos.tombstones.deleted_before(before, limit=repos.max_batch_writes))
+        if not docs:
+            return purged
+        batch = repos.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        purged += len(docs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete tombstones older than the retention period")
+    parser.add_argument("--retention-days", type=float, default=TOMBSTONE_RETENTION_DAYS,
+                        help="Keep tombstones of deletions this recent (the servers' TOMBSTONE_RETENTION_DAYS)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without writing")
+    args = parser.parse_args()
+
+    purged = purge(args.retention_days, args.dry_run)
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}Tombstones older than {args.retention_days:g} days: {purged}")
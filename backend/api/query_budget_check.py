@@ -0,0 +1,140 @@
+"""
+Query budget check: the read round trips each endpoint may make, enforced with `assert_max_queries`.
+
+A throwaway user with categories, transactions and assignments, and a user with one simulated
+Plaid item, are created in-process; then each endpoint in BUDGETS is called inside
+`assert_max_queries` (api/db_trace.py), which fails when its request makes more read round
+trips (queries, gets, get_all calls) than the budget, or calls one query shape more than
+--max-repeated times (an N+1 pattern, e.g. a query per transaction). The budgets don't grow
+with the amount of data, so a loop of queries shows up even with the small seed data.
+
+Prints each endpoint's round trips and exits with status 1 if any is over budget.
+
+Usage (from the backend directory):
+    python api/query_budget_check.py
+    python api/query_budget_check.py --history-size 500 --max-repeated 2
+"""
+import os
+import sys
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+# The check creates its own users; it must not run against a real database
+if os.getenv("DB_BACKEND", "memory") == "firestore":
+    sys.exit("The query budget check creates its own data; run it with DB_BACKEND=memory or DB_BACKEND=sqlite")
+os.environ.setdefault("DB_BACKEND", "memory")
+
+# Plaid calls always go to the simulator, whatever the environment says
+os.environ["PLAID_ENV"] = "simulator"
+
+import httpx
+from api.db_trace import assert_max_queries, DB_TRACE_REPEAT_THRESHOLD
+from api.sync_benchmark import create_benchmark_user
+from backend.db.versions import to_version
+
+USER_ID = "query-budget-user"
+
+# (endpoint, method, path, request, read round trip budget); "{category}" etc. are filled in from the seed data
+BUDGETS = [
+    ("get categories", "POST", "/category/get-categories", {"user_id": USER_ID}, 2),
+    ("get allocated and spent", "POST", "/category/get-allocated-and-spent",
+     {"user_id": USER_ID, "start_date": "2026-01-01", "end_date": "2026-01-31"}, 3),
+    ("get transactions", "POST", "/transaction/get-transactions", {"user_id": USER_ID, "limit": 20}, 2),
+    ("create transaction", "POST", "/transaction/create-transaction",
+     {"user_id": USER_ID, "category_id": "{category}", "amount": -5, "name": "Budget check", "date": "2026-01-15"}, 3),
+    ("create assignment", "POST", "/assignment/create-assignment",
+     {"user_id": USER_ID, "category_id": "{category}", "amount": 10, "date": "2026-01-15"}, 3),
+    ("snapshot", "POST", "/sync/get-snapshot", {"user_id": USER_ID}, 5),
+    ("sync changes", "POST", "/sync/get-changes", {"user_id": USER_ID, "since": "{since}"}, 6),
+    ("initial Plaid sync", "POST", "/transaction/sync-plaid-transactions", {"user_id": "{plaid_user}"}, 4),
+    ("incremental Plaid sync", "POST", "/transaction/sync-plaid-transactions", {"user_id": "{plaid_user}"}, 6),
+]
+
+async def seed(client, categories, transactions):
+    """Create the check user's categories, transactions and assignments; returns the category IDs"""
+    async def post(path, body):
+        response = await client.post(path, json=body)
+        response.raise_for_status()
+        return response.json()
+
+    await post("/user/create-user", {"email": f"{USER_ID}@budget-check.local", "user_id": USER_ID})
+    category_ids = [
+        (await post("/category/create-category", {"name": f"Category {i}", "user_id": USER_ID}))["category_id"]
+        for i in range(categories)
+    ]
+    for i in range(transactions):
+        await post("/transaction/create-transaction", {
+            "user_id": USER_ID, "category_id": category_ids[i % categories], "amount": -(i + 1),
+            "name": f"Transaction {i}", "date": f"2026-01-{i % 28 + 1:02d}",
+        })
+        if i % 4 == 0:
+            await post("/assignment/create-assignment", {
+                "user_id": USER_ID, "category_id": category_ids[i % categories], "amount": 25, "date": "2026-01-01",
+            })
+    return category_ids
+
+def fill(request, values):
+    return {key: value.format(**values) if isinstance(value, str) else value for key, value in request.items()}
+
+async def check_budgets(app, categories, transactions, history_size, max_repeated):
+    """Call each endpoint in BUDGETS under its budget; returns [(endpoint, read round trips, budget, error or None)]"""
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://query-budget-check", timeout=None) as client:
+        category_ids = await seed(client, categories, transactions)
+        values = {
+            "category": category_ids[0],
+            "plaid_user": create_benchmark_user(history_size, 0),
+            # Changes since before the seed data, so the feed reads them (since=0 only asks for a resync)
+            "since": str(to_version(datetime.now(timezone.utc) - timedelta(days=1))),
+        }
+
+        for endpoint, method, path, request, max_queries in BUDGETS:
+            request = fill(request, values)
+            traces = []
+            try:
+                with assert_max_queries(max_queries, max_repeated) as traces:
+                    if method == "GET":
+                        response = await client.get(path, params=request)
+                    else:
+                        response = await client.post(path, json=request)
+                    response.raise_for_status()
+                error = None
+            except (AssertionError, httpx.HTTPStatusError) as e:
+                error = str(e)
+            round_trips = sum(trace.read_round_trips for _, _, trace in traces)
+            results.append((endpoint, round_trips, max_queries, error))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the read round trips of each endpoint stay within budget")
+    parser.add_argument("--categories", type=int, default=8, help="Categories of the check user")
+    parser.add_argument("--transactions", type=int, default=40, help="Transactions of the check user")
+    parser.add_argument("--history-size", type=int, default=300, help="Transactions of the simulated Plaid item")
+    parser.add_argument("--max-repeated", type=int, default=DB_TRACE_REPEAT_THRESHOLD - 1,
+                        help="Calls of one query shape allowed in a request (default: below the DB_TRACE flag threshold)")
+    args = parser.parse_args()
+
+    import main
+
+    print(f"Checking {len(BUDGETS)} endpoints ({args.transactions} transactions, {args.history_size} Plaid transactions)...")
+    results = asyncio.run(check_budgets(main.app, args.categories, args.transactions, args.history_size, args.max_repeated))
+
+    failures = 0
+    for endpoint, round_trips, max_queries, error in results:
+        print(f"  {'FAIL' if error else 'ok':4} {endpoint}: {round_trips} read round trips (budget {max_queries})")
+        if error:
+            failures += 1
+            print(f"       {error}")
+
+    print(f"\n{len(results) - failures}/{len(results)} endpoints within budget")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,194 @@
+"""
+Incremental balance reconciliation: checks a user's balances like `check_user` (api/integrity.py)
+while reading only the documents changed since the user was last reconciled.
+
+Each user's watermark document (`reconciliation_watermarks/{user_id}`) keeps:
+- `watermark`: the time the last run covered changes up to
+- `balances`: the verified available amount in cents of each category
+- `contributions`: each document's part of the balances (a transaction's or assignment's
+  category and amount, an archive block's category totals), as zlib-compressed JSON
+
+A later run reads the user's categories, the transactions, assignments and archive blocks
+stamped after the watermark and the tombstones left since (see db/versions.py), applies them to
+the contributions and compares the balances they add up to with the stored ones. With no
+changes and every balance as verified, the contributions aren't even decoded.
+
+The watermark is Firestore's read time of the user's document, taken before any other read
+(`consistent_read_time`, api/sync_routes.py): it comes from the clock that stamps the documents,
+and every write stamped at or before it is visible to the reads that follow, so no change up to
+it is missed. Changes stamped after it may be read too and are read again next time: applying a
+document's contribution twice sets it to the same value. A balance that doesn't add up means
+the changes don't explain the stored state (a write missed by the versioning, or an actual
+discrepancy), so the user gets a full recompute, which is authoritative, reports the issues and
+rewrites the watermark. Users without a watermark, with one older than the tombstones kept
+(TOMBSTONE_RETENTION_DAYS) or too many documents to keep their contributions are always
+recomputed in full.
+
+What this saves is documents read, not round trips: a run reads the user and watermark
+documents together, then the categories and one query per kind of change (six round trips, the
+full check four), so it only pays off for users whose history is larger than their changes.
+"""
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+from .db import repos
+from .balance_counters import balance_counters
+from .integrity import Ledger, category_issues
+from .sync_routes import TOMBSTONE_RETENTION_DAYS
+from backend.db.schemas import read_cents
+from backend.db.archive import MAX_BLOCK_BYTES
+
+class Contributions:
+    """Each document's part of one user's balances, updated from the documents that changed"""
+
+    def __init__(self, transactions=None, assignments=None, blocks=None):
+        self.transactions = transactions or {}  # transaction_id -> [category_id, cents]
+        self.assignments = assignments or {}  # assignment_id -> [category_id, cents]
+        self.blocks = blocks or {}  # archive block ID -> category totals
+
+    @classmethod
+    def decode(cls, payload):
+        data = json.loads(zlib.decompress(payload))
+        return cls(data["t"], data["a"], data["b"])
+
+    def encode(self):
+        data = {"t": self.transactions, "a": self.assignments, "b": self.blocks}
+        return zlib.compress(json.dumps(data, separators=(",", ":")).encode(), 6)
+
+    def add_transaction(self, doc):
+        data = doc.to_dict()
+        self.transactions[doc.id] = [data.get("category_id"), read_cents(data, "amount")]
+
+    def add_assignment(self, doc):
+        data = doc.to_dict()
+        self.assignments[doc.id] = [data.get("category_id"), read_cents(data, "amount")]
+
+    def add_archive_block(self, doc):
+        """A block's totals replace the live transactions it archived (but not the ones moved back since)"""
+        data = doc.to_dict()
+        unarchived = data.get("unarchived") or {}
+        for transaction_id in data.get("transaction_ids") or []:
+            if transaction_id not in unarchived:
+                self.transactions.pop(transaction_id, None)
+        self.blocks[doc.id] = data.get("category_totals") or {}
+
+    def remove(self, collection, document_id):
+        """Drop a deleted document's contribution"""
+        if collection == "transactions":
+            self.transactions.pop(document_id, None)
+        elif collection == "assignments":
+            self.assignments.pop(document_id, None)
+
+    def ledger(self):
+        ledger = Ledger()
+        for category_id, amount_cents in self.transactions.values():
+            ledger.add_transaction({"category_id": category_id, "amount_cents": amount_cents})
+        for category_totals in self.blocks.values():
+            ledger.add_archive_block({"category_totals": category_totals})
+        for category_id, amount_cents in self.assignments.values():
+            ledger.add_assignment({"category_id": category_id, "amount_cents": amount_cents})
+        return ledger
+
+def full_contributions(user_id):
+    """The user's Contributions, from one query per collection"""
+    contributions = Contributions()
+    for doc in repos.transactions.where(user_id=user_id).stream():
+        contributions.add_transaction(doc)
+    for doc in repos.transaction_archive.blocks(user_id):
+        contributions.add_archive_block(doc)
+    for doc in repos.assignments.for_user(user_id):
+        contributions.add_assignment(doc)
+    return contributions
+
+def stale_reason(watermark_data, now):
+    """Why the user's watermark can't be reconciled from, or None when it can"""
+    if not watermark_data:
+        return "no_watermark"
+    if not watermark_data.get("contributions"):
+        return "no_contributions"
+    if watermark_data["watermark"] < now - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        return "watermark_expired"
+    return None
+
+def save_watermark(user_id, watermark, categories, ledger, contributions):
+    """Record the balances verified up to `watermark`; without the contributions if they don't fit a document"""
+    payload = contributions.encode()
+    repos.reconciliation_watermarks.ref(user_id).set({
+        "user_id": user_id,
+        "watermark": watermark,
+        "balances": {
+            doc.id: ledger.expected_available(doc.id, doc.to_dict().get("is_unallocated_funds", False)) for doc in categories
+        },
+        "contributions": payload if len(payload) <= MAX_BLOCK_BYTES else None,
+        "reconciled_at": datetime.now(timezone.utc),
+    })
+
+def reconcile_user(user_id, user_email=None, full=False):
+    """
+    Check every category of the user, from the changes since the last run when possible; returns
+    what `check_user` does, plus the `mode` used ("full" or "incremental") and, for full runs,
+    the `fallback_reason` (None when `full` was asked for)
+    """
+    now = datetime.now(timezone.utc)
+    # The user document (whose read time is the new watermark, see `consistent_read_time`) and the
+    # watermark document in one round trip, before every other read
+    user_ref, watermark_ref = repos.users.ref(user_id), repos.reconciliation_watermarks.ref(user_id)
+    snapshots = {doc.reference.path: doc for doc in repos.get_all([user_ref, watermark_ref])}  # In any order
+    user_doc, watermark_doc = snapshots[user_ref.path], snapshots[watermark_ref.path]
+    watermark = user_doc.read_time
+    watermark_data = None if full else (watermark_doc.to_dict() or None)
+    fallback_reason = None if full else stale_reason(watermark_data, now)
+
+    categories = list(repos.categories.for_user(user_id))
+    stored = balance_counters.totals(categories)
+
+    if not full and fallback_reason is None:
+        since = watermark_data["watermark"]
+        transactions = list(repos.transactions.changed(user_id, since))
+        assignments = list(repos.assignments.changed(user_id, since))
+        blocks = list(repos.transaction_archive.changed(user_id, since))
+        tombstones = list(repos.tombstones.changed(user_id, since))
+        result = {
+            "user_id": user_id,
+            "categories": len(categories),
+            "transactions": len(transactions),
+            "assignments": len(assignments),
+            "issues": [],
+            "mode": "incremental",
+            "fallback_reason": None,
+        }
+        balances = watermark_data.get("balances") or {}
+        if not (transactions or assignments or blocks or tombstones) and all(
+            balances.get(doc.id) == stored[doc.id] for doc in categories
+        ):
+            repos.reconciliation_watermarks.update(user_id, {"watermark": watermark, "reconciled_at": now})
+            return result
+
+        contributions = Contributions.decode(watermark_data["contributions"])
+        for doc in blocks:
+            contributions.add_archive_block(doc)
+        for doc in transactions:
+            contributions.add_transaction(doc)
+        for doc in assignments:
+            contributions.add_assignment(doc)
+        for doc in tombstones:
+            contributions.remove(doc.get("collection"), doc.get("document_id"))
+        ledger = contributions.ledger()
+        if not category_issues(user_id, user_email, categories, stored, ledger):
+            save_watermark(user_id, watermark, categories, ledger, contributions)
+            return result
+        fallback_reason = "inconsistent_deltas"
+
+    contributions = full_contributions(user_id)
+    ledger = contributions.ledger()
+    issues = category_issues(user_id, user_email, categories, stored, ledger)
+    save_watermark(user_id, watermark, categories, ledger, contributions)
+    return {
+        "user_id": user_id,
+        "categories": len(categories),
+        "transactions": ledger.transaction_count,
+        "assignments": ledger.assignment_count,
+        "issues": issues,
+        "mode": "full",
+        "fallback_reason": fallback_reason,
+    }
@@ -0,0 +1,144 @@
+"""
+Microbenchmark of the transaction records against the Pydantic transaction schema.
+
+For a set of generated synced transactions, times per row:
+- encode: building a validated `TransactionSchema` and calling `to_dict()`, against building a
+  `TransactionRecord` and calling its compiled `to_dict()` (and, for reference, the hand-written
+  dict the sync path used to build without any validation)
+- decode: `TransactionSchema.from_dict()` against `TransactionRecord.from_dict()` on stored
+  documents
+and the memory held by the decoded objects. No database is needed.
+
+Usage (from the backend directory):
+    python api/record_benchmark.py --rows 10000
+"""
+import os
+import sys
+import argparse
+import datetime
+import json
+import random
+import time
+import tracemalloc
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+from backend.db.schemas import Transaction as TransactionSchema, TransactionRecord
+
+def generate_rows(count, seed):
+    """Keyword arguments of `count` synced transactions"""
+    rng = random.Random(seed)
+    return [{
+        "amount_cents": -rng.randint(100, 20000),
+        "name": f"Merchant {rng.randint(1, 500)}",
+        "date": f"2026-01-{rng.randint(1, 31):02d}",
+        "user_id": "benchmark-user",
+        "category_id": rng.choice([None, "groceries", "rent"]),
+        "plaid_transaction_id": f"plaid-{index}",
+        "institution_name": "Simulated Bank",
+        "account_name": "Checking",
+        "merchant_name": rng.choice([None, "Store"]),
+        "personal_finance_category": {"primary": "FOOD_AND_DRINK", "detailed": "FOOD_AND_DRINK_GROCERIES", "confidence_level": "HIGH"},
+        "pending": rng.random() < 0.1,
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+    } for index in range(count)]
+
+def hand_written_dict(row):
+    """The unvalidated dict the sync path built before records existed"""
+    return {
+        "amount_cents": row["amount_cents"],
+        "name": row["name"],
+        "date": row["date"],
+        "user_id": row["user_id"],
+        "plaid_transaction_id": row["plaid_transaction_id"],
+        "institution_name": row["institution_name"],
+        "account_name": row["account_name"],
+        "merchant_name": row["merchant_name"],
+        "personal_finance_category": row["personal_finance_category"],
+        "pending": row["pending"],
+        "category_id": row["category_id"],
+        "created_at": row["created_at"],
+        "type": "debit" if row["amount_cents"] < 0 else "credit"
+    }
+
+def time_per_row(function, rows, repeat):
+    """Best time over `repeat` runs of `function` on every row, in microseconds per row"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in rows:
+            function(row)
+        best = min(best, time.perf_counter() - start)
+    return round(best / len(rows) * 1_000_000, 3)
+
+def retained_bytes_per_row(function, rows):
+    """Memory held by the objects `function` builds from every row, in bytes per row"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [function(row) for row in rows]
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return round(retained / len(rows))
+
+def run_benchmark(row_count, repeat, seed):
+    rows = generate_rows(row_count, seed)
+    stored = [TransactionRecord(**row).to_dict() for row in rows]
+
+    # Both encoders must produce the same documents (apart from unset optional fields the schema drops)
+    for row in rows[:100]:
+        schema_dict = TransactionSchema(**row).to_dict()
+        record_dict = TransactionRecord(**row).to_dict()
+        if {k: v for k, v in record_dict.items() if v is not None} != schema_dict:
+            raise AssertionError(f"Encoders disagree: {schema_dict} != {record_dict}")
+
+    results = {
+        "rows": row_count,
+        "encode_us_per_row": {
+            "pydantic_schema": time_per_row(lambda row: TransactionSchema(**row).to_dict(), rows, repeat),
+            "record": time_per_row(lambda row: TransactionRecord(**row).to_dict(), rows, repeat),
+            "hand_written_dict": time_per_row(hand_written_dict, rows, repeat),
+        },
+        "decode_us_per_row": {
+            "pydantic_schema": time_per_row(TransactionSchema.from_dict, stored, repeat),
+            "record": time_per_row(TransactionRecord.from_dict, stored, repeat),
+        },
+        "decoded_bytes_per_row": {
+            "pydantic_schema": retained_bytes_per_row(TransactionSchema.from_dict, stored),
+            "record": retained_bytes_per_row(TransactionRecord.from_dict, stored),
+        },
+    }
+    for measure in ("encode_us_per_row", "decode_us_per_row"):
+        results[measure]["speedup"] = round(results[measure]["pydantic_schema"] / results[measure]["record"], 2)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark transaction records against the Pydantic transaction schema")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of transactions per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (the best is reported)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated transactions")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.rows, args.repeat, args.seed)
+
+    print(f"\n📊 Transaction serialization ({results['rows']} rows)")
+    for measure, unit in (("encode_us_per_row", "µs/row"), ("decode_us_per_row", "µs/row"), ("decoded_bytes_per_row", "bytes/row")):
+        print(f"  {measure}:")
+        for variant, value in results[measure].items():
+            print(f"    {variant}: {value}{'x' if variant == 'speedup' else ' ' + unit}")
+
+    # Save results to a JSON file with timestamp in the record_benchmarks folder
+    timestamp = datetime.datetime.now()
+    benchmarks_dir = 'record_benchmarks'
+    os.makedirs(benchmarks_dir, exist_ok=True)
+    filepath = os.path.join(benchmarks_dir, f'record_benchmark_{timestamp.strftime("%Y%m%d_%H%M%S")}.json')
+    with open(filepath, 'w') as json_file:
+        json.dump({"benchmark_timestamp": timestamp.isoformat(), "results": results}, json_file, indent=4)
+
+    print(f"\nDetailed results saved to: {filepath}")
@@ -0,0 +1,112 @@
+"""
+Compact columnar encoding of a user's state, for apps hydrating their local copy in one request
+(`POST /sync/get-snapshot`, api/sync_routes.py).
+
+Tables (category groups, categories, transactions) are objects of equally long column arrays
+instead of arrays of objects, so field names appear once per table:
+- strings repeated across rows (names, merchants, accounts) are indexes into the snapshot's
+  `strings` array, sent last as it grows while the rows are encoded; -1 stands for none
+- references to other tables are row indexes (a category's `group`, a transaction's
+  `category`), -1 for none (or a deleted category)
+- amounts are integer cents and transaction dates are days after the snapshot's `start_date`
+
+Transactions are sent in chunks of SNAPSHOT_CHUNK_ROWS rows, newest first, each chunk a table
+of its own, so the response is encoded and compressed a chunk at a time while it streams.
+"""
+import os
+import json
+import zlib
+from datetime import date
+from fastapi.encoders import jsonable_encoder
+from backend.db.schemas import read_cents
+
+# Transaction rows per chunk of the stream
+SNAPSHOT_CHUNK_ROWS = int(os.getenv("SNAPSHOT_CHUNK_ROWS", "1000"))
+
+def _json(value):
+    return json.dumps(value, separators=(",", ":"))
+
+class StringTable:
+    """Dictionary of the strings of a snapshot, each stored once and referenced by index"""
+
+    def __init__(self):
+        self.strings = []
+        self._indexes = {}
+
+    def index(self, value):
+        if value is None:
+            return -1
+        index = self._indexes.get(value)
+        if index is None:
+            index = self._indexes[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+class SnapshotEncoder:
+    """Encodes one snapshot; tables referenced by others (groups, then categories) come first"""
+
+    def __init__(self, start_date):
+        self.start_date = start_date
+        self._start_ordinal = date.fromisoformat(start_date).toordinal()
+        self.strings = StringTable()
+        self._group_rows = {}  # category group ID -> row
+        self._category_rows = {}  # category ID -> row
+
+    def category_groups(self, docs):
+        table = {"id": [], "name": [], "sort_order": []}
+        for row, doc in enumerate(docs):
+            data = doc.to_dict()
+            self._group_rows[doc.id] = row
+            table["id"].append(doc.id)
+            table["name"].append(self.strings.index(data.get("name")))
+            table["sort_order"].append(data.get("sort_order", 0))
+        return table
+
+    def categories(self, docs, available_cents):
+        """Categories table, with each category's available amount from {category_id: cents}"""
+        table = {"id": [], "name": [], "group": [], "available_cents": [], "goal_cents": [], "is_unallocated_funds": []}
+        for row, doc in enumerate(docs):
+            data = doc.to_dict()
+            self._category_rows[doc.id] = row
+            table["id"].append(doc.id)
+            table["name"].append(self.strings.index(data.get("name")))
+            table["group"].append(self._group_rows.get(data.get("group_id"), -1))
+            table["available_cents"].append(available_cents[doc.id])
+            has_goal = data.get("goal_amount_cents") is not None or data.get("goal_amount") is not None
+            table["goal_cents"].append(read_cents(data, "goal_amount") if has_goal else None)
+            table["is_unallocated_funds"].append(1 if data.get("is_unallocated_funds") else 0)
+        return table
+
+    def transactions(self, docs):
+        table = {
+            "id": [], "date": [], "amount_cents": [], "category": [], "name": [],
+            "merchant_name": [], "account_name": [], "institution_name": [], "pending": [],
+        }
+        for doc in docs:
+            data = doc.to_dict()
+            table["id"].append(doc.id)
+            table["date"].append(date.fromisoformat(data["date"]).toordinal() - self._start_ordinal)
+            table["amount_cents"].append(read_cents(data, "amount"))
+            table["category"].append(self._category_rows.get(data.get("category_id"), -1))
+            table["name"].append(self.strings.index(data.get("name")))
+            for field in ("merchant_name", "account_name", "institution_name"):
+                table[field].append(self.strings.index(data.get(field)))
+            table["pending"].append(1 if data.get("pending") else 0)
+        return table
+
+    def stream(self, header, transaction_docs, chunk_rows=SNAPSHOT_CHUNK_ROWS):
+        """
+        JSON text of the snapshot in pieces: `header` (a dict of the sections already encoded),
+        then the transaction chunks, then the strings
+        """
+        yield _json({**jsonable_encoder(header), "start_date": self.start_date})[:-1] + ',"transactions":['
+        for start in range(0, len(transaction_docs), chunk_rows):
+            yield ("," if start else "") + _json(self.transactions(transaction_docs[start:start + chunk_rows]))
+        yield '],"strings":' + _json(self.strings.strings) + "}"
+
+def gzip_stream(pieces, level=6):
+    """Gzip-compress a stream of text pieces, flushing after each so every piece is sent as it is encoded"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip container
+    for piece in pieces:
+        yield compressor.compress(piece.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,129 @@
+"""
+End-to-end benchmark for /transaction/sync-plaid-transactions using the offline Plaid simulator.
+
+For each history size a throwaway user with one simulated Plaid item is created, then an
+initial sync (full history) and an incremental sync (pending flips, modified and removed
+transactions) are run. Wall time, Firestore operations and peak Python memory are reported
+for each, and the benchmark data is deleted afterwards unless --keep is given.
+
+Runs against the backend selected by DB_BACKEND; use DB_BACKEND=memory to benchmark the sync
+code path without Firestore credentials.
+
+Usage (from the backend directory):
+    python api/sync_benchmark.py --sizes 1000 10000 100000
+    DB_BACKEND=memory python api/sync_benchmark.py --sizes 1000 10000
+"""
+import os
+import sys
+import argparse
+import asyncio
+import datetime
+import json
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+# Change to the backend directory so the relative paths work correctly
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(backend_dir)
+
+# Add the backend and repository directories to Python path
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.getcwd()))
+
+# Plaid calls always go to the simulator, whatever the environment says
+os.environ["PLAID_ENV"] = "simulator"
+
+from api.db import repos
+from api.db_instrumentation import count_operations
+from api import transaction_routes
+from api.plaid_utils import client as plaid_client
+from backend.db.schemas import User as UserSchema, PlaidItem as PlaidItemSchema
+
+def create_benchmark_user(history_size, seed):
+    """Create a user with one simulated Plaid item holding `history_size` transactions"""
+    user_id = f"sync-benchmark-{history_size}-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+    repos.users.create(UserSchema(email=f"{user_id}@benchmark.local").to_dict(), document_id=user_id)
+
+    access_token = f"access-sim-{history_size}-{seed}"
+    simulated_item = plaid_client.item(access_token)
+    plaid_item = PlaidItemSchema(
+        user_id=user_id,
+        access_token=access_token,
+        item_id=simulated_item.item_id,
+        institution_id=simulated_item.item_id,
+        institution_name="Simulated Bank",
+        accounts=simulated_item.accounts,
+        cursor=None
+    )
+    repos.plaid_items.create(plaid_item.to_dict())
+    return user_id
+
+def delete_benchmark_user(user_id):
+    """Delete every document created for a benchmark user"""
+    for repository in [repos.transactions, repos.plaid_items]:
+        while True:
+            docs = list(repository.where(user_id=user_id).limit(250).stream())
+            if not docs:
+                break
+            batch = repos.batch()
+            for doc in docs:
+                # Transactions are deleted through the repository, so both copies go while the user is dual-writing
+                batch.delete(repos.transactions.ref(doc.id, user_id=user_id) if repository is repos.transactions else doc.reference, tombstone=False)
+            batch.commit()
+    repos.users.delete(user_id)
+
+def measure_sync(user_id):
+    """Run one sync and return its wall time, Firestore operation counts and peak memory"""
+    request = transaction_routes.SyncPlaidTransactionsRequest(user_id=user_id)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with count_operations() as counts, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        response = asyncio.run(transaction_routes.sync_plaid_transactions(request))
+    wall_time = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "wall_time_seconds": round(wall_time, 3),
+        "firestore_operations": counts.as_dict(),
+        "peak_memory_mb": round(peak_memory / (1024 * 1024), 2),
+        "summary": response["summary"]
+    }
+
+def run_benchmark(sizes, seed, keep):
+    results = []
+    for history_size in sizes:
+        print(f"\n--- History size: {history_size} ---")
+        user_id = create_benchmark_user(history_size, seed)
+        try:
+            initial = measure_sync(user_id)
+            print(f"  Initial sync:     {initial['wall_time_seconds']}s, {initial['firestore_operations']}, peak {initial['peak_memory_mb']} MB")
+            incremental = measure_sync(user_id)
+            print(f"  Incremental sync: {incremental['wall_time_seconds']}s, {incremental['firestore_operations']}, peak {incremental['peak_memory_mb']} MB")
+            results.append({"history_size": history_size, "initial_sync": initial, "incremental_sync": incremental})
+        finally:
+            if not keep:
+                delete_benchmark_user(user_id)
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Plaid transaction sync against the offline Plaid simulator")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Transaction history sizes to benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the simulated transaction histories")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark users and transactions after the run")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.seed, args.keep)
+
+    # Save results to a JSON file with timestamp in the sync_benchmarks folder
+    timestamp = datetime.datetime.now()
+    benchmarks_dir = 'sync_benchmarks'
+    os.makedirs(benchmarks_dir, exist_ok=True)
+    filepath = os.path.join(benchmarks_dir, f'sync_benchmark_{timestamp.strftime("%Y%m%d_%H%M%S")}.json')
+    with open(filepath, 'w') as json_file:
+        json.dump({"benchmark_timestamp": timestamp.isoformat(), "results": results}, json_file, indent=4)
+
+    print(f"\nDetailed results saved to: {filepath}")
@@ -0,0 +1,230 @@
+import os
+from datetime import date, timedelta
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from .db import repos
+from .db_async import run_db, gather_db
+from .balance_counters import balance_counters
+from .user_metadata import user_metadata
+from .change_feed import category_payload, transaction_payload
+from .snapshot import SnapshotEncoder, gzip_stream
+from backend.db.schemas import read_cents
+from backend.db.versions import VERSION_FIELD, DELETED_FIELD, SYNCED_COLLECTIONS, to_version, from_version
+
+router = APIRouter()
+
+# Documents read per collection per call; must exceed the writes of one batch, which can share a version
+SYNC_CHANGES_PAGE_SIZE = int(os.getenv("SYNC_CHANGES_PAGE_SIZE", "1000"))
+
+# How long tombstones are kept (api/purge_tombstones.py); clients with an older version fetch everything again
+TOMBSTONE_RETENTION_DAYS = float(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+
+# Months of transactions in a snapshot unless the app asks otherwise (the current month and the ones before it)
+SNAPSHOT_MONTHS = int(os.getenv("SNAPSHOT_MONTHS", "3"))
+SNAPSHOT_MAX_MONTHS = 24
+
+class GetChangesRequest(BaseModel):
+    user_id: str
+    since: int = 0
+
+class GetSnapshotRequest(BaseModel):
+    user_id: str
+    months: int = SNAPSHOT_MONTHS
+
+def consistent_read_time(user_id):
+    """
+    Firestore's read time of the user's document, and whether it exists. It comes from the clock
+    that stamps `updated_at`, and every commit stamped at or before it is visible to the reads
+    that follow, so the changes read up to it are complete (unlike a cutoff from this server's clock)
+    """
+    user_doc = repos.users.get(user_id)
+    return user_doc.read_time, user_doc.exists
+
+def changes_response(version, resync=False, has_more=False, categories=(), category_groups=(), transactions=(), deleted=()):
+    return {
+        "version": version,
+        "resync": resync,
+        "has_more": has_more,
+        "categories": list(categories),
+        "category_groups": list(category_groups),
+        "transactions": list(transactions),
+        "deleted": list(deleted),
+    }
+
+def versioned(payload, version):
+    payload.pop(VERSION_FIELD, None)
+    payload["version"] = version
+    return payload
+
+def shard_states(category_docs):
+    """
+    {category_id: (summed shard amounts in cents, version of the newest shard write)} of the
+    sharded category snapshots, with every shard read in one round trip
+    """
+    shard_categories = {}  # shard document path -> category_id
+    shard_refs = []
+    for category_doc in category_docs:
+        for shard_ref in balance_counters.shard_refs(category_doc):
+            shard_categories[shard_ref.path] = category_doc.id
+            shard_refs.append(shard_ref)
+    states = {category_doc.id: (0, 0) for category_doc in category_docs}
+    if shard_refs:
+        for shard_doc in repos.get_all(shard_refs):
+            if shard_doc.exists:
+                category_id = shard_categories[shard_doc.reference.path]
+                cents, version = states[category_id]
+                shard_data = shard_doc.to_dict()
+                shard_version = to_version(shard_data[VERSION_FIELD]) if shard_data.get(VERSION_FIELD) else 0
+                states[category_id] = (cents + read_cents(shard_data, "available"), max(version, shard_version))
+    return states
+
+@router.post("/get-changes")
+async def get_changes(request: GetChangesRequest):
+    """
+    The user's categories, category groups and transactions changed since version `since`, and
+    the documents deleted since (`deleted`, as collection and ID), for clients keeping a local
+    copy (see db/versions.py). Clients store the returned `version` and pass it as `since` next
+    time, calling again right away while `has_more` is set. With `resync` set (first call with
+    `since=0`, or a version older than the tombstones kept) the client must fetch its data the
+    usual way and continue from the returned version.
+    """
+    user_id, since = request.user_id, request.since
+    try:
+        until, user_exists = await run_db(consistent_read_time, user_id)
+        if not user_exists:
+            raise HTTPException(status_code=404, detail="User not found")
+        version = to_version(until)
+        if since <= 0 or from_version(since) < until - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+            return changes_response(version, resync=True)
+        if since >= version:
+            return changes_response(since)
+
+        after = from_version(since)
+        categories, category_groups, transactions, tombstones, sharded = await gather_db(
+            lambda: list(repos.categories.changed(user_id, after, until, SYNC_CHANGES_PAGE_SIZE)),
+            lambda: list(repos.category_groups.changed(user_id, after, until, SYNC_CHANGES_PAGE_SIZE)),
+            lambda: list(repos.transactions.changed(user_id, after, until, SYNC_CHANGES_PAGE_SIZE)),
+            lambda: list(repos.tombstones.changed(user_id, after, until, SYNC_CHANGES_PAGE_SIZE)),
+            # A balance change of a sharded category only touches its shards, which are checked separately
+            lambda: list(repos.categories.sharded(user_id)),
+        )
+
+        # A full page may end partway through the documents of one version, so the response
+        # only covers the versions before the last one it read; the rest comes with the next call
+        through = version
+        for docs, field in ((categories, VERSION_FIELD), (category_groups, VERSION_FIELD), (transactions, VERSION_FIELD), (tombstones, DELETED_FIELD)):
+            if len(docs) == SYNC_CHANGES_PAGE_SIZE:
+                through = min(through, to_version(docs[-1].get(field)) - 1)
+
+        def within(docs, field=VERSION_FIELD):
+            return [(doc, to_version(doc.get(field))) for doc in docs if to_version(doc.get(field)) <= through]
+
+        shards = await run_db(shard_states, sharded)
+        changed_categories = {doc.id: (doc, category_version) for doc, category_version in within(categories)}
+        for doc in sharded:
+            if doc.id not in changed_categories and since < shards[doc.id][1] <= through:
+                changed_categories[doc.id] = (doc, shards[doc.id][1])
+
+        category_payloads = []
+        for category_id, (doc, category_version) in changed_categories.items():
+            data = doc.to_dict()
+            shard_cents, shard_version = shards.get(category_id, (0, 0)) if data.get("available_shards") else (0, 0)
+            payload = category_payload(category_id, data, read_cents(data, "available") + shard_cents)
+            category_payloads.append(versioned(payload, max(category_version, shard_version)))
+
+        return changes_response(
+            through,
+            has_more=through < version,
+            categories=category_payloads,
+            category_groups=[versioned({**doc.to_dict(), "id": doc.id}, doc_version) for doc, doc_version in within(category_groups)],
+            transactions=[versioned(transaction_payload(doc.id, doc.to_dict()), doc_version) for doc, doc_version in within(transactions)],
+            deleted=[
+                {"collection": doc.get("collection"), "id": doc.get("document_id"), "version": doc_version}
+                for doc, doc_version in within(tombstones, DELETED_FIELD) if doc.get("collection") in SYNCED_COLLECTIONS
+            ],
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving changes: {str(e)}")
+
+def month_start(months_back):
+    """First day (YYYY-MM-DD) of the month `months_back` months before the current one"""
+    today = date.today()
+    month_index = today.year * 12 + today.month - 1 - months_back
+    return date(month_index // 12, month_index % 12 + 1, 1).isoformat()
+
+def categories_with_totals(user_id):
+    """The user's category snapshots and their available amounts in cents (shards summed)"""
+    categories = list(repos.categories.for_user(user_id))
+    return categories, balance_counters.totals(categories)
+
+def plaid_item_summary(doc):
+    """What the app shows of a linked institution (no access token or sync cursor)"""
+    data = doc.to_dict()
+    return {
+        "id": doc.id,
+        "item_id": data.get("item_id"),
+        "institution_id": data.get("institution_id"),
+        "institution_name": data.get("institution_name"),
+        "accounts": data.get("accounts") or [],
+    }
+
+@router.post("/get-snapshot")
+async def get_snapshot(request: GetSnapshotRequest, http_request: Request):
+    """
+    The user's whole state for an app starting without a local copy, in one response: the user's
+    preferences, category groups, categories, Plaid item summaries and the transactions of the
+    last `months` months, in the columnar encoding of api/snapshot.py, streamed and gzipped when
+    the client accepts it. Every document is read in one concurrent fan-out. `version` is where
+    the app continues with `POST /sync/get-changes`.
+    """
+    user_id, months = request.user_id, request.months
+    if not 1 <= months <= SNAPSHOT_MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"months must be between 1 and {SNAPSHOT_MAX_MONTHS}")
+    try:
+        # Taken before the reads, so the changes pulled from it include anything written while they run
+        read_time, user_exists = await run_db(consistent_read_time, user_id)
+        if not user_exists:
+            raise HTTPException(status_code=404, detail="User not found")
+        version = to_version(read_time)
+        metadata = await run_db(user_metadata.get, user_id)
+        if metadata is None:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        start_date = month_start(months - 1)
+        (categories, available_cents), category_groups, plaid_items, transactions = await gather_db(
+            lambda: categories_with_totals(user_id),
+            lambda: list(repos.category_groups.for_user(user_id)),
+            lambda: list(repos.plaid_items.for_user(user_id)),
+            lambda: list(repos.transactions.dated_from(user_id, start_date, metadata["archived_through"])),
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving snapshot: {str(e)}")
+
+    # Newest first, as transaction pages are
+    transactions.sort(key=lambda doc: doc.id)
+    transactions.sort(key=lambda doc: doc.get("date"), reverse=True)
+
+    encoder = SnapshotEncoder(start_date)
+    header = {
+        "version": version,
+        "user": {
+            "email": metadata["email"],
+            "preferences": metadata["preferences"],
+            "unallocated_category_id": metadata["unallocated_category_id"],
+        },
+        "category_groups": encoder.category_groups(category_groups),
+        "categories": encoder.categories(categories, available_cents),
+        "plaid_items": [plaid_item_summary(doc) for doc in plaid_items],
+    }
+    pieces = encoder.stream(header, transactions)
+    if "gzip" in http_request.headers.get("accept-encoding", ""):
+        return StreamingResponse(gzip_stream(pieces), media_type="application/json", headers={
+            "Content-Encoding": "gzip",
+            "Vary": "Accept-Encoding",
+        })
+    return StreamingResponse(pieces, media_type="application/json", headers={"Vary": "Accept-Encoding"})
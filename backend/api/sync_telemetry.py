@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from .db import repos
+from .db_instrumentation import start_counting, stop_counting
+from backend.db.schemas import SyncRun as SyncRunSchema
+
+logger = logging.getLogger(__name__)
+telemetry_logger = logging.getLogger("sync_telemetry")
+
+# Per-transaction debug messages are only logged for every Nth transaction
+DEBUG_SAMPLE_EVERY = max(int(os.getenv("SYNC_DEBUG_SAMPLE_EVERY", "100")), 1)
+
+def sampled_debug(log, index, message, *args):
+    """Log a per-transaction debug message for one in every DEBUG_SAMPLE_EVERY transactions"""
+    if index % DEBUG_SAMPLE_EVERY == 0 and log.isEnabledFor(logging.DEBUG):
+        log.debug(message, *args)
+
+class ItemTelemetry:
+    """Plaid call latency, pages and update counts for one Plaid item in a sync run"""
+
+    def __init__(self, item_id, institution_name):
+        self.item_id = item_id
+        self.institution_name = institution_name
+        self.pages = 0
+        self.plaid_seconds = 0.0
+        self.max_page_seconds = 0.0
+        self.added = 0
+        self.modified = 0
+        self.removed = 0
+
+    @contextmanager
+    def plaid_call(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.pages += 1
+            self.plaid_seconds += elapsed
+            self.max_page_seconds = max(self.max_page_seconds, elapsed)
+
+    def record_page(self, plaid_response):
+        self.added += len(plaid_response.get("added", []))
+        self.modified += len(plaid_response.get("modified", []))
+        self.removed += len(plaid_response.get("removed", []))
+
+    def as_dict(self):
+        return {
+            "item_id": self.item_id,
+            "institution_name": self.institution_name,
+            "pages": self.pages,
+            "plaid_seconds": round(self.plaid_seconds, 4),
+            "max_page_seconds": round(self.max_page_seconds, 4),
+            "added": self.added,
+            "modified": self.modified,
+            "removed": self.removed,
+        }
+
+class SyncTelemetry:
+    """
+    Structured telemetry for one Plaid sync run: per-item Plaid timings and counts, phase
+    durations, Firestore operations and batch commit latency. `finish()` emits the record as a
+    single JSON line on the `sync_telemetry` logger and stores it in the sync_runs collection.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.items = []
+        self.phases = {}
+        self.totals = {}
+        self.commit_results = []
+        self.record = None
+        self.operations, self.counting_token = start_counting()
+
+    def item(self, item_id, institution_name):
+        item = ItemTelemetry(item_id, institution_name)
+        self.items.append(item)
+        return item
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(self.phases.get(name, 0.0) + time.perf_counter() - start, 4)
+
+    def record_commits(self, commit_results):
+        self.commit_results.extend(commit_results)
+
+    def batch_commit_stats(self):
+        seconds = [result.seconds for result in self.commit_results]
+        return {
+            "count": len(seconds),
+            "failed": sum(1 for result in self.commit_results if not result.committed),
+            "retried": sum(1 for result in self.commit_results if result.attempts > 1),
+            "total_seconds": round(sum(seconds), 4),
+            "max_seconds": round(max(seconds), 4) if seconds else 0.0,
+        }
+
+    def finish(self, status, error=None):
+        """Stop counting, then emit and store the sync run record; returns the record"""
+        if self.record is not None:
+            return self.record
+        stop_counting(self.counting_token)
+        duration_seconds = round(time.perf_counter() - self.start, 4)
+        # Telemetry must never fail the sync itself: a record that doesn't validate falls back to a minimal one
+        try:
+            record = SyncRunSchema(
+                user_id=self.user_id,
+                status=status,
+                error=error,
+                started_at=self.started_at,
+                duration_seconds=duration_seconds,
+                phases=self.phases,
+                items=[item.as_dict() for item in self.items],
+                totals=self.totals,
+                firestore_operations=self.operations.as_dict(),
+                batch_commits=self.batch_commit_stats(),
+            ).to_dict()
+        except Exception as e:
+            logger.error(f"Invalid sync run record for user_id: {self.user_id}, error: {e}")
+            record = {
+                "user_id": self.user_id,
+                "status": status,
+                "error": error,
+                "started_at": self.started_at,
+                "duration_seconds": duration_seconds,
+                "telemetry_error": str(e),
+                "created_at": datetime.now(timezone.utc),
+            }
+        self.record = record
+
+        telemetry_logger.info(json.dumps(record, default=str))
+        try:
+            repos.sync_runs.create(record)
+        except Exception as e:
+            logger.error(f"Failed to store sync run record for user_id: {self.user_id}, error: {e}")
+        return record
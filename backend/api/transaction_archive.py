@@ -0,0 +1,129 @@
+import os
+import logging
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from google.api_core.exceptions import AlreadyExists
+from .db import repos, Increment
+from .user_metadata import user_metadata
+from backend.db.archive import MAX_BLOCK_BYTES, month_of, block_id, block_document, category_key, encode_rows
+from backend.db.schemas import read_cents
+
+logger = logging.getLogger(__name__)
+
+# Transactions from months that ended at least this many days ago are compacted into archive blocks
+TRANSACTION_ARCHIVE_AFTER_DAYS = int(os.getenv("TRANSACTION_ARCHIVE_AFTER_DAYS", "365"))
+
+def archive_cutoff_month(today=None):
+    """The oldest month kept live: transactions dated in earlier months are compacted"""
+    return ((today or date.today()) - timedelta(days=TRANSACTION_ARCHIVE_AFTER_DAYS)).strftime("%Y-%m")
+
+class TransactionArchive:
+    """
+    Moves old transactions into archive blocks (cold storage, see db/archive.py) and back.
+
+    `compact_user` moves a user's posted transactions dated before a month into blocks, one
+    batch per block: the block is created and the transactions it holds deleted atomically, so
+    every transaction is always either live or archived, and an interrupted compaction simply
+    resumes on the next run. Balances don't change, as the transactions stay counted in them.
+    An edit committed between the compaction's read of a month and its batch is lost, so run it
+    for months old enough not to be edited any more (TRANSACTION_ARCHIVE_AFTER_DAYS).
+
+    `unarchive` moves one transaction back to the live collection before it is edited (by a
+    route or a Plaid sync). Blocks are never rewritten: the row is marked as moved back and the
+    block's totals decremented in the batch that recreates the live document.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # One unarchive at a time per process
+
+    def compact_user(self, user_id, before_month, dry_run=False):
+        """Archive the user's transactions dated before `before_month` (YYYY-MM); returns stats"""
+        stats = {"transactions": 0, "blocks": 0, "months": 0, "newest_month": None}
+        by_month = defaultdict(list)
+        for doc in repos.transactions.dated_before(user_id, f"{before_month}-01"):
+            # Pending transactions are still replaced by their posted version during syncs
+            if not doc.to_dict().get("pending"):
+                by_month[month_of(doc.to_dict()["date"])].append(doc)
+        if not by_month:
+            return stats
+
+        stats["months"] = len(by_month)
+        stats["transactions"] = sum(len(docs) for docs in by_month.values())
+        stats["newest_month"] = max(by_month)
+        if dry_run:
+            return stats
+
+        self.mark_archived_through(user_id, stats["newest_month"])
+
+        # A block and the deletes of its transactions must fit one batch
+        max_rows = repos.batch_writes_for_user(user_id) - 1
+        for month, docs in sorted(by_month.items()):
+            part = max((block.get("part") for block in repos.transaction_archive.blocks(user_id, month, month)), default=-1) + 1
+            for start in range(0, len(docs), max_rows):
+                for rows, payload in self._blocks({doc.id: doc.to_dict() for doc in docs[start:start + max_rows]}):
+                    batch = repos.batch()
+                    batch.create(
+                        repos.transaction_archive.ref(block_id(user_id, month, part), user_id=user_id),
+                        block_document(user_id, month, part, rows, payload)
+                    )
+                    # The transactions stay in the user's history, so they leave no tombstone for caching clients
+                    for transaction_id in rows:
+                        batch.delete(repos.transactions.ref(transaction_id, user_id=user_id), tombstone=False)
+                    batch.commit()
+                    stats["blocks"] += 1
+                    part += 1
+        return stats
+
+    def mark_archived_through(self, user_id, month):
+        """
+        Raise the user's `archived_through` month, which readers check before looking for archived
+        transactions (through the cached user metadata); returns whether it changed
+        """
+        user_doc = repos.users.get(user_id)
+        if ((user_doc.to_dict() or {}).get("archived_through") or "") >= month:
+            return False
+        repos.users.update(user_id, {"archived_through": month})
+        user_metadata.invalidate(user_id)
+        return True
+
+    def _blocks(self, rows):
+        """(rows, payload) chunks of {transaction_id: data} whose compressed payload fits a block"""
+        payload = encode_rows(rows)
+        if len(payload) <= MAX_BLOCK_BYTES or len(rows) == 1:
+            yield rows, payload
+            return
+        ids = list(rows)
+        for half in (ids[:len(ids) // 2], ids[len(ids) // 2:]):
+            yield from self._blocks({transaction_id: rows[transaction_id] for transaction_id in half})
+
+    def unarchive(self, user_id, transaction_id=None, plaid_transaction_id=None):
+        """
+        Move an archived transaction (by ID or Plaid ID) back to the live collection; returns its
+        live snapshot, or None if no archived transaction matches
+        """
+        with self._lock:
+            row, block = repos.transaction_archive.locate(user_id, transaction_id, plaid_transaction_id)
+            if row is None:
+                return None
+
+            data = row.to_dict()
+            key = category_key(data.get("category_id"))
+            transaction_ref = repos.transactions.ref(row.id, user_id=user_id)
+            batch = repos.batch()
+            batch.create(transaction_ref, data)
+            batch.update(repos.transaction_archive.ref(block.id, user_id=user_id), {
+                f"unarchived.{row.id}": True,
+                "count": Increment(-1),
+                f"category_totals.{key}.count": Increment(-1),
+                f"category_totals.{key}.amount_cents": Increment(-read_cents(data, "amount")),
+            })
+            try:
+                batch.commit()
+                logger.info(f"Unarchived transaction {row.id} from block {block.id} for user_id: {user_id}")
+            except AlreadyExists:
+                # Another process moved it back in the meantime
+                pass
+            return transaction_ref.get()
+
+transaction_archive = TransactionArchive()
@@ -1,11 +1,19 @@
 from fastapi import APIRouter, HTTPException
+from google.api_core.exceptions import NotFound
 from pydantic import BaseModel
-from datetime import datetime, timezone
 from decimal import Decimal
-from google.cloud import firestore
-from .db import db, NULL_VALUE
+from .db import repos, NULL_VALUE, DELETE_FIELD
+from .db_async import run_db, fetch, gather_db
+from .unit_of_work import UnitOfWork
+from .balance_counters import balance_counters
+from .user_metadata import user_metadata
+from .transaction_archive import transaction_archive
 from .plaid_utils import get_plaid_transactions, get_saved_cursor  # Assuming helper functions exist for Plaid API calls
-from backend.db.schemas import Transaction as TransactionSchema
+from .categorization_rules import load_rule_set
+from .batch_commit import commit_batches
+from .sync_telemetry import SyncTelemetry, sampled_debug
+from .integrity import check_user
+from backend.db.schemas import TransactionRecord, to_cents, from_cents, read_cents, dollar_amounts
 import logging
 import os
 
@@ -25,6 +33,9 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Check the user's balances at the end of each Plaid sync unless the request says otherwise
+VERIFY_BALANCES_AFTER_SYNC = os.getenv("VERIFY_BALANCES_AFTER_SYNC", "false").lower() == "true"
+
 def convert_plaid_personal_finance_category(pfc):
     """Convert Plaid PersonalFinanceCategory object to a dictionary for Firestore storage"""
     if not pfc:
@@ -47,6 +58,89 @@ def convert_plaid_personal_finance_category(pfc):
         except:
             return None
 
+def plaid_transaction_record(transaction, user_id, item_data, account_name, category_id):
+    """Validated transaction record for a synced Plaid transaction"""
+    return TransactionRecord(
+        # Plaid amounts are positive for money leaving the account; ours are the opposite, in cents
+        amount_cents=-to_cents(transaction["amount"]),
+        name=transaction["name"],
+        date=transaction['date'].strftime("%Y-%m-%d"),
+        user_id=user_id,
+        category_id=category_id,
+        plaid_transaction_id=transaction["transaction_id"],
+        institution_name=item_data["institution_name"],
+        account_name=account_name,
+        merchant_name=transaction.get("merchant_name"),
+        personal_finance_category=convert_plaid_personal_finance_category(transaction.get("personal_finance_category")),
+        pending=transaction.get("pending")
+    )
+
+def reconcile_pending_transactions(user_id, added_transactions, deleted_transactions):
+    """
+    Match posted transactions to the pending transactions they replace within one sync run.
+
+    When Plaid posts a pending transaction, the pending one comes through `removed` and the
+    posted one through `added` with `pending_transaction_id` pointing at it. Returns a map of
+    posted plaid transaction ID -> the stored pending document, its category_id and amount, so
+    the posted transaction can keep the user's category and only the net amount difference is
+    applied to the category's available amount.
+    """
+    removed_ids = {transaction["transaction_id"] for transaction in deleted_transactions}
+
+    # Hash map of pending transaction ID -> posted transaction, limited to pending transactions removed in this run
+    posted_by_pending_id = {}
+    for transaction in added_transactions:
+        pending_id = transaction.get("pending_transaction_id")
+        if pending_id and pending_id in removed_ids:
+            posted_by_pending_id[pending_id] = transaction
+
+    # The stored pending transactions, read with one query per batch of IDs
+    stored_pending = repos.transactions.by_plaid_ids(user_id, posted_by_pending_id)
+    pending_docs = {}
+    for pending_id, posted_transaction in posted_by_pending_id.items():
+        if pending_id not in stored_pending:
+            continue
+
+        pending_docs[posted_transaction["transaction_id"]] = (pending_id, stored_pending[pending_id][0])
+
+    # Only carry over categories that still exist, checked with one bulk read
+    category_ids = {doc.to_dict().get("category_id") for _, doc in pending_docs.values()} - {None, ""}
+    existing_categories = repos.categories.get_many(category_ids, user_id=user_id)
+
+    reconciled = {}
+    for posted_id, (pending_id, pending_doc) in pending_docs.items():
+        pending_data = pending_doc.to_dict()
+        category_id = pending_data.get("category_id")
+        reconciled[posted_id] = {
+            "pending_transaction_id": pending_id,
+            "pending_ref": repos.transactions.ref(pending_doc.id, user_id=user_id),
+            "category_id": category_id if category_id in existing_categories else NULL_VALUE,
+            "pending_amount_cents": read_cents(pending_data, "amount"),
+        }
+
+    return reconciled
+
+def apply_category_deltas(batch, user_id, category_deltas):
+    """
+    Add the summed amount deltas (in cents) for each of the user's categories to its available amount within the given batch
+    (or unit of work). Uses server-side increments (on a counter shard for sharded categories), so
+    batches touching the same category can be committed concurrently. Callers must make sure the
+    categories exist.
+    """
+    for category_id, delta in category_deltas.items():
+        if delta == 0:
+            continue
+        balance_counters.increment(batch, user_id, category_id, delta)
+
+def get_for_edit(uow, transaction_ref, user_id):
+    """The transaction's snapshot for an edit, moving it back from the archive first if it was compacted"""
+    transaction_doc = uow.get(transaction_ref)
+    if not transaction_doc.exists:
+        archived_doc = transaction_archive.unarchive(user_id, transaction_id=transaction_ref.id)
+        if archived_doc:
+            transaction_doc = uow.remember(archived_doc)
+    return transaction_doc
+
 class User(BaseModel):
     email: str
     user_id: str
@@ -85,6 +179,11 @@ class UpdateTransactionDateRequest(BaseModel):
 
 class SyncPlaidTransactionsRequest(BaseModel):
     user_id: str
+    verify_balances: bool = VERIFY_BALANCES_AFTER_SYNC
+
+class ApplyCategorizationRulesRequest(BaseModel):
+    user_id: str
+    only_uncategorized: bool = True  # False also re-categorizes transactions that already have a category
 
 @router.post("/get-transactions")
 async def get_transactions(request: UserIDRequest):
@@ -92,7 +191,7 @@ async def get_transactions(request: UserIDRequest):
         # print(f"Request received: user_id={request.user_id}, category_id={request.category_id}, limit={request.limit}, cursor_id={request.cursor_id}")
         
         # Start with the basic user_id filter
-        transactions_query = db.collection("transactions").where("user_id", "==", request.user_id)
+        filters = {}
         
         # If a category_id is provided, add that filter
         if request.category_id:
@@ -102,37 +201,26 @@ async def get_transactions(request: UserIDRequest):
             if request.category_id == "null":
                 print("Filtering for null category_id")
                 # Use NULL_VALUE (None) for consistent null value handling
-                transactions_query = db.collection("transactions").where("user_id", "==", request.user_id).where("category_id", "==", NULL_VALUE)
+                filters["category_id"] = NULL_VALUE
                 
                 print(f"Using NULL_VALUE to query for transactions with null category_id")
             else:
-                transactions_query = db.collection("transactions").where("user_id", "==", request.user_id).where("category_id", "==", request.category_id)
-        
-        # Sort by date in descending order (most recent first)
-        transactions_query = transactions_query.order_by("date", direction=firestore.Query.DESCENDING)
-        
-        # If cursor_id is provided, start after that document for pagination
-        if request.cursor_id:
-            # Get the document to use as cursor
-            cursor_doc = db.collection("transactions").document(request.cursor_id).get()
-            if cursor_doc.exists:
-                transactions_query = transactions_query.start_after(cursor_doc)
-                print(f"Starting after document with ID: {request.cursor_id}")
-            else:
-                print(f"Cursor document with ID {request.cursor_id} not found")
-        
-        # Limit the number of results
-        transactions_query = transactions_query.limit(request.limit)
-        
-        # Execute the query
-        transactions_docs = transactions_query.stream()
+                filters["category_id"] = request.category_id
+        
+        # Most recent first, starting after the cursor document (if given) for pagination; archived
+        # months are merged in once the pages reach them (newest archived month from cached user metadata)
+        metadata = await run_db(user_metadata.get, request.user_id)
+        transactions_docs = await fetch(
+            repos.transactions.page, request.user_id, request.limit, cursor_id=request.cursor_id,
+            archived_through=(metadata or {}).get("archived_through"), **filters
+        )
 
         # Collect transactions into a list, converting each document to a dictionary
         transactions = []
         last_doc_id = None
         
         for doc in transactions_docs:
-            transaction_data = doc.to_dict()
+            transaction_data = dollar_amounts(doc.to_dict(), "amount")  # Stored in cents, returned in dollars
             transaction_data["id"] = doc.id  # Add the transaction ID to the response
             
             # Store the last document ID for pagination
@@ -168,55 +256,46 @@ async def get_transactions(request: UserIDRequest):
 async def create_transaction(transaction: Transaction):
     try:
         # logger.info("Creating a new transaction with name: %s for user_id: %s and category_id: %s", transaction.name, transaction.user_id, transaction.category_id)
-        
-        user_ref = db.collection("users").document(transaction.user_id)
-        category_ref = db.collection("categories").document(transaction.category_id)
 
-        user_doc = user_ref.get()
-        if not user_doc.exists:
+        # The user comes from cached metadata; the category isn't read (see the increment below)
+        metadata = await run_db(user_metadata.get, transaction.user_id)
+        if metadata is None:
             raise HTTPException(status_code=404, detail="User not found")
-
-        category_doc = category_ref.get()
-        if not category_doc.exists:
-            raise HTTPException(status_code=404, detail="Category not found")
         
-        # Create a validated transaction using our schema
-        transaction_schema = TransactionSchema(
-            amount=transaction.amount,
+        # Create a validated transaction record (its type follows the sign of the amount)
+        amount_cents = to_cents(transaction.amount)
+        transaction_record = TransactionRecord(
+            amount_cents=amount_cents,
             user_id=transaction.user_id,
             category_id=transaction.category_id,
             name=transaction.name,
-            date=transaction.date,
-            type="debit" if transaction.amount < 0 else "credit"
+            date=transaction.date
         )
         
-        # Calculate new available amount for the category
-        category_data = category_doc.to_dict()
-        current_available = Decimal(str(category_data.get("available", 0.0)))
-        new_available = current_available + transaction.amount
-        
-        # Use batch write for atomicity
-        batch = db.batch()
-        
         # 1. Create the transaction
-        transaction_ref = db.collection("transactions").document()
-        batch.set(transaction_ref, transaction_schema.to_dict())
+        uow = UnitOfWork()
+        transaction_ref = repos.transactions.ref(user_id=transaction.user_id)
+        uow.set(transaction_ref, transaction_record.to_dict())
         
-        # 2. Update category available amount
-        batch.update(category_ref, {"available": float(new_available)})
+        # 2. Update category available amount (server-side increment)
+        balance_counters.increment(uow, transaction.user_id, transaction.category_id, amount_cents)
         
-        # Execute all writes atomically
-        batch.commit()
+        # Execute all writes atomically (in a batch shared with concurrent requests); they fail as a whole if the category doesn't exist
+        try:
+            await uow.commit_coalesced()
+        except NotFound:
+            raise HTTPException(status_code=404, detail="Category not found")
         
         # Get user email for logging
-        user_data = user_doc.to_dict()
-        user_email = user_data.get('email', 'Unknown')
+        user_email = metadata.get('email') or 'Unknown'
         
         # Log transaction creation with category
-        transaction_logger.info(f"Transaction created with category - Transaction: '{transaction.name}' (ID: {transaction_ref.id}), Amount: ${transaction.amount}, Category: '{category_data.get('name', 'Unknown')}' (ID: {transaction.category_id}), New category available: ${new_available}, User ID: {transaction.user_id}, User Email: {user_email}")
+        transaction_logger.info(f"Transaction created with category - Transaction: '{transaction.name}' (ID: {transaction_ref.id}), Amount: ${transaction.amount}, Category ID: {transaction.category_id}, User ID: {transaction.user_id}, User Email: {user_email}")
         
         # logger.info("Transaction created successfully with ID: %s", transaction_ref.id)
         return {"message": "Transaction created successfully.", "transaction_id": transaction_ref.id}
+    except HTTPException:
+        raise
     except ValueError as e:
         # This will catch validation errors from the Pydantic model
         raise HTTPException(status_code=400, detail=str(e))
@@ -229,8 +308,9 @@ async def delete_transaction(request: DeleteTransactionRequest):
     try:
         # print(f"Deleting transaction {request.transaction_id} for user {request.user_id}")
         
-        transaction_ref = db.collection("transactions").document(request.transaction_id)
-        transaction_doc = transaction_ref.get()
+        uow = UnitOfWork()
+        transaction_ref = repos.transactions.ref(request.transaction_id, user_id=request.user_id)
+        transaction_doc = await run_db(get_for_edit, uow, transaction_ref, request.user_id)
         
         if not transaction_doc.exists:
             raise HTTPException(status_code=404, detail="Transaction not found")
@@ -242,38 +322,26 @@ async def delete_transaction(request: DeleteTransactionRequest):
             raise HTTPException(status_code=403, detail="User ID does not match the transaction")
         
         category_id = transaction_data.get("category_id")
-        new_available = None
-        
-        if category_id:
-            category_ref = db.collection("categories").document(category_id)
-            category_doc = category_ref.get()
-            
-            if not category_doc.exists:
-                raise HTTPException(status_code=404, detail="Category not found")
-            
-            # Calculate new available amount for the category
-            category_data = category_doc.to_dict()
-            transaction_amount = Decimal(str(transaction_data["amount"]))
-            current_available = Decimal(str(category_data.get("available", 0.0)))
-            new_available = current_available - transaction_amount
-        else:
+        if not category_id:
             print("Transaction has no category - skipping category update")
 
-        # Use batch write for atomicity
-        batch = db.batch()
-        
         # 1. Delete the transaction
-        batch.delete(transaction_ref)
+        uow.delete(transaction_ref)
         
-        # 2. Update category available amount if transaction had a category
-        if category_id and new_available is not None:
-            batch.update(category_ref, {"available": float(new_available)})
+        # 2. Update category available amount if transaction had a category (server-side increment)
+        if category_id:
+            balance_counters.increment(uow, request.user_id, category_id, -read_cents(transaction_data, "amount"))
         
-        # Execute all writes atomically
-        batch.commit()
+        # Execute all writes atomically (in a batch shared with concurrent requests); they fail as a whole if the category doesn't exist
+        try:
+            await uow.commit_coalesced()
+        except NotFound:
+            raise HTTPException(status_code=404, detail="Category not found")
         # print(f"Transaction {request.transaction_id} deleted successfully")
         
         return {"message": "Transaction deleted successfully.", "transaction_id": request.transaction_id}
+    except HTTPException:
+        raise
     except Exception as e:
         # logger.error("Failed to delete transaction: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to delete transaction: %e")
@@ -283,8 +351,9 @@ async def update_transaction_category(request: UpdateTransactionCategoryRequest)
     try:
         print(f"Received request to update transaction category: {request}")
         
-        transaction_ref = db.collection("transactions").document(request.transaction_id)
-        transaction_doc = transaction_ref.get()
+        uow = UnitOfWork()
+        transaction_ref = repos.transactions.ref(request.transaction_id, user_id=request.user_id)
+        transaction_doc = await run_db(get_for_edit, uow, transaction_ref, request.user_id)
         
         if not transaction_doc.exists:
             print(f"Transaction with ID {request.transaction_id} not found.")
@@ -298,15 +367,12 @@ async def update_transaction_category(request: UpdateTransactionCategoryRequest)
             raise HTTPException(status_code=403, detail="User ID does not match the transaction")
         
         old_category_id = transaction_data.get("category_id")
-        old_category_ref = db.collection("categories").document(old_category_id) if old_category_id else None
-        old_category_doc = old_category_ref.get() if old_category_ref and callable(old_category_ref.get) else None
-        
-        if old_category_id and old_category_doc and not old_category_doc.exists:
-            print(f"Old category with ID {old_category_id} not found.")
-            raise HTTPException(status_code=404, detail="Old category not found")
-        
-        old_category_data = old_category_doc.to_dict() if old_category_doc else None
-        print(f"Old category data: {old_category_data}")
+        old_category_ref = repos.categories.ref(old_category_id, user_id=request.user_id) if old_category_id else None
+        new_category_ref = None if (request.category_id == "null" or request.category_id is None) else repos.categories.ref(request.category_id, user_id=request.user_id)
+
+        # Only the new category is read (to check it belongs to the user); the old category's
+        # balance is incremented without reading it
+        new_category_doc = await run_db(uow.get, new_category_ref) if new_category_ref else None
         
         # Check if the category is already the same - no need to update
         normalized_old_category_id = old_category_id if old_category_id else None
@@ -320,11 +386,7 @@ async def update_transaction_category(request: UpdateTransactionCategoryRequest)
         if request.category_id == "null" or request.category_id is None:
             print(f"Setting transaction {request.transaction_id} to have no category")
             new_category_data = None
-            new_category_ref = None
         else:
-            new_category_ref = db.collection("categories").document(request.category_id)
-            new_category_doc = new_category_ref.get() if callable(new_category_ref.get) else None
-            
             if not new_category_doc or not new_category_doc.exists:
                 print(f"New category with ID {request.category_id} not found.")
                 raise HTTPException(status_code=404, detail="New category not found")
@@ -337,67 +399,56 @@ async def update_transaction_category(request: UpdateTransactionCategoryRequest)
                 raise HTTPException(status_code=403, detail="New category does not belong to the user")
         
         # Get transaction amount for calculations
-        transaction_amount = transaction_data["amount"]
+        transaction_amount_cents = read_cents(transaction_data, "amount")
+        transaction_amount = from_cents(transaction_amount_cents)
         print(f"Transaction amount: {transaction_amount}")
         
-        # Get user email for logging
-        user_ref = db.collection("users").document(request.user_id)
-        user_doc = user_ref.get()
-        user_email = "Unknown"
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            user_email = user_data.get('email', 'Unknown')
-
-        # Calculate new available amounts before batch operations
-        new_old_available = None
-        new_new_available = None
-        
-        if old_category_data:
-            old_available = Decimal(str(old_category_data.get("available", 0.0)))
-            new_old_available = old_available - Decimal(str(transaction_amount))
-            
-        if new_category_data:
-            new_available = Decimal(str(new_category_data.get("available", 0.0)))
-            new_new_available = new_available + Decimal(str(transaction_amount))
+        # Get user email for logging (cached user metadata, no read in the common case)
+        metadata = await run_db(user_metadata.get, request.user_id)
+        user_email = (metadata or {}).get('email') or 'Unknown'
 
-        # Use batch write for atomicity
-        batch = db.batch()
-        
         # 1. Update the transaction's category_id
         if request.category_id == "null" or request.category_id is None:
-            batch.update(transaction_ref, {"category_id": None})
+            uow.update(transaction_ref, {"category_id": None})
         else:
-            batch.update(transaction_ref, {"category_id": request.category_id})
+            uow.update(transaction_ref, {"category_id": request.category_id})
         
         # 2. Update old category available amount (subtract transaction amount)
-        if old_category_data and old_category_ref:
-            batch.update(old_category_ref, {"available": float(new_old_available)})
+        if old_category_ref:
+            balance_counters.increment(uow, request.user_id, old_category_id, -transaction_amount_cents)
         
         # 3. Update new category available amount (add transaction amount)
         if new_category_data and new_category_ref:
-            batch.update(new_category_ref, {"available": float(new_new_available)})
+            balance_counters.increment(uow, request.user_id, request.category_id, transaction_amount_cents)
         
-        # Execute all writes atomically
-        batch.commit()
+        # Execute all writes atomically (in a batch shared with concurrent requests); they fail as a whole if the old category doesn't exist
+        try:
+            await uow.commit_coalesced()
+        except NotFound:
+            print(f"Old category with ID {old_category_id} not found.")
+            raise HTTPException(status_code=404, detail="Old category not found")
+
         # Log the transaction categorization results
-        if new_category_data and new_new_available is not None:
-            print(f"Updated new category available amount to {new_new_available}")
+        if new_category_data:
+            print(f"Added {transaction_amount} to new category available amount")
             
             # Log transaction categorization
-            transaction_logger.info(f"Transaction categorized - Transaction: '{transaction_data.get('name', 'Unknown')}' (ID: {request.transaction_id}), Amount: ${transaction_amount}, New category: '{new_category_data.get('name', 'Unknown')}' (ID: {request.category_id}), New category available: ${new_new_available}, User ID: {request.user_id}, User Email: {user_email}")
+            transaction_logger.info(f"Transaction categorized - Transaction: '{transaction_data.get('name', 'Unknown')}' (ID: {request.transaction_id}), Amount: ${transaction_amount}, New category: '{new_category_data.get('name', 'Unknown')}' (ID: {request.category_id}), User ID: {request.user_id}, User Email: {user_email}")
         else:
             print("Transaction set to have no category - no new category to update")
             
             # Log transaction uncategorization
             transaction_logger.info(f"Transaction uncategorized - Transaction: '{transaction_data.get('name', 'Unknown')}' (ID: {request.transaction_id}), Amount: ${transaction_amount}, Set to no category, User ID: {request.user_id}, User Email: {user_email}")
         
-        if old_category_data and new_old_available is not None:
-            print(f"Updated old category available amount to {new_old_available}")
+        if old_category_ref:
+            print(f"Subtracted {transaction_amount} from old category available amount")
         else:
             print("No old category to update (transaction was uncategorized).")
         
         print(f"Transaction category updated successfully for transaction_id: {request.transaction_id}")
         return {"message": "Transaction category updated successfully.", "transaction_id": request.transaction_id}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error updating transaction category: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to update transaction category: {e}")
@@ -407,8 +458,8 @@ async def update_transaction_date(request: UpdateTransactionDateRequest):
     try:
         print(f"Received request to update transaction date: {request}")
         
-        transaction_ref = db.collection("transactions").document(request.transaction_id)
-        transaction_doc = transaction_ref.get()
+        transaction_ref = repos.transactions.ref(request.transaction_id, user_id=request.user_id)
+        transaction_doc = await run_db(get_for_edit, UnitOfWork(), transaction_ref, request.user_id)
         
         if not transaction_doc.exists:
             print(f"Transaction with ID {request.transaction_id} not found.")
@@ -426,16 +477,12 @@ async def update_transaction_date(request: UpdateTransactionDateRequest):
             print(f"Date is already the same ({request.date}), no update needed")
             return {"message": "Transaction date is already set to the requested date.", "transaction_id": request.transaction_id}
         
-        # Update the transaction date
-        transaction_ref.update({"date": request.date})
-        
-        # Get user email for logging
-        user_ref = db.collection("users").document(request.user_id)
-        user_doc = user_ref.get()
-        user_email = "Unknown"
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            user_email = user_data.get("email", "Unknown")
+        # Update the transaction date and get the user email for logging (cached user metadata) concurrently
+        _, metadata = await gather_db(
+            lambda: transaction_ref.update({"date": request.date}),
+            lambda: user_metadata.get(request.user_id)
+        )
+        user_email = (metadata or {}).get("email") or "Unknown"
         
         # Log the transaction date update
         transaction_logger.info(f"Transaction date updated - User: {user_email}, Transaction ID: {request.transaction_id}, Old Date: {transaction_data.get('date')}, New Date: {request.date}")
@@ -446,14 +493,77 @@ async def update_transaction_date(request: UpdateTransactionDateRequest):
         print(f"Error updating transaction date: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to update transaction date: {e}")
 
+@router.post("/apply-categorization-rules")
+async def apply_categorization_rules(request: ApplyCategorizationRulesRequest):
+    """Re-apply the user's categorization rules to existing transactions in bulk"""
+    try:
+        filters = {"category_id": NULL_VALUE} if request.only_uncategorized else {}
+
+        # Load the rules and the candidate transactions concurrently
+        rule_set, transaction_docs = await gather_db(
+            lambda: load_rule_set(request.user_id),
+            lambda: list(repos.transactions.find(user_id=request.user_id, **filters))
+        )
+        if not len(rule_set):
+            return {"message": "No categorization rules to apply.", "updated": 0}
+
+        # Collect (transaction_ref, old_category_id, new_category_id, amount in cents) for every transaction a rule changes
+        updates = []
+        for doc in transaction_docs:
+            transaction_data = doc.to_dict()
+            new_category_id = rule_set.match(transaction_data)
+            old_category_id = transaction_data.get("category_id") or None
+            if new_category_id and new_category_id != old_category_id:
+                updates.append((repos.transactions.ref(doc.id, user_id=request.user_id), old_category_id, new_category_id, read_cents(transaction_data, "amount")))
+
+        # Each batch holds one write per transaction plus one balance update per distinct category (500 operations max,
+        # fewer while the user's documents are being migrated and every write goes to both layouts)
+        max_ops = repos.batch_writes_for_user(request.user_id)
+        update_batches = []
+        current_batch = []
+        current_categories = set()
+        for update in updates:
+            new_categories = {category_id for category_id in (update[1], update[2]) if category_id and category_id not in current_categories}
+            if current_batch and len(current_batch) + len(current_categories) + len(new_categories) + 1 > max_ops:
+                update_batches.append(current_batch)
+                current_batch = []
+                current_categories = set()
+            current_batch.append(update)
+            current_categories.update(category_id for category_id in (update[1], update[2]) if category_id)
+        if current_batch:
+            update_batches.append(current_batch)
+
+        for batch_updates in update_batches:
+            batch = repos.batch()
+            category_deltas = {}
+            for transaction_ref, old_category_id, new_category_id, amount_cents in batch_updates:
+                batch.update(transaction_ref, {"category_id": new_category_id})
+                if old_category_id:
+                    category_deltas[old_category_id] = category_deltas.get(old_category_id, 0) - amount_cents
+                category_deltas[new_category_id] = category_deltas.get(new_category_id, 0) + amount_cents
+            apply_category_deltas(batch, request.user_id, category_deltas)
+            await run_db(batch.commit)
+
+        transaction_logger.info(f"Categorization rules applied - User ID: {request.user_id}, Transactions updated: {len(updates)}")
+        return {"message": "Categorization rules applied successfully.", "updated": len(updates)}
+    except Exception as e:
+        print(f"Error applying categorization rules: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to apply categorization rules: {e}")
+
 @router.post("/sync-plaid-transactions")
 async def sync_plaid_transactions(request: SyncPlaidTransactionsRequest):
+    # The sync is a long sequence of blocking Plaid and database calls; run it in the threadpool
+    # so it doesn't hold the event loop for the whole sync
+    return await run_db(run_plaid_sync, request)
+
+def run_plaid_sync(request: SyncPlaidTransactionsRequest):
+    """Sync every Plaid item of the user: fetch updates, then apply added, modified and removed transactions"""
+    telemetry = SyncTelemetry(request.user_id)
     try:
-        print(f"Starting sync for user_id: {request.user_id}")
+        logger.info(f"Starting sync for user_id: {request.user_id}")
         
         user_id = request.user_id
-        plaid_items_query = db.collection("plaid_items").where("user_id", "==", user_id)
-        plaid_items_docs = list(plaid_items_query.stream())  # Convert to list so we can iterate twice
+        plaid_items_docs = list(repos.plaid_items.for_user(user_id))  # Convert to list so we can iterate twice
 
         added_transactions = []
         modified_transactions = []
@@ -465,290 +575,364 @@ async def sync_plaid_transactions(request: SyncPlaidTransactionsRequest):
         # Store cursor updates to apply later
         cursor_updates = {}
 
-        for item_doc in plaid_items_docs:
-            item_data = item_doc.to_dict()
-            item_id = item_doc.id
-            print(f"Processing Plaid item: {item_data['institution_name']}")
-            # print(f"Processing Plaid item with access_token: {item_data['access_token']}")
-            
-            saved_cursor = item_data.get("cursor")
-            has_more = True
-            last_cursor = None
-
-            while has_more:
-                plaid_response = get_plaid_transactions(item_data["access_token"], cursor=saved_cursor)
-                # print(f"Fetched transactions from Plaid: {plaid_response}")
-
-                # Save the new cursor value (but don't update the database yet)
-                new_cursor = plaid_response.get("next_cursor")
-                if new_cursor:
-                    last_cursor = new_cursor
-                    saved_cursor = new_cursor
-
-                # Associate each transaction with this Plaid item's data
-                for trans in plaid_response.get("added", []):
-                    transaction_item_map[trans["transaction_id"]] = item_data
-                
-                for trans in plaid_response.get("modified", []):
-                    transaction_item_map[trans["transaction_id"]] = item_data
-                
-                for trans in plaid_response.get("removed", []):
-                    transaction_item_map[trans["transaction_id"]] = item_data
-
-                added_transactions.extend(plaid_response.get("added", []))
-                modified_transactions.extend(plaid_response.get("modified", []))
-                deleted_transactions.extend(plaid_response.get("removed", []))
+        with telemetry.phase("fetch"):
+            for item_doc in plaid_items_docs:
+                item_data = item_doc.to_dict()
+                item_id = item_doc.id
+                item_telemetry = telemetry.item(item_id, item_data['institution_name'])
+                logger.info(f"Processing Plaid item: {item_data['institution_name']}")
+
+                saved_cursor = item_data.get("cursor")
+                has_more = True
+                last_cursor = None
+
+                while has_more:
+                    with item_telemetry.plaid_call():
+                        plaid_response = get_plaid_transactions(item_data["access_token"], cursor=saved_cursor)
+                    item_telemetry.record_page(plaid_response)
+
+                    # Save the new cursor value (but don't update the database yet)
+                    new_cursor = plaid_response.get("next_cursor")
+                    if new_cursor:
+                        last_cursor = new_cursor
+                        saved_cursor = new_cursor
+
+                    # Associate each transaction with this Plaid item's data
+                    for trans in plaid_response.get("added", []):
+                        transaction_item_map[trans["transaction_id"]] = item_data
+
+                    for trans in plaid_response.get("modified", []):
+                        transaction_item_map[trans["transaction_id"]] = item_data
+
+                    for trans in plaid_response.get("removed", []):
+                        transaction_item_map[trans["transaction_id"]] = item_data
+
+                    added_transactions.extend(plaid_response.get("added", []))
+                    modified_transactions.extend(plaid_response.get("modified", []))
+                    deleted_transactions.extend(plaid_response.get("removed", []))
+
+                    # Check if there are more transactions to sync
+                    has_more = plaid_response.get("has_more", False)
+
+                # Store the last cursor for this item to update later
+                if last_cursor:
+                    cursor_updates[item_id] = last_cursor
+
+        # Process added transactions with batch operations
+        logger.info(f"Processing {len(added_transactions)} added transactions")
+
+        with telemetry.phase("reconcile"):
+            # Match posted transactions to the pending transactions they replace so categories carry over
+            reconciled_transactions = reconcile_pending_transactions(user_id, added_transactions, deleted_transactions)
+            reconciled_pending_ids = {match["pending_transaction_id"] for match in reconciled_transactions.values()}
+        logger.info(f"Reconciled {len(reconciled_transactions)} pending transactions with their posted versions")
+
+        with telemetry.phase("categorize"):
+            # Compile the user's categorization rules once for this sync
+            rule_set = load_rule_set(user_id)
+
+            # Assign categories and split into batches that stay within the Firestore limit of 500 operations
+            # per batch (half that while the user's documents are being migrated and written to both layouts).
+            # A reconciled transaction also deletes its pending document (and writes its tombstone), and each
+            # distinct category touched by a batch costs one balance update.
+            batch_op_limit = repos.batch_writes_for_user(user_id)
+            added_batches = []
+            category_assignments = {}
+            rule_categorized_count = 0
+            current_batch = []
+            current_categories = set()
+            current_ops = 0
+            for transaction in added_transactions:
+                reconciled = reconciled_transactions.get(transaction["transaction_id"])
+                if reconciled:
+                    category_id = reconciled["category_id"]
+                else:
+                    category_id = rule_set.match({
+                        "name": transaction["name"],
+                        "merchant_name": transaction.get("merchant_name"),
+                        "personal_finance_category": convert_plaid_personal_finance_category(transaction.get("personal_finance_category")),
+                        "amount_cents": -to_cents(transaction["amount"])
+                    })
+                    if category_id:
+                        rule_categorized_count += 1
+                category_assignments[transaction["transaction_id"]] = category_id or NULL_VALUE
+
+                transaction_ops = 3 if reconciled else 1
+                if current_batch and current_ops + transaction_ops + (1 if category_id and category_id not in current_categories else 0) > batch_op_limit:
+                    added_batches.append(current_batch)
+                    current_batch = []
+                    current_categories = set()
+                    current_ops = 0
+                if category_id and category_id not in current_categories:
+                    current_categories.add(category_id)
+                    transaction_ops += 1
+                current_batch.append(transaction)
+                current_ops += transaction_ops
+            if current_batch:
+                added_batches.append(current_batch)
+        logger.info(f"Applied {len(rule_set)} categorization rules, categorized {rule_categorized_count} transactions")
+
+        total_batches = len(added_batches)
+
+        with telemetry.phase("build_added_batches"):
+            # Build every batch first, then commit them concurrently
+            built_batches = []
+            transaction_index = 0
+            for batch_index, batch_transactions in enumerate(added_batches):
+                batch = repos.batch()
+                category_deltas = {}
 
-                # Check if there are more transactions to sync
-                has_more = plaid_response.get("has_more", False)
-                print(f"Has more transactions: {has_more}")
-            
-            # Store the last cursor for this item to update later
-            if last_cursor:
-                cursor_updates[item_id] = last_cursor        # Process added transactions with batch operations
-        print(f"Processing {len(added_transactions)} added transactions")
-        print("Debug: Making sure category_id is explicitly set to None")
-        
-        # Process in batches of 500 (Firestore batch limit)
-        batch_size = 500
-        total_batches = (len(added_transactions) + batch_size - 1) // batch_size
-        successful_batches = 0
-        
-        for i in range(0, len(added_transactions), batch_size):
-            batch_num = (i // batch_size) + 1
-            print(f"Processing batch {batch_num}/{total_batches}")
-            
-            batch = db.batch()
-            batch_transactions = added_transactions[i:i + batch_size]
-            
-            try:
                 for transaction in batch_transactions:
+                    transaction_index += 1
                     # Get the correct item_data for this transaction
                     item_data = transaction_item_map.get(transaction["transaction_id"])
                     if not item_data:
-                        print(f"Warning: No item data found for transaction {transaction['transaction_id']}")
+                        logger.warning(f"No item data found for transaction {transaction['transaction_id']}")
                         continue
 
-                    print(f"Adding transaction: {transaction['transaction_id']}")
+                    sampled_debug(logger, transaction_index, "Adding transaction: %s", transaction["transaction_id"])
 
                     account_name = next(
                         (account["name"] for account in item_data.get("accounts", []) if account["account_id"] == transaction["account_id"]),
                         None
-                    )              
-                    
-                    # Create explicit transaction data dictionary
-                    transaction_dict = {
-                        "amount": -transaction["amount"],
-                        "name": transaction["name"],
-                        "date": transaction['date'].strftime("%Y-%m-%d"),
-                        "user_id": user_id,
-                        "plaid_transaction_id": transaction["transaction_id"],
-                        "institution_name": item_data["institution_name"],
-                        "account_name": account_name,
-                        "merchant_name": transaction.get("merchant_name"),
-                        "personal_finance_category": convert_plaid_personal_finance_category(transaction.get("personal_finance_category")),
-                        "pending": transaction.get("pending"),
-                        "category_id": NULL_VALUE,  # Use the explicit NULL_VALUE constant
-                        "created_at": datetime.now(timezone.utc),
-                        "type": "debit" if -transaction["amount"] < 0 else "credit"
-                    }
-                    
-                    transaction_ref = db.collection("transactions").document()
-                    batch.set(transaction_ref, transaction_dict)
-                
-                # Commit this batch of transactions
-                batch.commit()
-                successful_batches += 1
-                print(f"✅ Successfully created batch {batch_num}/{total_batches} with {len(batch_transactions)} transactions")
-                
-            except Exception as batch_error:
-                print(f"❌ Failed to process batch {batch_num}/{total_batches}: {batch_error}")
-                # Continue with next batch rather than failing entirely
-                continue
-        
-        print(f"Completed transaction creation: {successful_batches}/{total_batches} batches successful")
+                    )
+
+                    # Posted transactions replacing a pending one keep the pending transaction's category,
+                    # everything else gets the category of the first matching rule (if any)
+                    reconciled = reconciled_transactions.get(transaction["transaction_id"])
+                    category_id = category_assignments[transaction["transaction_id"]]
+
+                    transaction_record = plaid_transaction_record(
+                        transaction, user_id, item_data, account_name,
+                        category_id  # NULL_VALUE unless carried over or matched by a rule
+                    )
+                    amount_cents = transaction_record.amount_cents
+
+                    # create (not set) so a retried commit of an already applied batch is rejected instead of replayed
+                    transaction_ref = repos.transactions.ref(user_id=user_id)
+                    batch.create(transaction_ref, transaction_record.to_dict())
+
+                    if reconciled:
+                        # Replace the pending document and only apply the net amount difference to its category
+                        batch.delete(reconciled["pending_ref"])
+                        if category_id:
+                            net_amount_cents = amount_cents - reconciled["pending_amount_cents"]
+                            category_deltas[category_id] = category_deltas.get(category_id, 0) + net_amount_cents
+                    elif category_id:
+                        # Rule-categorized transactions add their full amount, aggregated per batch
+                        category_deltas[category_id] = category_deltas.get(category_id, 0) + amount_cents
+
+                apply_category_deltas(batch, user_id, category_deltas)
+                built_batches.append(batch)
+
+        with telemetry.phase("commit_added"):
+            # Batches are independent (balance changes are increments), so commit them in parallel with per-batch retry
+            commit_results = commit_batches(built_batches)
+        telemetry.record_commits(commit_results)
+        successful_batches = sum(1 for result in commit_results if result.committed)
+
+        logger.info(f"Completed transaction creation: {successful_batches}/{total_batches} batches successful")
         
         # Check if all batches were successful before proceeding
         if successful_batches < total_batches:
-            print(f"❌ Not all batches were successful ({successful_batches}/{total_batches}). Skipping cursor updates to allow retry.")
+            logger.error(f"❌ Not all batches were successful ({successful_batches}/{total_batches}). Skipping cursor updates to allow retry.")
             raise HTTPException(status_code=500, detail=f"Failed to process all transaction batches. Only {successful_batches}/{total_batches} batches were successful.")
 
         # Process modified transactions
-        print(f"Processing {len(modified_transactions)} modified transactions")
+        logger.info(f"Processing {len(modified_transactions)} modified transactions")
         modified_successful = 0
-        for transaction in modified_transactions:
-            try:
-                # Get the correct item_data for this transaction
-                item_data = transaction_item_map.get(transaction["transaction_id"])
-                if not item_data:
-                    print(f"Warning: No item data found for modified transaction {transaction['transaction_id']}")
-                    continue
-                    
-                print(f"Modifying transaction: {transaction['transaction_id']}")
-
-                account_name = next(
-                    (account["name"] for account in item_data.get("accounts", []) if account["account_id"] == transaction["account_id"]),
-                    None
-                )
-                existing_query = db.collection("transactions").where("plaid_transaction_id", "==", transaction["transaction_id"]).where("user_id", "==", user_id)
-                existing_docs = existing_query.stream()
-                existing_doc = next(existing_docs, None)
-
-                if existing_doc:
-                    print(f"Updating existing transaction with ID: {existing_doc.id}")
-                    existing_doc.reference.update({
-                        "amount": -transaction["amount"] if transaction["amount"] > 0 else transaction["amount"],
-                        "name": transaction["name"],
-                        "date": transaction['date'].strftime("%Y-%m-%d"),
-                        "merchant_name": transaction.get("merchant_name"),
-                        "personal_finance_category": convert_plaid_personal_finance_category(transaction.get("personal_finance_category")),
-                        "pending": transaction.get("pending")
-                    })
-                else:
-                    print(f"Creating new transaction for modified transaction: {transaction['transaction_id']}")
-                    # Create a validated transaction using our schema
-                    transaction_schema = TransactionSchema(
-                        amount=-transaction["amount"],
-                        name=transaction["name"],
-                        date=transaction['date'].strftime("%Y-%m-%d"),
-                        user_id=user_id,
-                        plaid_transaction_id=transaction["transaction_id"],
-                        institution_name=item_data["institution_name"],
-                        account_name=account_name,
-                        merchant_name=transaction.get("merchant_name"),
-                        personal_finance_category=convert_plaid_personal_finance_category(transaction.get("personal_finance_category")),
-                        pending=transaction.get("pending"),
-                        category_id=None  # Explicitly set category_id to None for modified transactions
+        with telemetry.phase("modified"):
+            # The stored documents of the modified transactions, read with one query per batch of IDs
+            stored_modified = repos.transactions.by_plaid_ids(user_id, [transaction["transaction_id"] for transaction in modified_transactions])
+            modified_ids_seen = set()
+            for transaction_index, transaction in enumerate(modified_transactions):
+                try:
+                    # Get the correct item_data for this transaction
+                    item_data = transaction_item_map.get(transaction["transaction_id"])
+                    if not item_data:
+                        logger.warning(f"No item data found for modified transaction {transaction['transaction_id']}")
+                        continue
+
+                    sampled_debug(logger, transaction_index, "Modifying transaction: %s", transaction["transaction_id"])
+
+                    account_name = next(
+                        (account["name"] for account in item_data.get("accounts", []) if account["account_id"] == transaction["account_id"]),
+                        None
                     )
-                    
-                    # Create explicit transaction data dictionary
-                    transaction_dict = {
-                        "amount": -transaction["amount"],
-                        "name": transaction["name"],
-                        "date": transaction['date'].strftime("%Y-%m-%d"),
-                        "user_id": user_id,
-                        "plaid_transaction_id": transaction["transaction_id"],
-                        "institution_name": item_data["institution_name"],
-                        "account_name": account_name,
-                        "merchant_name": transaction.get("merchant_name"),
-                        "personal_finance_category": convert_plaid_personal_finance_category(transaction.get("personal_finance_category")),
-                        "pending": transaction.get("pending"),
-                        "category_id": NULL_VALUE,  # Use the explicit NULL_VALUE constant
-                        "created_at": datetime.now(timezone.utc),
-                        "type": "debit" if -transaction["amount"] < 0 else "credit"
-                    }
-                    
-                    print(f"Debug modified transaction with NULL_VALUE: {transaction_dict}")
-                    
-                    transaction_ref = db.collection("transactions").document()
-                    # Use merge=False to ensure fields are set exactly as provided
-                    transaction_ref.set(transaction_dict, merge=False)
-                
-                modified_successful += 1
-                print(f"✅ Successfully processed modified transaction {transaction['transaction_id']}")
-                
-            except Exception as e:
-                print(f"❌ Failed to process modified transaction {transaction['transaction_id']}: {e}")
-                continue
+                    # A transaction modified again on a later page is read again, as the first modification changed it
+                    first_modification = transaction["transaction_id"] not in modified_ids_seen
+                    modified_ids_seen.add(transaction["transaction_id"])
+                    existing_doc = (stored_modified.get(transaction["transaction_id"]) or [None])[0] if first_modification \
+                        else repos.transactions.by_plaid_id(user_id, transaction["transaction_id"])
+                    # Transactions modified after they were archived are moved back to be updated
+                    existing_doc = existing_doc or transaction_archive.unarchive(user_id, plaid_transaction_id=transaction["transaction_id"])
+
+                    if existing_doc:
+                        existing = TransactionRecord.from_dict(existing_doc.to_dict())
+                        new_amount_cents = -to_cents(transaction["amount"])
+                        batch = repos.batch()
+                        batch.update(repos.transactions.ref(existing_doc.id, user_id=user_id), {
+                            "amount_cents": new_amount_cents,
+                            "amount": DELETE_FIELD,  # Legacy float amount of documents not migrated yet
+                            "name": transaction["name"],
+                            "date": transaction['date'].strftime("%Y-%m-%d"),
+                            "merchant_name": transaction.get("merchant_name"),
+                            "personal_finance_category": convert_plaid_personal_finance_category(transaction.get("personal_finance_category")),
+                            "pending": transaction.get("pending"),
+                            "type": "debit" if new_amount_cents < 0 else "credit"
+                        })
+                        # A changed amount moves the category's available amount by the difference, in the same batch
+                        if existing.category_id:
+                            apply_category_deltas(batch, user_id, {existing.category_id: new_amount_cents - existing.amount_cents})
+                        batch.commit()
+                    else:
+                        sampled_debug(logger, transaction_index, "Creating new transaction for modified transaction: %s", transaction["transaction_id"])
+                        # Modified transactions that aren't stored yet are created uncategorized
+                        transaction_record = plaid_transaction_record(transaction, user_id, item_data, account_name, NULL_VALUE)
+
+                        transaction_ref = repos.transactions.ref(user_id=user_id)
+                        # Use merge=False to ensure fields are set exactly as provided
+                        transaction_ref.set(transaction_record.to_dict(), merge=False)
+
+                    modified_successful += 1
+
+                except Exception as e:
+                    logger.error(f"❌ Failed to process modified transaction {transaction['transaction_id']}: {e}")
+                    continue
         
-        print(f"Completed modified transactions: {modified_successful}/{len(modified_transactions)} successful")
+        logger.info(f"Completed modified transactions: {modified_successful}/{len(modified_transactions)} successful")
         
         # Check if all modified transactions were successful
         if modified_successful < len(modified_transactions):
-            print(f"❌ Not all modified transactions were successful ({modified_successful}/{len(modified_transactions)}). Skipping cursor updates to allow retry.")
+            logger.error(f"❌ Not all modified transactions were successful ({modified_successful}/{len(modified_transactions)}). Skipping cursor updates to allow retry.")
             raise HTTPException(status_code=500, detail=f"Failed to process all modified transactions. Only {modified_successful}/{len(modified_transactions)} were successful.")
 
         # Process deleted transactions
-        print(f"Processing {len(deleted_transactions)} deleted transactions")
+        logger.info(f"Processing {len(deleted_transactions)} deleted transactions")
         deleted_successful = 0
-        for transaction in deleted_transactions:
-            try:
-                print(f"Deleting transaction: {transaction['transaction_id']}")
-                existing_query = db.collection("transactions").where("plaid_transaction_id", "==", transaction["transaction_id"]).where("user_id", "==", user_id)
-                existing_docs = existing_query.stream()
-
-                transaction_found = False
-                for doc in existing_docs:
-                    transaction_found = True
-                    print(f"Deleting transaction with ID: {doc.id}")
-                    
-                    # Get transaction data before deleting to check for category
-                    transaction_data = doc.to_dict()
-                    category_id = transaction_data.get("category_id")
-                    new_available = None
-                    
-                    if category_id:
-                        category_ref = db.collection("categories").document(category_id)
-                        category_doc = category_ref.get()
-                        
-                        if category_doc.exists:
-                            # Calculate new available amount for the category
-                            category_data = category_doc.to_dict()
-                            transaction_amount = Decimal(str(transaction_data["amount"]))
-                            current_available = Decimal(str(category_data.get("available", 0.0)))
-                            new_available = current_available - transaction_amount
-                            print(f"Updating category {category_id} available amount from {current_available} to {new_available}")
-                        else:
-                            print(f"Warning: Category {category_id} not found for transaction {doc.id}")
-                    else:
-                        print(f"Transaction {doc.id} has no category - skipping category update")
-
-                    # Use batch write for atomicity
-                    batch = db.batch()
-                    
-                    # 1. Delete the transaction
-                    batch.delete(doc.reference)
-                    
-                    # 2. Update category available amount if transaction had a category
-                    if category_id and new_available is not None and category_doc.exists:
-                        batch.update(category_ref, {"available": float(new_available)})
-                    
-                    # Execute all writes atomically
-                    batch.commit()
-                
-                if transaction_found:
-                    deleted_successful += 1
-                    print(f"✅ Successfully processed deleted transaction {transaction['transaction_id']}")
+        with telemetry.phase("removed"):
+            uow = UnitOfWork()
+
+            # Find the stored document(s) for every removed transaction, with one query per batch of IDs
+            stored_removed = repos.transactions.by_plaid_ids(
+                user_id, [transaction["transaction_id"] for transaction in deleted_transactions if transaction["transaction_id"] not in reconciled_pending_ids]
+            )
+            removed_docs = []
+            for transaction_index, transaction in enumerate(deleted_transactions):
+                try:
+                    if transaction["transaction_id"] in reconciled_pending_ids:
+                        # Already replaced by its posted transaction in the added batches
+                        deleted_successful += 1
+                        continue
+
+                    sampled_debug(logger, transaction_index, "Deleting transaction: %s", transaction["transaction_id"])
+                    existing_docs = [uow.remember(doc) for doc in stored_removed.get(transaction["transaction_id"], [])]
+                    if not existing_docs:
+                        # Removed after it was archived: move it back so it's deleted like any other
+                        archived_doc = transaction_archive.unarchive(user_id, plaid_transaction_id=transaction["transaction_id"])
+                        existing_docs = [uow.remember(archived_doc)] if archived_doc else []
+                    if not existing_docs:
+                        sampled_debug(logger, transaction_index, "Transaction %s not found in database (may have been already deleted)", transaction["transaction_id"])
+                    removed_docs.extend(existing_docs)
+                    deleted_successful += 1  # Not found counts as successful since it's already deleted
+
+                except Exception as e:
+                    logger.error(f"❌ Failed to process deleted transaction {transaction['transaction_id']}: {e}")
+                    continue
+
+            # Check every affected category exists with one read; balances are then incremented
+            # server-side, so nothing depends on the values read here
+            category_ids = list({doc.to_dict().get("category_id") for doc in removed_docs} - {None, ""})
+            category_docs = uow.get_many(*[repos.categories.ref(category_id, user_id=user_id) for category_id in category_ids])
+            existing_categories = set()
+            for category_id, category_doc in zip(category_ids, category_docs):
+                if category_doc.exists:
+                    existing_categories.add(category_id)
                 else:
-                    print(f"⚠️ Transaction {transaction['transaction_id']} not found in database (may have been already deleted)")
-                    deleted_successful += 1  # Count as successful since it's already deleted
-                
-            except Exception as e:
-                print(f"❌ Failed to process deleted transaction {transaction['transaction_id']}: {e}")
-                continue
-        
-        print(f"Completed deleted transactions: {deleted_successful}/{len(deleted_transactions)} successful")
+                    logger.warning(f"Category {category_id} not found for removed transactions")
+
+            # Delete in batches of up to 500 operations (fewer while dual-writing), each delete also writing a tombstone. Each batch also
+            # increments the available amount of the categories it touches by the summed deletions, so every committed batch leaves
+            # balances consistent.
+            max_ops = repos.batch_writes_for_user(user_id)
+            category_deltas = {}
+            pending_ops = 0
+            for doc in removed_docs:
+                category_id = doc.to_dict().get("category_id")
+                category_op = 1 if category_id in existing_categories and category_id not in category_deltas else 0
+                if pending_ops + 2 + category_op > max_ops:
+                    apply_category_deltas(uow, user_id, category_deltas)
+                    uow.commit()
+                    category_deltas = {}
+                    pending_ops = 0
+                    category_op = 1 if category_id in existing_categories else 0
+
+                uow.delete(repos.transactions.ref(doc.id, user_id=user_id))
+                pending_ops += 2 + category_op
+                if category_id in existing_categories:
+                    category_deltas[category_id] = category_deltas.get(category_id, 0) - read_cents(doc.to_dict(), "amount")
+
+            apply_category_deltas(uow, user_id, category_deltas)
+            uow.commit()
+        
+        logger.info(f"Completed deleted transactions: {deleted_successful}/{len(deleted_transactions)} successful")
         
         # Check if all deleted transactions were successful
         if deleted_successful < len(deleted_transactions):
-            print(f"❌ Not all deleted transactions were successful ({deleted_successful}/{len(deleted_transactions)}). Skipping cursor updates to allow retry.")
+            logger.error(f"❌ Not all deleted transactions were successful ({deleted_successful}/{len(deleted_transactions)}). Skipping cursor updates to allow retry.")
             raise HTTPException(status_code=500, detail=f"Failed to process all deleted transactions. Only {deleted_successful}/{len(deleted_transactions)} were successful.")
 
         # Now that all transactions have been processed successfully, update the cursors with batch write
-        print("✅ All transactions processed successfully. Updating cursors...")
+        logger.info("✅ All transactions processed successfully. Updating cursors...")
         if cursor_updates:
             try:
-                batch = db.batch()
-                for item_id, cursor in cursor_updates.items():
-                    print(f"Updating cursor for item {item_id} to {cursor}")
-                    item_ref = db.collection("plaid_items").document(item_id)
-                    batch.update(item_ref, {"cursor": cursor})
-                batch.commit()
-                print(f"✅ Updated {len(cursor_updates)} cursors atomically")
+                with telemetry.phase("cursors"):
+                    batch = repos.batch()
+                    for item_id, cursor in cursor_updates.items():
+                        item_ref = repos.plaid_items.ref(item_id)
+                        batch.update(item_ref, {"cursor": cursor})
+                    batch.commit()
+                logger.info(f"✅ Updated {len(cursor_updates)} cursors atomically")
             except Exception as e:
-                print(f"❌ Failed to update cursors: {e}")
+                logger.error(f"❌ Failed to update cursors: {e}")
                 raise HTTPException(status_code=500, detail=f"Transactions synced successfully but failed to update cursors: {e}")
         
-        print("🎉 Sync completed successfully")
+        # Guardrail: a sync that left a balance wrong is logged (and reported) right away
+        balance_issues = None
+        if request.verify_balances:
+            with telemetry.phase("verify"):
+                balance_issues = check_user(user_id)["issues"]
+            for issue in balance_issues:
+                logger.error(f"❌ Balance of category {issue['category_id']} is {issue['stored_available']} after sync, "
+                             f"expected {issue['expected_available']}")
+
+        telemetry.totals = {
+            "added": len(added_transactions),
+            "modified": len(modified_transactions),
+            "removed": len(deleted_transactions),
+            "reconciled_pending": len(reconciled_transactions),
+            "categorized_by_rules": rule_categorized_count,
+            "cursors_updated": len(cursor_updates),
+        }
+        if balance_issues is not None:
+            telemetry.totals["balance_issues"] = len(balance_issues)
+        sync_run = telemetry.finish("success")
+        logger.info(f"🎉 Sync completed successfully in {sync_run['duration_seconds']}s")
         return {
             "message": "Transactions synced successfully.",
             "summary": {
                 "added": f"{successful_batches}/{total_batches} batches ({len(added_transactions)} transactions)",
                 "modified": f"{modified_successful}/{len(modified_transactions)} transactions",
                 "deleted": f"{deleted_successful}/{len(deleted_transactions)} transactions",
-                "cursors_updated": len(cursor_updates)
+                "reconciled_pending": len(reconciled_transactions),
+                "categorized_by_rules": rule_categorized_count,
+                "cursors_updated": len(cursor_updates),
+                "balance_issues": balance_issues,
+                "duration_seconds": sync_run["duration_seconds"],
+                "firestore_operations": sync_run["firestore_operations"]
             }
         }
     except Exception as e:
-        print(f"Error during sync: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to sync transactions: {e}")
\ No newline at end of file
+        logger.error(f"Error during sync: {e}")
+        telemetry.finish("failed", error=str(e))
+        raise HTTPException(status_code=500, detail=f"Failed to sync transactions: {e}")
@@ -0,0 +1,112 @@
+from .db import repos
+from .db_instrumentation import start_counting, stop_counting
+from .write_coalescer import write_coalescer
+from backend.db.layouts import write_count
+
+MAX_BATCH_WRITES = 500
+
+class UnitOfWork:
+    """
+    Request-scoped identity map and write buffer.
+
+    Every document is read at most once: `get`/`get_many` return the snapshot already seen in
+    this unit of work (from an earlier get or query result) and fetch the rest with a single
+    `get_all`. Writes are queued and sent together by `commit()`, in one atomic batch (which
+    refuses more writes than a batch holds). Reads and writes made inside the `with` block are
+    counted in `operations`.
+
+        with UnitOfWork() as uow:
+            user_ref, category_ref = repos.users.ref(user_id), repos.categories.ref(category_id, user_id=user_id)
+            user_doc, category_doc = uow.get_many(user_ref, category_ref)
+            uow.update(category_ref, {...})
+            uow.commit()
+    """
+
+    def __init__(self):
+        self.documents = {}  # document path -> snapshot
+        self.writes = []  # (operation, reference, data)
+        self.cache_hits = 0
+        self.operations = None
+        self._counting_token = None
+
+    def __enter__(self):
+        self.operations, self._counting_token = start_counting()
+        return self
+
+    def __exit__(self, *exc_info):
+        stop_counting(self._counting_token)
+        return False
+
+    def remember(self, snapshot):
+        """Add a snapshot (e.g. a query result) to the identity map and return it"""
+        self.documents[snapshot.reference.path] = snapshot
+        return snapshot
+
+    def get(self, reference):
+        return self.get_many(reference)[0]
+
+    def get_many(self, *references):
+        """Snapshots for the references, in order, reading only documents not seen before in one round trip"""
+        missing = {}
+        for reference in references:
+            if reference is None:
+                continue
+            if reference.path in self.documents:
+                self.cache_hits += 1
+            else:
+                missing[reference.path] = reference
+        if missing:
+            for snapshot in repos.get_all(list(missing.values())):
+                self.remember(snapshot)
+        return [self.documents[reference.path] if reference is not None else None for reference in references]
+
+    def find(self, query):
+        """Run a query and remember its results; returns the snapshots as a list"""
+        return [self.remember(snapshot) for snapshot in query.stream()]
+
+    def create(self, reference, data):
+        self.writes.append(("create", reference, data))
+
+    def set(self, reference, data):
+        self.writes.append(("set", reference, data))
+
+    def update(self, reference, data):
+        self.writes.append(("update", reference, data))
+
+    def delete(self, reference):
+        self.writes.append(("delete", reference, None))
+
+    def commit(self):
+        """
+        Send every queued write in one atomic batch; returns the number of batches committed (0
+        or 1). Raises ValueError, writing nothing, when the writes don't fit in one batch: callers
+        with more writes commit them in explicit chunks, each leaving the data consistent
+        """
+        if not self.writes:
+            return 0
+        # Writes to documents of dual-write users count twice, deletes also write a tombstone
+        batch_writes = sum(write_count(reference, operation) for operation, reference, _ in self.writes)
+        if batch_writes > MAX_BATCH_WRITES:
+            raise ValueError(f"A unit of work can't commit {batch_writes} writes atomically (at most {MAX_BATCH_WRITES} per batch)")
+
+        batch = repos.batch()
+        for operation, reference, data in self.writes:
+            if operation == "delete":
+                batch.delete(reference)
+            else:
+                getattr(batch, operation)(reference, data)
+            # Written documents must be read again if needed
+            self.documents.pop(reference.path, None)
+        batch.commit()
+        self.writes = []
+        return 1
+
+    async def commit_coalesced(self):
+        """
+        Send every queued write through the process's write coalescer, which commits them in one
+        batch with other requests' writes from the same short window; returns once they are committed
+        """
+        writes, self.writes = self.writes, []
+        for _, reference, _ in writes:
+            self.documents.pop(reference.path, None)
+        await write_coalescer.commit(writes)
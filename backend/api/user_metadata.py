@@ -0,0 +1,71 @@
+import os
+import time
+import logging
+import threading
+from .db import repos
+
+logger = logging.getLogger(__name__)
+
+# How long user metadata is served from the cache before being read again
+USER_METADATA_TTL_SECONDS = float(os.getenv("USER_METADATA_TTL_SECONDS", "300"))
+
+class UserMetadataCache:
+    """
+    Process-wide TTL cache of user-level metadata that rarely changes: email, preferences, the
+    unallocated funds category ID and the newest archived transaction month. Hot paths use it
+    instead of reading the user document (or querying for the unallocated category) on every
+    request. Entries written by this process are invalidated immediately; changes made by other
+    processes show up within the TTL.
+    """
+
+    def __init__(self, ttl_seconds=USER_METADATA_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # user_id -> (expires_at, metadata)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Metadata dict for the user, or None if the user doesn't exist"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        metadata = self._load(user_id)
+        if metadata is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl_seconds, metadata)
+        return metadata
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, user_id):
+        user_doc = repos.users.get(user_id)
+        if not user_doc.exists:
+            return None
+        user_data = user_doc.to_dict()
+        repos.layouts.prime(user_id, user_data)  # The storage layout comes with the same read
+
+        unallocated_category_id = user_data.get("unallocated_category_id")
+        if not unallocated_category_id:
+            # User created before the ID was recorded: look it up once and store it on the user document
+            unallocated_category = repos.categories.unallocated_for_user(user_id)
+            if unallocated_category:
+                unallocated_category_id = unallocated_category.id
+                repos.users.update(user_id, {"unallocated_category_id": unallocated_category_id})
+                logger.info(f"Recorded unallocated category {unallocated_category_id} for user_id: {user_id}")
+
+        return {
+            "email": user_data.get("email"),
+            "preferences": user_data.get("preferences"),
+            "unallocated_category_id": unallocated_category_id,
+            "archived_through": user_data.get("archived_through"),
+        }
+
+user_metadata = UserMetadataCache()
@@ -2,7 +2,9 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from datetime import datetime, timezone
 from typing import Optional
-from .db import db
+from .db import repos, DATA_LAYOUT
+from .db_async import run_db
+from .user_metadata import user_metadata
 from backend.db.schemas import User as UserSchema, UserPreferences, PaySchedule, Category as CategorySchema
 
 router = APIRouter()
@@ -20,9 +22,14 @@ class UpdatePreferencesRequest(BaseModel):
 @router.post("/create-user")
 async def create_user(user: User):
     try:
+        # The unallocated funds category ID is recorded on the user so it never has to be queried for
+        unallocated_category_ref = repos.categories.ref(user_id=user.user_id, layout=DATA_LAYOUT)
+
         # Create a validated User object with schema
         user_schema = UserSchema(
-            email=user.email
+            email=user.email,
+            unallocated_category_id=unallocated_category_ref.id,
+            data_layout=DATA_LAYOUT
         )
         
         # Convert to dict for Firestore (validation happens automatically)
@@ -32,23 +39,24 @@ async def create_user(user: User):
         unallocated_category = CategorySchema(
             name="Unallocated Funds",
             user_id=user.user_id,  # Use the provided user_id instead of user_ref.id
-            available=0.0,
+            available_cents=0,
             is_unallocated_funds=True
         )
         
         # Use batch write for atomicity
-        batch = db.batch()
+        batch = repos.batch()
         
         # 1. Create the user
-        user_ref = db.collection(UserSchema.collection_name()).document(user.user_id)
+        user_ref = repos.users.ref(user.user_id)
         batch.set(user_ref, user_data)
         
         # 2. Create the unallocated funds category
-        unallocated_category_ref = db.collection(CategorySchema.collection_name()).document()
         batch.set(unallocated_category_ref, unallocated_category.to_dict())
         
         # Execute all writes atomically
-        batch.commit()
+        await run_db(batch.commit)
+        user_metadata.invalidate(user.user_id)
+        repos.layouts.invalidate(user.user_id)
 
         return {"message": "User created successfully.", "user_id": user_ref.id}
     except ValueError as ve:
@@ -63,17 +71,18 @@ async def update_preferences(request: UpdatePreferencesRequest):
     try:
         # print request
         # print(f"Updating preferences: {request.preferences}")
-        user_ref = db.collection("users").document(request.user_id)
-        user_doc = user_ref.get()
+        user_ref = repos.users.ref(request.user_id)
+        user_doc = await run_db(user_ref.get)
         if not user_doc.exists:
             # print(f"User with user_id: {request.user_id} not found")
             raise HTTPException(status_code=404, detail="User not found")
 
         # The preferences are already validated by Pydantic
         # Update the user document with the preferences
-        user_ref.update({
+        await run_db(user_ref.update, {
             "preferences": request.preferences.model_dump(exclude_none=True)
         })
+        user_metadata.invalidate(request.user_id)
 
         # print("Preferences updated successfully")
         return {"message": "Preferences updated successfully."}
@@ -0,0 +1,162 @@
+import os
+import asyncio
+import logging
+import contextvars
+from google.api_core.exceptions import NotFound, FailedPrecondition, InvalidArgument, AlreadyExists
+from .db import repos, Increment
+from backend.db.layouts import write_count
+from .db_async import run_db
+from .db_instrumentation import record
+
+logger = logging.getLogger(__name__)
+
+# How long writes wait for other requests' writes before being committed together (0 disables coalescing)
+WRITE_COALESCE_WINDOW_SECONDS = float(os.getenv("WRITE_COALESCE_WINDOW_MS", "50")) / 1000
+
+MAX_BATCH_WRITES = 500
+
+# Errors with which Firestore rejects a batch without applying any of it. After any other error
+# (a deadline, an unavailable backend, a reset connection) the batch may have been applied, so
+# retrying its increments could apply them twice.
+DEFINITE_REJECTIONS = (NotFound, FailedPrecondition, InvalidArgument, AlreadyExists)
+
+def _increment_value(operation, data):
+    """The amount of an update that only increments one field (e.g. a balance), or None"""
+    if operation != "update" or len(data) != 1:
+        return None
+    value = next(iter(data.values()))
+    return value.value if isinstance(value, Increment) else None
+
+class WriteCoalescer:
+    """
+    Per-process group commit for request writes, to cut write amplification on hot documents.
+
+    A burst of requests (e.g. bulk recategorization from the UI) sends many small balance
+    increments to the same few category documents. Each request's writes are queued here and,
+    after a short window, committed in one batch together with every other request queued in
+    that window. Increments of the same field of the same document are merged into a single
+    increment, so N requests touching one category cost one write to it instead of N.
+
+    A request is only acknowledged (`commit` returns) after the batch holding its writes is
+    committed, and each request's writes stay atomic: if the shared batch is rejected (see
+    DEFINITE_REJECTIONS), every request in it is retried in a batch of its own, so one bad
+    request (e.g. a missing category) only fails itself. Any other error fails every request in
+    the group, as the batch may have been applied.
+    """
+
+    def __init__(self, window_seconds=WRITE_COALESCE_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._group = []  # (writes, future) per queued request
+        self._written_paths = {}  # document path -> batch writes it costs, for documents written (other than increments) by the group
+        self._increments = {}  # (document path, field) -> [reference, summed amount]
+        self._flush_task = None
+        self._flushes = set()  # Flushes in progress (kept referenced until they finish)
+
+    async def commit(self, writes):
+        """Commit a request's writes, a list of (operation, reference, data) tuples, with the current group"""
+        if not writes:
+            return
+        if self.window_seconds <= 0:
+            await run_db(self._commit_writes, writes)
+            return
+
+        if self._conflicts(writes) or self._write_count() + sum(write_count(reference, operation) for operation, reference, _ in writes) > MAX_BATCH_WRITES:
+            # Start a new group rather than writing the same document twice or overfilling the batch
+            self._start_flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self._add(writes, future)
+        if self._flush_task is None:
+            # The flush runs outside any request's context, so its writes aren't counted against one request
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_after_window(), context=contextvars.Context())
+
+        await future
+        record(writes=len(writes), batch_commits=1)
+
+    def _conflicts(self, writes):
+        for operation, reference, data in writes:
+            if reference.path in self._written_paths:
+                return True
+            if _increment_value(operation, data) is None and any(path == reference.path for path, _ in self._increments):
+                return True
+        return False
+
+    def _write_count(self):
+        """Batch writes the group's merged writes take (documents of dual-write users are written twice)"""
+        incremented = {path: write_count(reference) for (path, _), (reference, _) in self._increments.items()}
+        return sum(incremented.values()) + sum(self._written_paths.values())
+
+    def _add(self, writes, future):
+        self._group.append((writes, future))
+        for operation, reference, data in writes:
+            amount = _increment_value(operation, data)
+            if amount is None:
+                self._written_paths[reference.path] = write_count(reference, operation)
+                continue
+            key = (reference.path, next(iter(data)))
+            if key in self._increments:
+                self._increments[key][1] += amount
+            else:
+                self._increments[key] = [reference, amount]
+
+    def _start_flush(self):
+        """Hand the current group to a flush that starts immediately"""
+        group, increments = self._take_group()
+        if group:
+            flush = asyncio.get_running_loop().create_task(self._flush(group, increments), context=contextvars.Context())
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    def _take_group(self):
+        group, increments = self._group, self._increments
+        self._group, self._written_paths, self._increments = [], {}, {}
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        return group, increments
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window_seconds)
+        group, increments = self._take_group()
+        await self._flush(group, increments)
+
+    async def _flush(self, group, increments):
+        writes = [
+            (operation, reference, data) for request_writes, _ in group for operation, reference, data in request_writes
+            if _increment_value(operation, data) is None
+        ]
+        writes += [("update", reference, {field: Increment(amount)}) for (_, field), (reference, amount) in increments.items()]
+        try:
+            await run_db(self._commit_writes, writes)
+            for _, future in group:
+                if not future.done():
+                    future.set_result(None)
+            return
+        except Exception as e:
+            if len(group) == 1 or not isinstance(e, DEFINITE_REJECTIONS):
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            logger.warning(f"Coalesced commit of {len(group)} requests was rejected, committing them separately: {e}")
+
+        # The batch was rejected as a whole, so nothing was applied; retry each request on its own
+        for request_writes, future in group:
+            try:
+                await run_db(self._commit_writes, request_writes)
+                if not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _commit_writes(self, writes):
+        batch = repos.batch()
+        for operation, reference, data in writes:
+            if operation == "delete":
+                batch.delete(reference)
+            else:
+                getattr(batch, operation)(reference, data)
+        batch.commit()
+
+write_coalescer = WriteCoalescer()
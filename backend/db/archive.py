@@ -0,0 +1,111 @@
+"""
+Cold storage blocks for old transactions.
+
+`api/transaction_archive.py` compacts a user's transactions from months older than
+TRANSACTION_ARCHIVE_AFTER_DAYS into block documents (`transaction_archive`), each holding up
+to a batch worth of one month's transactions as zlib-compressed JSON, so reading a month of
+history costs one document read instead of one per transaction. Besides the compressed rows,
+a block keeps:
+- `category_totals`: count and amount in cents per category (`_uncategorized` for none), so
+  category filters skip blocks without a match and balance checks need no decompression
+- `transaction_ids`, `plaid_transaction_ids` and `category_ids` arrays, for `array_contains`
+  lookups of a single transaction or category
+- `unarchived`: IDs of the rows moved back to the live collection (when an old transaction is
+  edited). Blocks are never rewritten: moving a row back marks it here and decrements the
+  totals, in the same batch that recreates the live document.
+"""
+import json
+import zlib
+from datetime import datetime, timezone
+
+BLOCK_ENCODING = "zlib-json-1"
+UNCATEGORIZED = "_uncategorized"
+
+# Largest compressed payload of a block (Firestore documents are limited to 1 MiB)
+MAX_BLOCK_BYTES = 900_000
+
+def month_of(date):
+    """The YYYY-MM month of a YYYY-MM-DD date"""
+    return date[:7]
+
+def block_id(user_id, month, part):
+    return f"{user_id}_{month}_{part:03d}"
+
+def category_key(category_id):
+    return category_id or UNCATEGORIZED
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot archive value of type {type(value).__name__}")
+
+def _decode_value(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+def encode_rows(rows):
+    """Compressed payload of {transaction_id: transaction data}"""
+    return zlib.compress(json.dumps(rows, default=_encode_value, separators=(",", ":")).encode(), 6)
+
+def decode_rows(payload):
+    return json.loads(zlib.decompress(payload), object_hook=_decode_value)
+
+def block_document(user_id, month, part, rows, payload=None):
+    """Block document for {transaction_id: transaction data}, all dated in `month`"""
+    category_totals = {}
+    for data in rows.values():
+        totals = category_totals.setdefault(category_key(data.get("category_id")), {"count": 0, "amount_cents": 0})
+        totals["count"] += 1
+        totals["amount_cents"] += data["amount_cents"]
+    return {
+        "user_id": user_id,
+        "month": month,
+        "part": part,
+        "count": len(rows),
+        "category_totals": category_totals,
+        "transaction_ids": list(rows),
+        "plaid_transaction_ids": [data["plaid_transaction_id"] for data in rows.values() if data.get("plaid_transaction_id")],
+        "category_ids": [key for key in category_totals if key != UNCATEGORIZED],
+        "encoding": BLOCK_ENCODING,
+        "transactions": payload if payload is not None else encode_rows(rows),
+        "created_at": datetime.now(timezone.utc),
+    }
+
+def has_category(block_data, category_id):
+    """Whether a block still holds transactions of the category (None for uncategorized)"""
+    return (block_data.get("category_totals") or {}).get(category_key(category_id), {}).get("count", 0) > 0
+
+class ArchivedTransaction:
+    """
+    Read-only stand-in for the snapshot of an archived transaction, so readers can mix archived
+    and live transactions. It has no `reference`: edits go through `transaction_archive.unarchive`.
+    """
+
+    exists = True
+    archived = True
+
+    def __init__(self, transaction_id, data, block_id):
+        self.id = transaction_id
+        self._data = data
+        self.block_id = block_id
+
+    @property
+    def date(self):
+        return self._data.get("date")
+
+    def get(self, field):
+        return self._data.get(field)
+
+    def to_dict(self):
+        return dict(self._data)
+
+def archived_transactions(block_snapshot):
+    """ArchivedTransactions for the rows of a block that haven't been moved back"""
+    block_data = block_snapshot.to_dict()
+    unarchived = block_data.get("unarchived") or {}
+    return [
+        ArchivedTransaction(transaction_id, data, block_snapshot.id)
+        for transaction_id, data in decode_rows(block_data["transactions"]).items()
+        if transaction_id not in unarchived
+    ]
@@ -0,0 +1,6 @@
+# Local storage backends implementing the subset of the Firestore client API used by the app
+from .document_store import Increment, DELETE_FIELD, SERVER_TIMESTAMP
+from .memory import MemoryClient
+from .sqlite import SQLiteClient
+
+__all__ = ["Increment", "DELETE_FIELD", "SERVER_TIMESTAMP", "MemoryClient", "SQLiteClient"]
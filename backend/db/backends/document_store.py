@@ -0,0 +1,489 @@
+"""
+Shared implementation of the Firestore client API subset used by the app, for local backends.
+
+Backends only provide storage (`_load`, `_write_many` and `_scan`); the
+reference, query, batch and snapshot classes here give them Firestore's semantics: auto IDs,
+create/set/update/delete with preconditions, atomic batches of up to 500 writes, `Increment`
+and `DELETE_FIELD` transforms, equality/range/in filters, ordering, cursors and limits, and
+query snapshot listeners (`on_snapshot`), whose callbacks run on a background thread in commit
+order, as with Firestore.
+"""
+import copy
+import uuid
+import queue
+import logging
+import threading
+from enum import Enum
+from collections import defaultdict
+from datetime import datetime, timezone
+from google.api_core.exceptions import AlreadyExists, NotFound, InvalidArgument
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_WRITES = 500
+
+class Increment:
+    """Server-side numeric increment, applied when the write is committed"""
+
+    def __init__(self, value):
+        self.value = value
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+def auto_id():
+    return uuid.uuid4().hex[:20]
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+def _apply_transforms(data, existing=None):
+    """Resolve Increment/DELETE_FIELD/SERVER_TIMESTAMP values against the existing document"""
+    result = copy.deepcopy(existing) if existing else {}
+    for field_path, value in data.items():
+        parts = field_path.split(".")
+        target = result
+        for part in parts[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        key = parts[-1]
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif value is SERVER_TIMESTAMP:
+            target[key] = datetime.now(timezone.utc)
+        elif isinstance(value, Increment):
+            current = target.get(key)
+            target[key] = (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+        else:
+            target[key] = copy.deepcopy(value)
+    return result
+
+def _merge_paths(data, prefix=""):
+    """Field paths of a merge set: nested maps are merged field by field, as in Firestore"""
+    paths = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and value:
+            paths.update(_merge_paths(value, f"{prefix}{key}."))
+        else:
+            paths[f"{prefix}{key}"] = value
+    return paths
+
+def _comparable(left, right):
+    numeric = (int, float)
+    if isinstance(left, bool) or isinstance(right, bool):
+        return isinstance(left, bool) and isinstance(right, bool)
+    if isinstance(left, numeric) and isinstance(right, numeric):
+        return True
+    return type(left) == type(right)
+
+def _matches(data, field_path, op, value):
+    try:
+        field_value = _get_field(data, field_path)
+    except KeyError:
+        return False
+    if op == "==":
+        return field_value == value if field_value is None or value is None else _comparable(field_value, value) and field_value == value
+    if op == "!=":
+        return field_value is not None and field_value != value
+    if op == "in":
+        return any(_matches(data, field_path, "==", candidate) for candidate in value)
+    if op == "not-in":
+        return field_value is not None and field_value not in value
+    # Firestore's Python client spells these with underscores
+    if op in ("array_contains", "array-contains"):
+        return isinstance(field_value, list) and value in field_value
+    if op in ("array_contains_any", "array-contains-any"):
+        return isinstance(field_value, list) and any(candidate in field_value for candidate in value)
+    if field_value is None or value is None or not _comparable(field_value, value):
+        return False
+    if op == "<":
+        return field_value < value
+    if op == "<=":
+        return field_value <= value
+    if op == ">":
+        return field_value > value
+    if op == ">=":
+        return field_value >= value
+    raise InvalidArgument(f"Unsupported filter operator: {op}")
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return _get_field(self._data, field_path)
+
+class DocumentReference:
+    def __init__(self, client, collection_path, document_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._collection_path}/{self.id}"
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._collection_path)
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, *args, **kwargs):
+        # Read under the commit lock, so every commit stamped at or before the read time is visible, as in Firestore
+        with self._client._lock:
+            return DocumentSnapshot(self, self._client._load(self._collection_path, self.id), read_time=datetime.now(timezone.utc))
+
+    def create(self, data):
+        batch = self._client.batch()
+        batch.create(self, data)
+        batch.commit()
+
+    def set(self, data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, data, merge=merge)
+        batch.commit()
+
+    def update(self, data):
+        batch = self._client.batch()
+        batch.update(self, data)
+        batch.commit()
+
+    def delete(self):
+        batch = self._client.batch()
+        batch.delete(self)
+        batch.commit()
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+class Query:
+    def __init__(self, client, collection_path, filters=(), orders=(), limit_count=None, start=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_count
+        self._start = start  # (snapshot, inclusive)
+
+    def _copy(self, **changes):
+        values = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit_count": self._limit,
+            "start": self._start,
+        }
+        values.update(changes)
+        return Query(self._client, self._collection_path, **values)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def start_after(self, document):
+        return self._copy(start=(document, False))
+
+    def start_at(self, document):
+        return self._copy(start=(document, True))
+
+    def _sort_key(self, document_id, data):
+        return tuple(_get_field(data, field_path) for field_path, _ in self._orders) + (document_id,)
+
+    def _run(self):
+        equality = {field_path: value for field_path, op, value in self._filters if op == "=="}
+        results = [
+            (document_id, data)
+            for document_id, data in self._client._scan(self._collection_path, equality)
+            if all(_matches(data, field_path, op, value) for field_path, op, value in self._filters)
+        ]
+
+        # Documents missing an ordered field are excluded, as in Firestore
+        order_fields = [field_path for field_path, _ in self._orders]
+        if order_fields:
+            def has_fields(data):
+                try:
+                    for field_path in order_fields:
+                        _get_field(data, field_path)
+                    return True
+                except KeyError:
+                    return False
+            results = [(document_id, data) for document_id, data in results if has_fields(data)]
+
+        # Stable multi-key sort, applied from the last order to the first
+        results.sort(key=lambda item: item[0])
+        for field_path, direction in reversed(self._orders):
+            results.sort(key=lambda item: _get_field(item[1], field_path), reverse=(direction == DESCENDING))
+
+        if self._start is not None:
+            snapshot, inclusive = self._start
+            start_key = self._sort_key(snapshot.id, snapshot.to_dict())
+            position = next((i for i, (document_id, _) in enumerate(results) if document_id == snapshot.id), None)
+            if position is None:
+                # Cursor document is no longer in the results; fall back to comparing sort keys
+                descending = [direction == DESCENDING for _, direction in self._orders] + [False]
+                def after(item):
+                    key = self._sort_key(*item)
+                    for value, start_value, is_descending in zip(key, start_key, descending):
+                        if value != start_value:
+                            return value < start_value if is_descending else value > start_value
+                    return inclusive
+                results = [item for item in results if after(item)]
+            else:
+                results = results[position if inclusive else position + 1:]
+
+        if self._limit is not None:
+            results = results[:self._limit]
+        return results
+
+    def stream(self, *args, **kwargs):
+        for document_id, data in self._run():
+            reference = DocumentReference(self._client, self._collection_path, document_id)
+            yield DocumentSnapshot(reference, copy.deepcopy(data))
+
+    def get(self, *args, **kwargs):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        """
+        Call `callback(docs, changes, read_time)` with the query's documents now and after every
+        commit that changes them; returns a Watch to `unsubscribe()`
+        """
+        if self._limit is not None or self._start is not None:
+            raise InvalidArgument("The local backends don't support listeners on queries with a limit or cursor")
+        return self._client._watch(self, callback)
+
+    def _matches_document(self, data):
+        return data is not None and all(_matches(data, field_path, op, value) for field_path, op, value in self._filters)
+
+class ChangeType(Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+class DocumentChange:
+    def __init__(self, type, document, old_index, new_index):
+        self.type = type
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+class Watch:
+    """Snapshot listener on a query: tracks the matching documents and queues a snapshot for every change"""
+
+    def __init__(self, query, callback):
+        self._query = query
+        self._callback = callback
+        self._documents = {}  # document_id -> data of the documents matching the query
+        self.active = True
+
+    def _snapshot(self, changes):
+        """(docs, changes) for the listener, given [(ChangeType, document_id, data)]"""
+        collection_path = self._query._collection_path
+        def snapshot(document_id, data):
+            return DocumentSnapshot(DocumentReference(self._query._client, collection_path, document_id), data)
+        ordered = sorted(self._documents.items(), key=lambda item: self._query._sort_key(*item))
+        docs = [snapshot(document_id, data) for document_id, data in ordered]
+        return docs, [DocumentChange(change_type, snapshot(document_id, data), -1, -1) for change_type, document_id, data in changes]
+
+    def _initial(self):
+        self._documents = dict(self._query._run())
+        return self._snapshot([(ChangeType.ADDED, document_id, data) for document_id, data in self._documents.items()])
+
+    def _apply(self, written):
+        """Snapshot for {document_id: data or None} written to the collection, or None if nothing matched"""
+        changes = []
+        for document_id, data in written.items():
+            matched = document_id in self._documents
+            if self._query._matches_document(data):
+                changes.append((ChangeType.MODIFIED if matched else ChangeType.ADDED, document_id, data))
+                self._documents[document_id] = data
+            elif matched:
+                changes.append((ChangeType.REMOVED, document_id, self._documents.pop(document_id)))
+        return self._snapshot(changes) if changes else None
+
+    def unsubscribe(self):
+        self._query._client._unwatch(self)
+
+class CollectionReference(Query):
+    def __init__(self, client, collection_path):
+        super().__init__(client, collection_path)
+        self.id = collection_path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._collection_path, document_id or auto_id())
+
+    def add(self, data, document_id=None):
+        reference = self.document(document_id)
+        reference.create(data)
+        return datetime.now(timezone.utc), reference
+
+class WriteBatch:
+    """Atomic group of writes: every precondition is checked before any write is applied"""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def _add(self, kind, reference, data=None, merge=False):
+        if len(self._writes) >= MAX_BATCH_WRITES:
+            raise InvalidArgument(f"A batch can contain at most {MAX_BATCH_WRITES} writes")
+        self._writes.append((kind, reference, data, merge))
+
+    def create(self, reference, data):
+        self._add("create", reference, data)
+
+    def set(self, reference, data, merge=False):
+        self._add("set", reference, data, merge)
+
+    def update(self, reference, data):
+        self._add("update", reference, data)
+
+    def delete(self, reference):
+        self._add("delete", reference)
+
+    def commit(self, *args, **kwargs):
+        with self._client._lock:
+            # Resolve every write against the current (and earlier in-batch) state before storing anything
+            staged = {}
+            for kind, reference, data, merge in self._writes:
+                key = (reference._collection_path, reference.id)
+                existing = staged[key] if key in staged else self._client._load(*key)
+                if kind == "create":
+                    if existing is not None:
+                        raise AlreadyExists(f"Document already exists: {reference.path}")
+                    staged[key] = _apply_transforms(data)
+                elif kind == "set":
+                    staged[key] = _apply_transforms(_merge_paths(data), existing) if merge else _apply_transforms(data)
+                elif kind == "update":
+                    if existing is None:
+                        raise NotFound(f"No document to update: {reference.path}")
+                    staged[key] = _apply_transforms(data, existing)
+                else:
+                    staged[key] = None
+            self._client._write_many(staged)
+            self._client._notify(staged)
+        results = list(self._writes)
+        self._writes = []
+        return results
+
+class DocumentStoreClient:
+    """Base class for local clients; subclasses implement the storage hooks"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._watches = defaultdict(list)  # collection path -> Watches
+        self._snapshots = None  # Queue of (watch, docs, changes) for the listener thread, once one is started
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+    def document(self, path):
+        collection_path, document_id = path.rsplit("/", 1)
+        return DocumentReference(self, collection_path, document_id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, *args, **kwargs):
+        for reference in references:
+            yield reference.get()
+
+    def close(self):
+        pass
+
+    # Snapshot listeners
+    def _watch(self, query, callback):
+        watch = Watch(query, callback)
+        with self._lock:
+            self._watches[query._collection_path].append(watch)
+            self._deliver(watch, *watch._initial())
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            watch.active = False
+            watches = self._watches.get(watch._query._collection_path, [])
+            if watch in watches:
+                watches.remove(watch)
+
+    def _notify(self, staged):
+        """Queue the snapshots of the watches affected by a commit; called with the lock held"""
+        written = defaultdict(dict)
+        for (collection_path, document_id), data in staged.items():
+            if self._watches.get(collection_path):
+                written[collection_path][document_id] = data
+        for collection_path, documents in written.items():
+            for watch in self._watches[collection_path]:
+                snapshot = watch._apply(documents)
+                if snapshot is not None:
+                    self._deliver(watch, *snapshot)
+
+    def _deliver(self, watch, docs, changes):
+        if self._snapshots is None:
+            self._snapshots = queue.Queue()
+            threading.Thread(target=self._run_listeners, name="snapshot-listeners", daemon=True).start()
+        self._snapshots.put((watch, docs, changes, datetime.now(timezone.utc)))
+
+    def _run_listeners(self):
+        while True:
+            watch, docs, changes, read_time = self._snapshots.get()
+            if not watch.active:
+                continue
+            try:
+                watch._callback(docs, changes, read_time)
+            except Exception:
+                logger.exception("Snapshot listener failed")
+
+    # Storage hooks
+    def _load(self, collection_path, document_id):
+        """Return a copy of the stored document data, or None"""
+        raise NotImplementedError
+
+    def _write_many(self, staged):
+        """Atomically store {(collection_path, document_id): data or None (delete)}"""
+        raise NotImplementedError
+
+    def _scan(self, collection_path, equality_filters):
+        """Yield (document_id, data) candidates; may use the equality filters to narrow the scan"""
+        raise NotImplementedError
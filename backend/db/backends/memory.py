@@ -0,0 +1,94 @@
+"""
+In-process document store with automatic secondary indexes, for tests, local development and
+benchmarks (DB_BACKEND=memory).
+
+Every top-level scalar field is indexed by value, so equality filters (`user_id == ...`,
+`category_id == ...`) only touch matching documents instead of scanning the collection.
+"""
+import copy
+from collections import defaultdict
+from .document_store import DocumentStoreClient
+
+def _index_key(value):
+    # bool is an int subclass; keep True and 1 in different buckets like Firestore does
+    if isinstance(value, bool):
+        return ("bool", value)
+    if isinstance(value, (int, float)):
+        return ("number", value)
+    return (type(value).__name__, value)
+
+def _indexable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return not isinstance(value, (dict, list, tuple))
+
+class _Collection:
+    def __init__(self):
+        self.documents = {}
+        # field -> index key -> set of document IDs
+        self.indexes = defaultdict(lambda: defaultdict(set))
+
+    def _index(self, document_id, data, add):
+        for field, value in data.items():
+            if not _indexable(value):
+                continue
+            bucket = self.indexes[field][_index_key(value)]
+            if add:
+                bucket.add(document_id)
+            else:
+                bucket.discard(document_id)
+                if not bucket:
+                    del self.indexes[field][_index_key(value)]
+
+    def put(self, document_id, data):
+        self.remove(document_id)
+        self.documents[document_id] = data
+        self._index(document_id, data, add=True)
+
+    def remove(self, document_id):
+        existing = self.documents.pop(document_id, None)
+        if existing is not None:
+            self._index(document_id, existing, add=False)
+
+    def candidates(self, equality_filters):
+        """Smallest set of document IDs matching one indexed equality filter, or None for a full scan"""
+        best = None
+        for field, value in equality_filters.items():
+            if "." in field or not _indexable(value):
+                continue
+            ids = self.indexes.get(field, {}).get(_index_key(value), set())
+            if best is None or len(ids) < len(best):
+                best = ids
+        return best
+
+class MemoryClient(DocumentStoreClient):
+    def __init__(self):
+        super().__init__()
+        self._collections = defaultdict(_Collection)
+
+    def _load(self, collection_path, document_id):
+        with self._lock:
+            collection = self._collections.get(collection_path)
+            data = collection.documents.get(document_id) if collection else None
+            return copy.deepcopy(data) if data is not None else None
+
+    def _write_many(self, staged):
+        with self._lock:
+            for (collection_path, document_id), data in staged.items():
+                if data is None:
+                    if collection_path in self._collections:
+                        self._collections[collection_path].remove(document_id)
+                else:
+                    self._collections[collection_path].put(document_id, data)
+
+    def _scan(self, collection_path, equality_filters):
+        with self._lock:
+            collection = self._collections.get(collection_path)
+            if collection is None:
+                return []
+            ids = collection.candidates(equality_filters)
+            if ids is None:
+                return list(collection.documents.items())
+            return [(document_id, collection.documents[document_id]) for document_id in ids]
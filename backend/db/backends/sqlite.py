@@ -0,0 +1,100 @@
+"""
+Single-file SQLite document store (DB_BACKEND=sqlite, SQLITE_PATH=...), for running the API
+locally without Firestore credentials.
+
+Documents are stored as JSON in one table keyed by (collection, id). Equality filters on
+top-level string/number fields are pushed down to SQL via json_extract, and the fields the
+app filters on most have expression indexes.
+"""
+import json
+import base64
+import sqlite3
+from datetime import datetime, date
+from decimal import Decimal
+from .document_store import DocumentStoreClient
+
+# Fields with a json_extract expression index
+INDEXED_FIELDS = ["user_id", "category_id", "group_id", "plaid_transaction_id", "pending_transaction_id", "item_id"]
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    raise TypeError(f"Cannot store value of type {type(value).__name__}")
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    if "__date__" in obj:
+        return date.fromisoformat(obj["__date__"])
+    if "__bytes__" in obj:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+class SQLiteClient(DocumentStoreClient):
+    def __init__(self, path="budgeting-app.sqlite3"):
+        super().__init__()
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (collection, id))"
+        )
+        for field in INDEXED_FIELDS:
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS documents_{field} "
+                f"ON documents (collection, json_extract(data, '$.{field}'))"
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _load(self, collection_path, document_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM documents WHERE collection = ? AND id = ?",
+                (collection_path, document_id)
+            ).fetchone()
+        return json.loads(row[0], object_hook=_decode) if row else None
+
+    def _write_many(self, staged):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN")
+            try:
+                for (collection_path, document_id), data in staged.items():
+                    if data is None:
+                        cursor.execute(
+                            "DELETE FROM documents WHERE collection = ? AND id = ?",
+                            (collection_path, document_id)
+                        )
+                    else:
+                        cursor.execute(
+                            "INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)",
+                            (collection_path, document_id, json.dumps(data, default=_encode))
+                        )
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def _scan(self, collection_path, equality_filters):
+        sql = "SELECT id, data FROM documents WHERE collection = ?"
+        params = [collection_path]
+        for field, value in equality_filters.items():
+            # Only push down filters SQL compares the same way Firestore does
+            if not field.isidentifier() or isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                continue
+            sql += f" AND json_extract(data, '$.{field}') = ?"
+            params.append(value)
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [(document_id, json.loads(data, object_hook=_decode)) for document_id, data in rows]
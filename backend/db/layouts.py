@@ -0,0 +1,235 @@
+"""
+Storage layouts for the documents users own (categories, transactions, assignments and
+transaction archive blocks).
+
+- `flat`: top-level collections (`transactions`, ...) filtered by `user_id`, the original layout
+- `partitioned`: per-user subcollections (`users/{uid}/transactions`, ...), so queries need no
+  `user_id` filter (nor the composite indexes that come with it) and users don't share index ranges
+
+Each user's layout is the `data_layout` field of their user document (flat when missing).
+While `api/migrate_user_partitions.py` moves a user from flat to partitioned, the user goes
+through two dual-write layouts, in which every write is applied to both copies of a document
+in the same batch: `dual_write` still reads the flat copies, `partitioned_dual_write` already
+reads the partitioned ones.
+
+The repositories resolve a user's layout through `UserLayouts` and hand out `UserDocument`s for
+single-layout users and `MirroredDocument`s for dual-write users; batches created by the
+repositories (`LayoutBatch`) expand writes to mirrored documents into writes to both copies.
+"""
+import time
+import threading
+from .versions import tombstoned
+
+FLAT = "flat"
+PARTITIONED = "partitioned"
+DUAL_WRITE = "dual_write"
+PARTITIONED_DUAL_WRITE = "partitioned_dual_write"
+LAYOUTS = (FLAT, DUAL_WRITE, PARTITIONED_DUAL_WRITE, PARTITIONED)
+
+def read_layout(layout):
+    """The layout (flat or partitioned) reads are served from"""
+    return PARTITIONED if layout in (PARTITIONED_DUAL_WRITE, PARTITIONED) else FLAT
+
+def mirror_layout(layout):
+    """The layout that also receives every write, or None outside dual-write"""
+    return {DUAL_WRITE: PARTITIONED, PARTITIONED_DUAL_WRITE: FLAT}.get(layout)
+
+class UserLayouts:
+    """
+    Process-wide TTL cache of each user's layout. A layout change made by the migration reaches
+    other processes within the TTL, which is why the migration waits that long between phases.
+    """
+
+    def __init__(self, load_user, ttl_seconds):
+        self._load_user = load_user  # user_id -> user document snapshot
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # user_id -> (expires_at, layout)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        user_doc = self._load_user(user_id)
+        return self.prime(user_id, user_doc.to_dict() if user_doc.exists else None)
+
+    def prime(self, user_id, user_data):
+        """Cache the layout from user document data that was read anyway (None when the user doesn't exist)"""
+        layout = (user_data or {}).get("data_layout") or FLAT
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown data layout '{layout}' for user {user_id}")
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, layout)
+        return layout
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def primary_reference(reference):
+    """The plain reference reads go to: the primary copy of a user's document, otherwise the reference itself"""
+    return reference.primary if isinstance(reference, UserDocument) else reference
+
+class UserDocument:
+    """
+    A document owned by a user, as handed out by the repositories: a reference (`primary`) that
+    knows its owner, so its writes can be versioned and its deletion tombstoned (see versions.py).
+    Writes made on it directly go through a one-write repository batch. Behaves like a document
+    reference for the repositories' batches, `UnitOfWork` and the write coalescer.
+    """
+
+    write_count = 1  # Writes it takes in a batch
+
+    def __init__(self, primary, user_id, batch_factory):
+        self.primary = primary
+        self.user_id = user_id
+        self._batch_factory = batch_factory
+
+    @property
+    def id(self):
+        return self.primary.id
+
+    @property
+    def path(self):
+        return self.primary.path
+
+    def collection(self, name):
+        return UserCollection(self.primary.collection(name), self.user_id, self._batch_factory)
+
+    def get(self, *args, **kwargs):
+        return self.primary.get(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # Other reads (e.g. snapshot listeners) go to the primary
+        return getattr(self.primary, name)
+
+    def _write(self, operation, *args):
+        batch = self._batch_factory()
+        getattr(batch, operation)(self, *args)
+        batch.commit()
+
+    def create(self, data):
+        self._write("create", data)
+
+    def set(self, data, merge=False):
+        self._write("set", data, merge)
+
+    def update(self, data):
+        self._write("update", data)
+
+    def delete(self):
+        self._write("delete")
+
+class UserCollection:
+    def __init__(self, primary, user_id, batch_factory):
+        self.primary = primary
+        self.user_id = user_id
+        self._batch_factory = batch_factory
+
+    def document(self, document_id=None):
+        return UserDocument(self.primary.document(document_id), self.user_id, self._batch_factory)
+
+    def __getattr__(self, name):
+        # Queries run against the primary
+        return getattr(self.primary, name)
+
+class MirroredDocument(UserDocument):
+    """
+    A document of a dual-write user: reads use the `primary` copy (in the user's read layout)
+    and writes go to both copies, atomically; identified by the primary's path.
+    """
+
+    write_count = 2
+
+    def __init__(self, primary, mirror, user_id, batch_factory):
+        super().__init__(primary, user_id, batch_factory)
+        self.mirror = mirror
+
+    def collection(self, name):
+        return MirroredCollection(self.primary.collection(name), self.mirror.collection(name), self.user_id, self._batch_factory)
+
+class MirroredCollection(UserCollection):
+    def __init__(self, primary, mirror, user_id, batch_factory):
+        super().__init__(primary, user_id, batch_factory)
+        self.mirror = mirror
+
+    def document(self, document_id=None):
+        primary = self.primary.document(document_id)
+        return MirroredDocument(primary, self.mirror.document(primary.id), self.user_id, self._batch_factory)
+
+def _nested(data):
+    """Update data with its field paths (`a.b`) turned into nested maps, for a merge set"""
+    nested = {}
+    for field_path, value in data.items():
+        *parents, key = field_path.split(".")
+        target = nested
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[key] = value
+    return nested
+
+class LayoutBatch:
+    """
+    Write batch of the repositories. Writes to documents of versioned collections are stamped
+    with the commit's version, and deletes of documents of tombstoned collections leave a
+    tombstone, when the batch is given the client's `Versions` (see versions.py).
+
+    Each write to a mirrored document is applied to both copies. The mirror copy may not exist
+    yet (the migration hasn't copied it), so creates and updates are written to it as a set and
+    a merge (with nested maps for field paths), which the migration's copy then completes.
+    """
+
+    def __init__(self, batch, versions=None):
+        self._batch = batch
+        self._versions = versions
+
+    def _stamp(self, reference, data):
+        return self._versions.stamp(reference, data) if self._versions else data
+
+    def create(self, reference, data):
+        data = self._stamp(reference, data)
+        self._batch.create(primary_reference(reference), data)
+        if isinstance(reference, MirroredDocument):
+            self._batch.set(reference.mirror, data)
+
+    def set(self, reference, data, merge=False):
+        data = self._stamp(reference, data)
+        self._batch.set(primary_reference(reference), data, merge=merge)
+        if isinstance(reference, MirroredDocument):
+            self._batch.set(reference.mirror, data, merge=merge)
+
+    def update(self, reference, data):
+        data = self._stamp(reference, data)
+        self._batch.update(primary_reference(reference), data)
+        if isinstance(reference, MirroredDocument):
+            self._batch.set(reference.mirror, _nested(data), merge=True)
+
+    def delete(self, reference, tombstone=True):
+        """
+        Delete the document; `tombstone=False` for deletes clients mustn't see as deletions
+        (e.g. transactions moved into an archive block)
+        """
+        self._batch.delete(primary_reference(reference))
+        if isinstance(reference, MirroredDocument):
+            self._batch.delete(reference.mirror)
+        if tombstone and self._versions and tombstoned(reference):
+            if not isinstance(reference, UserDocument):
+                raise ValueError(f"Deleting {reference.path} leaves a tombstone, which needs a reference from the repository (with its owner)")
+            self._batch.set(*self._versions.tombstone(reference, reference.user_id))
+
+    def commit(self, *args, **kwargs):
+        return self._batch.commit(*args, **kwargs)
+
+def write_count(reference, operation=None):
+    """Writes a batch spends on one write (of the given operation) to the reference, tombstones included"""
+    count = reference.write_count if isinstance(reference, UserDocument) else 1
+    if operation == "delete" and isinstance(reference, UserDocument) and tombstoned(reference):
+        count += 1
+    return count
@@ -0,0 +1,512 @@
+"""
+Repository layer between the API routes and the document store.
+
+Each repository owns one collection and the queries the app makes against it, so routes
+never build collection paths or filters themselves. Repositories work with any client that
+implements the Firestore client API subset used here: `google.cloud.firestore.Client` or
+one of the local backends in `backend.db.backends`. Reads return document snapshots and
+writes take plain dicts (usually a schema's `to_dict()`); `ref()` gives a document reference
+for adding writes to a batch.
+
+Categories, transactions, assignments and archive blocks are stored in the layout of the user
+owning them (see `layouts.py`), so their repositories take the `user_id` for every document
+they address.
+Batches must come from `Repositories.batch()` and multi-document reads from
+`Repositories.get_all()`, which know how to handle documents of dual-write users. Writes to
+documents clients cache are stamped with a version and their deletes leave tombstones (see
+`versions.py`); `changed` queries a user's documents by version.
+
+Transactions from old months may be compacted into archive blocks (see `archive.py`); the
+transaction reads that cover history (`for_user`, date ranges, pages) merge them back in.
+"""
+from datetime import date, timedelta
+from itertools import chain, groupby
+from .schemas import (
+    User, Category, CategoryGroup, Assignment, Transaction, PlaidItem,
+    CategorizationRule, SyncRun
+)
+from .layouts import (
+    UserLayouts, LayoutBatch, UserDocument, MirroredDocument, FLAT, PARTITIONED, read_layout, mirror_layout, primary_reference
+)
+from .versions import Versions, VERSION_FIELD, DELETED_FIELD, TOMBSTONES_COLLECTION
+from .archive import month_of, has_category, archived_transactions
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+# Most values an `in` filter may hold (Firestore's limit)
+MAX_IN_VALUES = 30
+
+def next_day(date_string):
+    """The YYYY-MM-DD date after the given one"""
+    return (date.fromisoformat(date_string) + timedelta(days=1)).isoformat()
+
+class Repository:
+    collection_name = None
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def collection(self):
+        return self.client.collection(self.collection_name)
+
+    def ref(self, document_id=None):
+        """Reference to a document; a new auto ID is generated when document_id is None"""
+        return self.collection.document(document_id)
+
+    def get(self, document_id):
+        return self.ref(document_id).get()
+
+    def get_many(self, document_ids):
+        """Fetch several documents in one round trip; returns {document_id: snapshot} for those that exist"""
+        refs = [self.ref(document_id) for document_id in dict.fromkeys(document_ids)]
+        if not refs:
+            return {}
+        return {doc.id: doc for doc in self.client.get_all(refs) if doc.exists}
+
+    def create(self, data, document_id=None):
+        """Create a document and return its reference"""
+        ref = self.ref(document_id)
+        ref.set(data)
+        return ref
+
+    def update(self, document_id, data):
+        self.ref(document_id).update(data)
+
+    def delete(self, document_id):
+        self.ref(document_id).delete()
+
+    def where(self, **equals):
+        """Query for documents whose fields equal the given values"""
+        query = self.collection
+        for field, value in equals.items():
+            query = query.where(field, "==", value)
+        return query
+
+    def find(self, **equals):
+        return self.where(**equals).stream()
+
+    def find_one(self, **equals):
+        """First document matching the filters, or None"""
+        for doc in self.where(**equals).limit(1).stream():
+            return doc
+        return None
+
+    def for_user(self, user_id):
+        return self.find(user_id=user_id)
+
+    # Field holding each document's version, for `changed`
+    version_field = VERSION_FIELD
+
+    def changed(self, user_id, since, until=None, limit=None):
+        """The user's documents with a version (timestamp) in (since, until] (or after since), oldest first (at most `limit` of them)"""
+        query = self.where(user_id=user_id).where(self.version_field, ">", since)
+        if until is not None:
+            query = query.where(self.version_field, "<=", until)
+        query = query.order_by(self.version_field)
+        return (query.limit(limit) if limit else query).stream()
+
+class UserScopedRepository(Repository):
+    """
+    Repository of a collection whose documents belong to a user and are stored in that user's
+    layout. `ref`, `get`, `get_many`, `create`, `update` and `delete` take the owner as the
+    keyword argument `user_id`; queries filtering on `user_id` run against the user's read
+    layout. `collection` is the flat top-level collection.
+    """
+
+    def __init__(self, client, layouts, batch_factory):
+        super().__init__(client)
+        self.layouts = layouts
+        self._batch_factory = batch_factory
+
+    def collection_in(self, layout, user_id):
+        """The user's collection in the given layout (flat or partitioned)"""
+        if layout == PARTITIONED:
+            return self.client.collection(User.collection_name()).document(user_id).collection(self.collection_name)
+        return self.collection
+
+    def ref(self, document_id=None, *, user_id, layout=None):
+        """
+        Reference to one of the user's documents (a new auto ID when document_id is None), in the
+        user's layout unless `layout` is given; a MirroredDocument while the user is dual-writing
+        """
+        layout = layout or self.layouts.get(user_id)
+        primary = self.collection_in(read_layout(layout), user_id).document(document_id)
+        if mirror_layout(layout) is None:
+            return UserDocument(primary, user_id, self._batch_factory)
+        mirror = self.collection_in(mirror_layout(layout), user_id).document(primary.id)
+        return MirroredDocument(primary, mirror, user_id, self._batch_factory)
+
+    def get(self, document_id, *, user_id):
+        return self.ref(document_id, user_id=user_id).get()
+
+    def get_many(self, document_ids, *, user_id):
+        """Fetch several documents in one round trip; returns {document_id: snapshot} for those that exist"""
+        refs = [primary_reference(self.ref(document_id, user_id=user_id)) for document_id in dict.fromkeys(document_ids)]
+        if not refs:
+            return {}
+        return {doc.id: doc for doc in self.client.get_all(refs) if doc.exists}
+
+    def create(self, data, document_id=None, *, user_id):
+        ref = self.ref(document_id, user_id=user_id)
+        ref.set(data)
+        return ref
+
+    def update(self, document_id, data, *, user_id):
+        self.ref(document_id, user_id=user_id).update(data)
+
+    def delete(self, document_id, *, user_id):
+        self.ref(document_id, user_id=user_id).delete()
+
+    def where(self, **equals):
+        """
+        Query for documents whose fields equal the given values. Queries with a `user_id` filter
+        run against that user's read layout (see `user_query`); others only see the flat layout.
+        """
+        if equals.get("user_id") is None:
+            return super().where(**equals)
+        return self.user_query(**equals)
+
+    def user_query(self, user_id, filter_user=True, **equals):
+        """
+        Query for one user's documents whose fields equal the given values, in the user's read
+        layout. The partitioned layout needs no `user_id` filter; the flat layout gets one unless
+        `filter_user` is False, for queries whose other filters already only match the user's
+        documents (e.g. a category ID) and whose indexes don't include `user_id`.
+        """
+        if read_layout(self.layouts.get(user_id)) == FLAT:
+            query = self.collection.where("user_id", "==", user_id) if filter_user else self.collection
+        else:
+            query = self.collection_in(PARTITIONED, user_id)
+        for field, value in equals.items():
+            query = query.where(field, "==", value)
+        return query
+
+    def listen(self, user_id, callback):
+        """Snapshot listener on all of the user's documents, in the user's current read layout; returns the watch"""
+        return self.user_query(user_id).on_snapshot(callback)
+
+class UserRepository(Repository):
+    collection_name = User.collection_name()
+
+class CategoryRepository(UserScopedRepository):
+    collection_name = Category.collection_name()
+
+    # Subcollection holding the counter shards of a sharded category's available amount
+    shards_collection_name = "available_shards"
+
+    def shard_ref(self, category_id, shard_index, *, user_id):
+        return self.ref(category_id, user_id=user_id).collection(self.shards_collection_name).document(str(shard_index))
+
+    def shard_refs(self, category_id, shard_count, *, user_id):
+        return [self.shard_ref(category_id, shard_index, user_id=user_id) for shard_index in range(shard_count)]
+
+    def listen_shards(self, category_id, callback, *, user_id):
+        """Snapshot listener on a sharded category's counter shards; returns the watch"""
+        category_ref = primary_reference(self.ref(category_id, user_id=user_id))
+        return category_ref.collection(self.shards_collection_name).on_snapshot(callback)
+
+    def unallocated_for_user(self, user_id):
+        """The user's Unallocated Funds category, or None"""
+        return self.find_one(user_id=user_id, is_unallocated_funds=True)
+
+    def sharded(self, user_id):
+        """The user's categories whose available amount is sharded"""
+        return self.user_query(user_id).where("available_shards", ">", 0).stream()
+
+    def any_in_group(self, user_id, group_id):
+        for doc in self.user_query(user_id, filter_user=False, group_id=group_id).limit(1).stream():
+            return True
+        return False
+
+class CategoryGroupRepository(Repository):
+    """
+    Category groups, in the flat layout only. `ref`, `create` and `delete` take the owner as
+    `user_id` (writes need it for the group's version and tombstone).
+    """
+    collection_name = CategoryGroup.collection_name()
+
+    def __init__(self, client, batch_factory):
+        super().__init__(client)
+        self._batch_factory = batch_factory
+
+    def ref(self, document_id=None, *, user_id):
+        return UserDocument(self.collection.document(document_id), user_id, self._batch_factory)
+
+    def get(self, document_id):
+        return self.collection.document(document_id).get()
+
+    def create(self, data, document_id=None):
+        ref = self.ref(document_id, user_id=data["user_id"])
+        ref.set(data)
+        return ref
+
+    def update(self, document_id, data, *, user_id):
+        self.ref(document_id, user_id=user_id).update(data)
+
+    def delete(self, document_id, *, user_id):
+        self.ref(document_id, user_id=user_id).delete()
+
+    def for_user(self, user_id):
+        return self.where(user_id=user_id).order_by("sort_order").stream()
+
+class AssignmentRepository(UserScopedRepository):
+    collection_name = Assignment.collection_name()
+
+    def for_category(self, user_id, category_id):
+        return self.user_query(user_id, filter_user=False, category_id=category_id).stream()
+
+    def for_category_in_range(self, user_id, category_id, start_date, end_date_exclusive):
+        query = self.user_query(user_id, filter_user=False, category_id=category_id)
+        return query.where("date", ">=", start_date).where("date", "<", end_date_exclusive).stream()
+
+    def in_range(self, user_id, start_date, end_date_exclusive):
+        """The user's assignments dated in [start_date, end_date_exclusive)"""
+        return self.where(user_id=user_id).where("date", ">=", start_date).where("date", "<", end_date_exclusive).stream()
+
+class TransactionArchiveRepository(UserScopedRepository):
+    """Blocks of compacted old transactions, one or more per user-month (see archive.py)"""
+    collection_name = "transaction_archive"
+
+    def blocks(self, user_id, start_month=None, end_month=None, descending=False, category_id=None):
+        """The user's blocks for months in [start_month, end_month], in month order"""
+        query = self.where(user_id=user_id)
+        if category_id:
+            query = query.where("category_ids", "array_contains", category_id)
+        if start_month:
+            query = query.where("month", ">=", start_month)
+        if end_month:
+            query = query.where("month", "<=", end_month)
+        return query.order_by("month", direction=DESCENDING if descending else ASCENDING).stream()
+
+    def transactions(self, user_id, start_date=None, end_date_exclusive=None, descending=False, **equals):
+        """
+        ArchivedTransactions of the user dated in [start_date, end_date_exclusive) and matching
+        the equality filters, by date (then ID). Blocks are read lazily, one month at a time,
+        and blocks whose category totals rule out a `category_id` filter are not decompressed.
+        """
+        category_id = equals.get("category_id")
+        blocks = self.blocks(
+            user_id,
+            start_month=month_of(start_date) if start_date else None,
+            end_month=month_of(end_date_exclusive) if end_date_exclusive else None,
+            descending=descending,
+            category_id=category_id,
+        )
+        for _, month_blocks in groupby(blocks, key=lambda block: block.get("month")):
+            rows = [
+                row
+                for block in month_blocks if "category_id" not in equals or has_category(block.to_dict(), category_id)
+                for row in archived_transactions(block)
+                if (start_date is None or row.date >= start_date)
+                and (end_date_exclusive is None or row.date < end_date_exclusive)
+                and all(row.get(field) == value for field, value in equals.items())
+            ]
+            rows.sort(key=lambda row: row.id)
+            rows.sort(key=lambda row: row.date, reverse=descending)
+            yield from rows
+
+    def locate(self, user_id, transaction_id=None, plaid_transaction_id=None):
+        """The archived transaction with the ID (or Plaid ID) and its block snapshot, or (None, None)"""
+        field, value = ("transaction_ids", transaction_id) if transaction_id else ("plaid_transaction_ids", plaid_transaction_id)
+        for block in self.where(user_id=user_id).where(field, "array_contains", value).stream():
+            for row in archived_transactions(block):
+                if (row.id if transaction_id else row.get("plaid_transaction_id")) == value:
+                    return row, block
+        return None, None
+
+    def any_for_category(self, user_id, category_id):
+        return any(has_category(block.to_dict(), category_id) for block in self.blocks(user_id, category_id=category_id))
+
+class TransactionRepository(UserScopedRepository):
+    """
+    Transactions of the users. Reads spanning history also return the archived transactions
+    (as `ArchivedTransaction`s, which can't be written to). Hot reads take `archived_through`,
+    the user's newest archived month (from the user document, None when nothing is archived),
+    so they only read blocks when the range reaches archived months.
+    """
+    collection_name = Transaction.collection_name()
+
+    def __init__(self, client, layouts, batch_factory, archive):
+        super().__init__(client, layouts, batch_factory)
+        self.archive = archive
+
+    def for_user(self, user_id):
+        """Every transaction of the user, live ones first"""
+        return chain(super().for_user(user_id), self.archive.transactions(user_id))
+
+    def for_category(self, user_id, category_id):
+        return self.user_query(user_id, filter_user=False, category_id=category_id).stream()
+
+    def any_for_category(self, user_id, category_id):
+        for doc in self.user_query(user_id, filter_user=False, category_id=category_id).limit(1).stream():
+            return True
+        return self.archive.any_for_category(user_id, category_id)
+
+    def for_category_in_range(self, user_id, category_id, start_date, end_date_exclusive, archived_through=None):
+        query = self.user_query(user_id, filter_user=False, category_id=category_id)
+        docs = query.where("date", ">=", start_date).where("date", "<", end_date_exclusive).stream()
+        if archived_through is None or month_of(start_date) > archived_through:
+            return docs
+        return chain(docs, self.archive.transactions(user_id, start_date, end_date_exclusive, category_id=category_id))
+
+    def in_range(self, user_id, start_date, end_date_exclusive, archived_through=None):
+        """The user's transactions dated in [start_date, end_date_exclusive), live ones first"""
+        docs = self.where(user_id=user_id).where("date", ">=", start_date).where("date", "<", end_date_exclusive).stream()
+        if archived_through is None or month_of(start_date) > archived_through:
+            return docs
+        return chain(docs, self.archive.transactions(user_id, start_date, end_date_exclusive))
+
+    def dated_before(self, user_id, date):
+        """The user's live transactions dated before `date`"""
+        return self.where(user_id=user_id).where("date", "<", date).stream()
+
+    def dated_from(self, user_id, start_date, archived_through=None):
+        """The user's transactions dated on or after `start_date`, live ones first"""
+        docs = self.where(user_id=user_id).where("date", ">=", start_date).stream()
+        if archived_through is None or month_of(start_date) > archived_through:
+            return docs
+        return chain(docs, self.archive.transactions(user_id, start_date))
+
+    def by_plaid_id(self, user_id, plaid_transaction_id):
+        """The stored (live) transaction for a Plaid transaction ID, or None"""
+        return self.find_one(plaid_transaction_id=plaid_transaction_id, user_id=user_id)
+
+    def by_plaid_ids(self, user_id, plaid_transaction_ids):
+        """
+        The stored (live) transactions for several Plaid transaction IDs, as {plaid_transaction_id:
+        [snapshots]}, read with one `in` query per MAX_IN_VALUES IDs
+        """
+        plaid_transaction_ids = list(dict.fromkeys(plaid_transaction_ids))
+        found = {}
+        for start in range(0, len(plaid_transaction_ids), MAX_IN_VALUES):
+            chunk = plaid_transaction_ids[start:start + MAX_IN_VALUES]
+            for doc in self.where(user_id=user_id).where("plaid_transaction_id", "in", chunk).stream():
+                found.setdefault(doc.get("plaid_transaction_id"), []).append(doc)
+        return found
+
+    def page(self, user_id, limit, cursor_id=None, archived_through=None, **equals):
+        """
+        One page of a user's transactions, newest first, starting after `cursor_id`.
+        Extra keyword arguments are equality filters (e.g. category_id=None for uncategorized).
+        Archived transactions are merged in by date, after the live ones of the same date.
+        """
+        query = self.where(user_id=user_id, **equals).order_by("date", direction=DESCENDING)
+        archived_after = None  # (date, ID) position in the archived transactions to continue after
+        if cursor_id:
+            cursor_doc = primary_reference(self.ref(cursor_id, user_id=user_id)).get()
+            if cursor_doc.exists:
+                query = query.start_after(cursor_doc)
+                archived_after = (cursor_doc.get("date"), None)
+            elif archived_through is not None:
+                cursor_row, _ = self.archive.locate(user_id, transaction_id=cursor_id)
+                if cursor_row:
+                    query = query.where("date", "<", cursor_row.date)
+                    archived_after = (cursor_row.date, cursor_row.id)
+        live = list(query.limit(limit).stream())
+
+        # Archived months are only read when the page reaches them
+        if archived_through is None or (len(live) == limit and month_of(live[-1].get("date")) > archived_through):
+            return live
+        if archived_after:
+            cursor_date, cursor_id = archived_after
+            # Archived rows of the cursor's date come after a live cursor, or after an archived cursor's ID
+            archived = (
+                row for row in self.archive.transactions(user_id, end_date_exclusive=next_day(cursor_date), descending=True, **equals)
+                if row.date < cursor_date or cursor_id is None or row.id > cursor_id
+            )
+        else:
+            archived = self.archive.transactions(user_id, descending=True, **equals)
+
+        page = []
+        next_archived = next(archived, None)
+        for doc in live:
+            while next_archived and next_archived.date > doc.get("date") and len(page) < limit:
+                page.append(next_archived)
+                next_archived = next(archived, None)
+            if len(page) == limit:
+                break
+            page.append(doc)
+        while next_archived and len(page) < limit:
+            page.append(next_archived)
+            next_archived = next(archived, None)
+        return page
+
+class PlaidItemRepository(Repository):
+    collection_name = PlaidItem.collection_name()
+
+class AccountRepository(Repository):
+    collection_name = "accounts"
+
+class CategorizationRuleRepository(Repository):
+    collection_name = CategorizationRule.collection_name()
+
+class SyncRunRepository(Repository):
+    collection_name = SyncRun.collection_name()
+
+    def listen_since(self, user_id, since, callback):
+        """Snapshot listener on the user's sync runs recorded from `since` on; returns the watch"""
+        return self.where(user_id=user_id).where("created_at", ">=", since).on_snapshot(callback)
+
+class TombstoneRepository(Repository):
+    """Records of deleted documents, for clients pulling changes (see versions.py)"""
+    collection_name = TOMBSTONES_COLLECTION
+    version_field = DELETED_FIELD
+
+    def deleted_before(self, before, limit=None):
+        """Tombstones of deletions before `before`, of every user"""
+        query = self.collection.where(DELETED_FIELD, "<", before)
+        return (query.limit(limit) if limit else query).stream()
+
+class LayoutMigrationRepository(Repository):
+    """Checkpoints of the users being moved to another layout (api/migrate_user_partitions.py)"""
+    collection_name = "layout_migrations"
+
+class ReconciliationWatermarkRepository(Repository):
+    """Per-user state of the incremental balance reconciliation (api/reconciliation.py), keyed by user ID"""
+    collection_name = "reconciliation_watermarks"
+
+class BalanceRepairRepository(Repository):
+    """Audit records of the balance corrections made by api/balance_repair.py"""
+    collection_name = "balance_repairs"
+
+class Repositories:
+    """All repositories for one client"""
+
+    # Most writes a batch may hold (Firestore's limit)
+    max_batch_writes = 500
+
+    def __init__(self, client, layout_ttl_seconds=60, server_timestamp=None):
+        self.client = client
+        # Versions written with the client's server timestamp sentinel; no versioning without one
+        self.versions = Versions(client, server_timestamp) if server_timestamp is not None else None
+        self.users = UserRepository(client)
+        self.layouts = UserLayouts(self.users.get, layout_ttl_seconds)
+        self.categories = CategoryRepository(client, self.layouts, self.batch)
+        self.category_groups = CategoryGroupRepository(client, self.batch)
+        self.assignments = AssignmentRepository(client, self.layouts, self.batch)
+        self.transaction_archive = TransactionArchiveRepository(client, self.layouts, self.batch)
+        self.transactions = TransactionRepository(client, self.layouts, self.batch, self.transaction_archive)
+        self.plaid_items = PlaidItemRepository(client)
+        self.categorization_rules = CategorizationRuleRepository(client)
+        self.sync_runs = SyncRunRepository(client)
+        self.accounts = AccountRepository(client)
+        self.layout_migrations = LayoutMigrationRepository(client)
+        self.tombstones = TombstoneRepository(client)
+        self.reconciliation_watermarks = ReconciliationWatermarkRepository(client)
+        self.balance_repairs = BalanceRepairRepository(client)
+
+    def batch(self):
+        return LayoutBatch(self.client.batch(), self.versions)
+
+    def get_all(self, references):
+        """Snapshots of several documents (plain or mirrored references) read in one round trip"""
+        return self.client.get_all([primary_reference(reference) for reference in references])
+
+    def batch_writes_for_user(self, user_id):
+        """
+        How many document writes of the user fit in one batch: half the limit while the user is
+        dual-writing, as each write is then applied to both copies
+        """
+        return self.max_batch_writes // 2 if mirror_layout(self.layouts.get(user_id)) else self.max_batch_writes
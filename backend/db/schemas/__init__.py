@@ -5,6 +5,10 @@ from .transaction import Transaction
 from .assignment import Assignment
 from .plaid_item import PlaidItem
 from .category_group import CategoryGroup
+from .categorization_rule import CategorizationRule
+from .sync_run import SyncRun
+from .money import to_cents, from_cents, read_cents, dollar_amounts
+from .records import TransactionRecord, AssignmentRecord
 
 # Export classes for easier imports
-__all__ = ['FirestoreModel', 'User', 'UserPreferences', 'PaySchedule', 'Category', 'Transaction', 'Assignment', 'PlaidItem', 'CategoryGroup']
\ No newline at end of file
+__all__ = ['FirestoreModel', 'User', 'UserPreferences', 'PaySchedule', 'Category', 'Transaction', 'Assignment', 'PlaidItem', 'CategoryGroup', 'CategorizationRule', 'SyncRun', 'to_cents', 'from_cents', 'read_cents', 'dollar_amounts', 'TransactionRecord', 'AssignmentRecord']
\ No newline at end of file
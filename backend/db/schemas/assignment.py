@@ -1,13 +1,13 @@
 from pydantic import BaseModel, Field, field_validator
 from datetime import datetime, timezone
 from typing import Dict, Any
-from decimal import Decimal
 from .base import FirestoreModel
+from .money import validate_cents
 
 class Assignment(FirestoreModel):
     """Model for assignment documents in Firestore"""
     
-    amount: Decimal
+    amount_cents: int
     user_id: str
     category_id: str
     date: str
@@ -17,15 +17,10 @@ class Assignment(FirestoreModel):
     def collection_name(cls) -> str:
         return "assignments"
     
-    @field_validator('amount')
+    @field_validator('amount_cents', mode='before')
     @classmethod
-    def validate_amount(cls, v):
-        # Convert to Decimal if it's not already
-        if isinstance(v, (int, float)):
-            v = Decimal(str(v))
-        elif isinstance(v, str):
-            v = Decimal(v)
-        
+    def validate_amount_cents(cls, v):
+        v = validate_cents(v)
         if v == 0:
             raise ValueError("Assignment amount cannot be zero")
         return v
@@ -46,7 +41,4 @@ class Assignment(FirestoreModel):
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert model to a dictionary for Firestore"""
-        data = self.model_dump(exclude_none=True)
-        # Convert Decimal to float for Firestore storage
-        data["amount"] = float(self.amount)
-        return data
\ No newline at end of file
+        return self.model_dump(exclude_none=True)
\ No newline at end of file
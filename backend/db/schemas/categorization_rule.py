@@ -0,0 +1,95 @@
+from pydantic import BaseModel, Field, field_validator, model_validator
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+from decimal import Decimal
+import re
+from .base import FirestoreModel
+
+class CategorizationRule(FirestoreModel):
+    """Model for categorization rule documents in Firestore
+
+    A rule matches when every condition that is set matches. Amount bounds are
+    compared against the absolute transaction amount and are inclusive.
+    """
+
+    user_id: str
+    category_id: str
+    merchant_name: Optional[str] = None  # Case-insensitive exact match
+    name_contains: Optional[str] = None  # Case-insensitive substring of the transaction name
+    name_regex: Optional[str] = None  # Case-insensitive regular expression searched in the transaction name
+    personal_finance_category: Optional[str] = None  # Plaid primary or detailed category
+    min_amount: Optional[Decimal] = None
+    max_amount: Optional[Decimal] = None
+    priority: int = 0  # Lower values are checked first
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @classmethod
+    def collection_name(cls) -> str:
+        return "categorization_rules"
+
+    @field_validator('user_id')
+    @classmethod
+    def validate_user_id(cls, v):
+        if not v or len(v.strip()) == 0:
+            raise ValueError("User ID cannot be empty")
+        return v
+
+    @field_validator('category_id')
+    @classmethod
+    def validate_category_id(cls, v):
+        if not v or len(v.strip()) == 0:
+            raise ValueError("Category ID cannot be empty")
+        return v
+
+    @field_validator('merchant_name', 'name_contains', 'personal_finance_category')
+    @classmethod
+    def validate_text_condition(cls, v):
+        # A blank condition would match every transaction (every name contains ""), so it counts as unset
+        if v is None:
+            return v
+        v = v.strip()
+        return v or None
+
+    @field_validator('name_regex')
+    @classmethod
+    def validate_name_regex(cls, v):
+        if not v:
+            return None
+        try:
+            re.compile(v)
+        except re.error as e:
+            raise ValueError(f"Invalid name regex: {e}")
+        return v
+
+    @field_validator('min_amount', 'max_amount')
+    @classmethod
+    def validate_amount_bound(cls, v):
+        if v is None:
+            return v
+        # Convert to Decimal if it's not already
+        if isinstance(v, (int, float)):
+            v = Decimal(str(v))
+        elif isinstance(v, str):
+            v = Decimal(v)
+        if v < 0:
+            raise ValueError("Amount bounds must be non-negative")
+        return v
+
+    @model_validator(mode='after')
+    def validate_conditions(self):
+        conditions = [self.merchant_name, self.name_contains, self.name_regex, self.personal_finance_category, self.min_amount, self.max_amount]
+        if all(condition is None for condition in conditions):
+            raise ValueError("Categorization rule must have at least one condition")
+        if self.min_amount is not None and self.max_amount is not None and self.min_amount > self.max_amount:
+            raise ValueError("Minimum amount cannot be greater than maximum amount")
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert model to a dictionary for Firestore"""
+        data = self.model_dump(exclude_none=True)
+        # Convert Decimal fields to float for Firestore storage
+        if self.min_amount is not None:
+            data["min_amount"] = float(self.min_amount)
+        if self.max_amount is not None:
+            data["max_amount"] = float(self.max_amount)
+        return data
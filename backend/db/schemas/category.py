@@ -1,8 +1,8 @@
 from pydantic import BaseModel, Field, field_validator
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any, ClassVar
-from decimal import Decimal
 from .base import FirestoreModel
+from .money import validate_cents
 
 class Category(FirestoreModel):
     """Model for category documents in Firestore"""
@@ -10,9 +10,10 @@ class Category(FirestoreModel):
     name: str
     user_id: str
     group_id: Optional[str] = None
-    available: Decimal = Decimal('0.0')
+    available_cents: int = 0
+    available_shards: Optional[int] = None  # Number of counter shards once the category is sharded
     is_unallocated_funds: bool = False
-    goal_amount: Optional[Decimal] = None
+    goal_amount_cents: Optional[int] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     
     @classmethod
@@ -33,33 +34,18 @@ class Category(FirestoreModel):
             raise ValueError("User ID cannot be empty")
         return v
     
-    @field_validator('available')
+    @field_validator('available_cents', mode='before')
     @classmethod
-    def validate_available(cls, v):
-        # Convert to Decimal if it's not already
-        if isinstance(v, (int, float)):
-            return Decimal(str(v))
-        elif isinstance(v, str):
-            return Decimal(v)
-        return v
+    def validate_available_cents(cls, v):
+        return validate_cents(v)
     
-    @field_validator('goal_amount')
+    @field_validator('goal_amount_cents', mode='before')
     @classmethod
-    def validate_goal_amount(cls, v):
+    def validate_goal_amount_cents(cls, v):
         if v is None:
             return v
-        # Convert to Decimal if it's not already
-        if isinstance(v, (int, float)):
-            return Decimal(str(v))
-        elif isinstance(v, str):
-            return Decimal(v)
-        return v
+        return validate_cents(v)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert model to a dictionary for Firestore"""
-        data = self.model_dump(exclude_none=True)
-        # Convert Decimal fields to float for Firestore storage
-        data["available"] = float(self.available)
-        if self.goal_amount is not None:
-            data["goal_amount"] = float(self.goal_amount)
-        return data
\ No newline at end of file
+        return self.model_dump(exclude_none=True)
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+Money amounts are stored as integer cents in `<field>_cents` fields (`amount_cents`,
+`available_cents`, `goal_amount_cents`), so sums and balance increments are exact integer
+arithmetic. Documents written before the switch hold the amount as a float in `<field>` (in
+dollars) until `api/migrate_money_to_cents.py` converts them; `read_cents` reads either form.
+The API keeps exchanging dollar amounts with the frontend.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+CENTS_PER_DOLLAR = 100
+
+def to_cents(amount) -> int:
+    """Dollar amount (Decimal, float, int or str) as integer cents, rounded half up"""
+    return int((Decimal(str(amount)) * CENTS_PER_DOLLAR).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_cents(cents) -> float:
+    """Integer cents as a dollar amount for API responses"""
+    return cents / CENTS_PER_DOLLAR
+
+def validate_cents(value):
+    """Pydantic validator body for cents fields: integers only (whole-number floats are accepted)"""
+    if type(value) is int:
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)) or value != int(value):
+        raise ValueError("Money amounts must be whole numbers of cents")
+    return int(value)
+
+def read_cents(data, field) -> int:
+    """
+    Amount of a money field of a stored document, in cents. A document can hold the amount in
+    `<field>_cents`, in the legacy float `<field>` (dollars) or, for balances incremented before
+    being migrated, in both; the amount is their sum.
+    """
+    cents = data.get(f"{field}_cents") or 0
+    legacy_amount = data.get(field)
+    if legacy_amount is not None:
+        cents += to_cents(legacy_amount)
+    return cents
+
+def dollar_amounts(data, *fields):
+    """Copy of a stored document's data with each money field as `<field>` in dollars (for API responses)"""
+    data = dict(data)
+    for field in fields:
+        if data.get(f"{field}_cents") is not None or data.get(field) is not None:
+            data[field] = from_cents(read_cents(data, field))
+        elif f"{field}_cents" in data:
+            data[field] = None  # Stored as null (e.g. a cleared goal)
+        data.pop(f"{field}_cents", None)
+    return data
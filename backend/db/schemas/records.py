@@ -0,0 +1,105 @@
+"""
+Lightweight records for the hot collections (transactions and assignments).
+
+A Plaid backfill writes thousands of transactions per sync, where building a Pydantic model,
+running its validators and `model_dump` for each row is measurable overhead. These records are
+slots-based dataclasses with the same checks as the Pydantic schemas written as plain Python,
+and an encoder to and a decoder from Firestore dicts that are generated once per class (as
+straight-line code, without per-field loops or introspection) when the module is imported.
+
+`to_dict()` always writes `category_id` (null when uncategorized, so uncategorized transactions
+can be queried) and leaves out the other unset optional fields. `from_dict()` decodes a stored
+document without re-validating it and reads legacy float amounts through `read_cents`.
+`python api/record_benchmark.py` compares them with the Pydantic schemas.
+"""
+from dataclasses import dataclass, field, fields, MISSING
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+from .money import validate_cents, read_cents
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def firestore_record(collection, always_written=(), computed=None):
+    """
+    Class decorator turning a record class into a slots dataclass with compiled `to_dict` and
+    `from_dict`. Fields ending in `_cents` are money fields. `always_written` fields are stored
+    even when None; `computed` maps extra stored fields to expressions of `self` (e.g. the type
+    of a transaction, derived from its amount).
+    """
+    def decorate(cls):
+        cls = dataclass(slots=True)(cls)
+        record_fields = fields(cls)
+        namespace = {"read_cents": read_cents, "cls": cls, "new": object.__new__}
+
+        # Encoder: required fields go in the dict literal, optional ones are added when set
+        literal = [f"{f.name!r}: self.{f.name}" for f in record_fields if f.default is MISSING or f.name in always_written]
+        literal += [f"{name!r}: {expression}" for name, expression in (computed or {}).items()]
+        lines = [f"def to_dict(self):", f"    data = {{{', '.join(literal)}}}"]
+        for f in record_fields:
+            if f.default is not MISSING and f.name not in always_written:
+                lines += [f"    if self.{f.name} is not None:", f"        data[{f.name!r}] = self.{f.name}"]
+        lines.append("    return data")
+
+        # Decoder: assigns the slots directly, skipping __init__ and validation
+        lines += ["def from_dict(data):", "    record = new(cls)"]
+        for f in record_fields:
+            if f.name.endswith("_cents"):
+                value = f"read_cents(data, {f.name[:-len('_cents')]!r})"
+            elif f.default is not MISSING:
+                value = f"data.get({f.name!r}, {f.default!r})"
+            else:
+                value = f"data.get({f.name!r})"
+            lines.append(f"    record.{f.name} = {value}")
+        lines.append("    return record")
+
+        exec(compile("\n".join(lines), f"<{cls.__name__} encoders>", "exec"), namespace)
+        cls.to_dict = namespace["to_dict"]
+        cls.from_dict = staticmethod(namespace["from_dict"])
+        cls.collection_name = staticmethod(lambda: collection)
+        return cls
+    return decorate
+
+def _require_text(value, message):
+    if not value or not value.strip():
+        raise ValueError(message)
+
+@firestore_record("transactions", always_written=("category_id",),
+                  computed={"type": "'debit' if self.amount_cents < 0 else 'credit'"})
+class TransactionRecord:
+    """Transaction document; `type` is derived from the sign of the amount"""
+
+    amount_cents: int  # Negative for expenses, positive for income
+    user_id: str
+    name: str
+    date: str
+    category_id: Optional[str] = None
+    created_at: datetime = field(default_factory=_now)
+    plaid_transaction_id: Optional[str] = None
+    institution_name: Optional[str] = None
+    account_name: Optional[str] = None
+    merchant_name: Optional[str] = None
+    personal_finance_category: Optional[Dict[str, Any]] = None
+    pending: Optional[bool] = None
+
+    def __post_init__(self):
+        self.amount_cents = validate_cents(self.amount_cents)
+        _require_text(self.user_id, "User ID cannot be empty")
+        _require_text(self.name, "Transaction name cannot be empty")
+
+@firestore_record("assignments")
+class AssignmentRecord:
+    """Assignment document"""
+
+    amount_cents: int
+    user_id: str
+    category_id: str
+    date: str
+    created_at: datetime = field(default_factory=_now)
+
+    def __post_init__(self):
+        self.amount_cents = validate_cents(self.amount_cents)
+        if self.amount_cents == 0:
+            raise ValueError("Assignment amount cannot be zero")
+        _require_text(self.user_id, "User ID cannot be empty")
+        _require_text(self.category_id, "Category ID cannot be empty")
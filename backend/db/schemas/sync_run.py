@@ -0,0 +1,41 @@
+from pydantic import BaseModel, Field, field_validator
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+from .base import FirestoreModel
+
+class SyncRun(FirestoreModel):
+    """Model for sync_runs documents in Firestore, one per Plaid transaction sync"""
+
+    user_id: str
+    status: str  # 'success' or 'failed'
+    error: Optional[str] = None
+    started_at: datetime
+    duration_seconds: float
+    phases: Dict[str, float] = {}  # Phase name -> seconds
+    items: List[Dict[str, Any]] = []  # Per Plaid item: latency, pages and added/modified/removed counts
+    totals: Dict[str, int] = {}
+    firestore_operations: Dict[str, int] = {}
+    batch_commits: Dict[str, Any] = {}
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @classmethod
+    def collection_name(cls) -> str:
+        return "sync_runs"
+
+    @field_validator('user_id')
+    @classmethod
+    def validate_user_id(cls, v):
+        if not v or len(v.strip()) == 0:
+            raise ValueError("User ID cannot be empty")
+        return v
+
+    @field_validator('status')
+    @classmethod
+    def validate_status(cls, v):
+        if v not in ["success", "failed"]:
+            raise ValueError("Sync run status must be 'success' or 'failed'")
+        return v
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert model to a dictionary for Firestore"""
+        return self.model_dump(exclude_none=True)
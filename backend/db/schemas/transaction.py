@@ -1,13 +1,13 @@
 from pydantic import BaseModel, Field, field_validator
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any, ClassVar
-from decimal import Decimal
 from .base import FirestoreModel
+from .money import validate_cents
 
 class Transaction(FirestoreModel):
     """Model for transaction documents in Firestore"""
     
-    amount: Decimal
+    amount_cents: int  # Negative for expenses, positive for income
     user_id: str
     name: str
     date: str    
@@ -25,16 +25,11 @@ class Transaction(FirestoreModel):
     def collection_name(cls) -> str:
         return "transactions"
     
-    @field_validator('amount')
+    @field_validator('amount_cents', mode='before')
     @classmethod
-    def validate_amount(cls, v):
+    def validate_amount_cents(cls, v):
         # Amount can be negative (expense) or positive (income)
-        # Convert to Decimal if it's not already
-        if isinstance(v, (int, float)):
-            return Decimal(str(v))
-        elif isinstance(v, str):
-            return Decimal(v)
-        return v
+        return validate_cents(v)
     
     @field_validator('user_id')
     @classmethod
@@ -60,8 +55,6 @@ class Transaction(FirestoreModel):
     def to_dict(self) -> Dict[str, Any]:
         """Convert model to a dictionary for Firestore"""
         data = self.model_dump(exclude_none=True)
-        # Convert Decimal to float for Firestore storage
-        data["amount"] = float(self.amount)
         # Ensure the type is set based on amount for consistency
-        data["type"] = "debit" if self.amount < 0 else "credit"
+        data["type"] = "debit" if self.amount_cents < 0 else "credit"
         return data
\ No newline at end of file
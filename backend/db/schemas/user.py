@@ -31,6 +31,9 @@ class User(FirestoreModel):
     email: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     preferences: UserPreferences = Field(default_factory=UserPreferences)
+    unallocated_category_id: Optional[str] = None  # ID of the user's "Unallocated Funds" category
+    data_layout: Optional[str] = None  # Storage layout of the user's documents (see db/layouts.py); flat when unset
+    archived_through: Optional[str] = None  # Newest month (YYYY-MM) of transactions compacted into cold storage
     
     @classmethod
     def collection_name(cls) -> str:
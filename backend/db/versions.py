@@ -0,0 +1,72 @@
+"""
+Version stamps and tombstones, for clients that keep a local copy of their data and only pull
+what changed (`POST /sync/get-changes` with `since=N`, api/sync_routes.py), and for the incremental
+balance reconciliation (api/reconciliation.py).
+
+Every write a repository batch (`LayoutBatch`) makes to a document of a versioned collection
+sets the document's `updated_at` to the server's commit timestamp, and deleting a document of
+a tombstoned collection also writes a tombstone (`tombstones/{collection}_{id}`, with the
+owner's user ID and the deletion's commit timestamp) in the same batch. A version is such a
+timestamp as an integer number of microseconds since the epoch. Commit timestamps only grow,
+and a read sees every commit timestamped before it, so the documents and tombstones of a user
+with a version in (N, M], read after M, are exactly the changes between versions N and M.
+
+Documents written before versioning have no `updated_at` and are never part of a delta;
+clients start (and restart, once their version is older than the tombstones kept) from a
+full fetch.
+"""
+from datetime import datetime, timedelta, timezone
+
+VERSION_FIELD = "updated_at"
+DELETED_FIELD = "deleted_at"
+TOMBSTONES_COLLECTION = "tombstones"
+
+# Collections whose documents are stamped; counter shards are, so a sharded balance change is a change of its category
+VERSIONED_COLLECTIONS = frozenset({
+    "categories", "category_groups", "transactions", "available_shards", "assignments", "transaction_archive"
+})
+
+# Collections whose deletes leave a tombstone (a category's shards go with the category)
+TOMBSTONED_COLLECTIONS = frozenset({"categories", "category_groups", "transactions", "assignments"})
+
+# Collections whose changes clients pull
+SYNCED_COLLECTIONS = frozenset({"categories", "category_groups", "transactions"})
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def to_version(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+def from_version(version):
+    return EPOCH + timedelta(microseconds=version)
+
+def collection_of(reference):
+    """ID of the collection a document reference belongs to"""
+    return reference.path.rsplit("/", 2)[-2]
+
+def tombstoned(reference):
+    return collection_of(reference) in TOMBSTONED_COLLECTIONS
+
+class Versions:
+    """Stamps and tombstones for one client, whose server timestamp sentinel they are written with"""
+
+    def __init__(self, client, server_timestamp):
+        self.client = client
+        self.server_timestamp = server_timestamp
+
+    def stamp(self, reference, data):
+        """The write's data with the version stamp added, for documents of versioned collections"""
+        if collection_of(reference) not in VERSIONED_COLLECTIONS:
+            return data
+        return {**data, VERSION_FIELD: self.server_timestamp}
+
+    def tombstone(self, reference, user_id):
+        """(reference, data) of the tombstone to write with the delete of a document of the user"""
+        collection = collection_of(reference)
+        tombstone_ref = self.client.collection(TOMBSTONES_COLLECTION).document(f"{collection}_{reference.id}")
+        return tombstone_ref, {
+            "user_id": user_id,
+            "collection": collection,
+            "document_id": reference.id,
+            DELETED_FIELD: self.server_timestamp,
+        }
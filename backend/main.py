@@ -1,10 +1,13 @@
 import sys
 import os
+import time
+from contextlib import asynccontextmanager, nullcontext
 
 # Add the parent directory to Python path for absolute imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from api.user_routes import router as user_router
 from api.category_routes import router as category_router
@@ -15,8 +18,22 @@ from api.account_routes import router as account_router
 from api.plaid_routes import router as plaid_router
 from api.plaid_item_routes import router as plaid_item_router
 from api.health_routes import router as health_router
+from api.categorization_rule_routes import router as categorization_rule_router
+from api.change_feed_routes import router as change_feed_router
+from api.sync_routes import router as sync_router
+from api.admin_routes import router as admin_router
+from api.db_async import configure_threadpool
+from api.db_instrumentation import count_operations
+from api.metrics import request_metrics
+from api import db_trace
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Size the threadpool that runs the blocking database and Plaid calls
+    configure_threadpool()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,8 +43,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Reads", "X-DB-Writes", "X-DB-Queries", "X-DB-Trace"],
 )
 
+@app.middleware("http")
+async def count_database_operations(request, call_next):
+    # Report the reads, writes and queries each request made, and record them with its latency and status for /metrics;
+    # with DB_TRACE on, every call is traced for N+1 patterns (api/db_trace.py)
+    started = time.perf_counter()
+    request_metrics.started()
+    status = 500
+    trace = db_trace.trace_operations() if db_trace.tracing() else nullcontext()
+    try:
+        with count_operations() as operations, trace as calls:
+            response = await call_next(request)
+        status = response.status_code
+    finally:
+        route = getattr(request.scope.get("route"), "path", None)
+        request_metrics.finished(request.method, route, status, time.perf_counter() - started, operations)
+    if calls is not None:
+        trace_summary = db_trace.finish_request(request.method, route, calls)
+        if trace_summary:
+            response.headers["X-DB-Trace"] = trace_summary
+    response.headers["X-DB-Reads"] = str(operations.reads)
+    response.headers["X-DB-Writes"] = str(operations.writes)
+    response.headers["X-DB-Queries"] = str(operations.queries)
+    return response
+
 # Include routers
 app.include_router(health_router, prefix="/health")
 app.include_router(user_router, prefix="/user")
@@ -38,7 +80,16 @@ app.include_router(assignment_router, prefix="/assignment")
 app.include_router(account_router, prefix="/account")
 app.include_router(plaid_router, prefix="/plaid")
 app.include_router(plaid_item_router, prefix="/plaid_item")
+app.include_router(categorization_rule_router, prefix="/categorization_rule")
+app.include_router(change_feed_router, prefix="/changes")
+app.include_router(sync_router, prefix="/sync")
+app.include_router(admin_router, prefix="/admin")
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the combined models and routes API"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Request and Firestore operation metrics of this process, in the Prometheus text format (api/metrics.py)"""
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4")
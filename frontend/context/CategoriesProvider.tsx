@@ -1,6 +1,6 @@
 // CategoriesProvider.tsx
-import React, { createContext, useContext, useEffect, useState } from 'react';
-import { onSnapshot, collection, query, where } from 'firebase/firestore';
+import React, { createContext, useContext, useEffect, useMemo, useState } from 'react';
+import { onSnapshot, collection, doc, query, where, Query, Unsubscribe } from 'firebase/firestore';
 import { db } from '../firebaseConfig.env.js';
 import { useAuth } from '@/context/AuthProvider';
 
@@ -30,52 +30,82 @@ type CategoriesContextType = {
   unallocatedFunds: Category | null;
 };
 
+// Layouts whose reads go to the user's subcollections (`read_layout` in backend/db/layouts.py)
+const PARTITIONED_READ_LAYOUTS = ['partitioned', 'partitioned_dual_write'];
+
 const CategoriesContext = createContext<CategoriesContextType | undefined>(undefined);
 
 export const CategoriesProvider: React.FC<{ children: React.ReactNode }> = ({ children }) => {
   const { user } = useAuth();
-  const [categories, setCategories] = useState<Category[]>([]);
+  const [fetchedCategories, setFetchedCategories] = useState<Category[]>([]);
+  // Sum of the counter shards of each sharded category, in cents (see backend/api/balance_counters.py)
+  const [shardCents, setShardCents] = useState<Record<string, number>>({});
   const [categoryGroups, setCategoryGroups] = useState<CategoryGroup[]>([]);
   const [loading, setLoading] = useState(true);
   const [groupsLoading, setGroupsLoading] = useState(true);
-  const [unallocatedFunds, setUnallocatedFunds] = useState<Category | null>(null);
+  // Whether the user's categories are read from `users/{uid}/categories`; null until the user document is read
+  const [partitioned, setPartitioned] = useState<boolean | null>(null);
 
+  // Follow the user's storage layout, which changes when the user is migrated
   useEffect(() => {
     if (!user) return;
 
-    // Create a query to get categories for the current user
-    const categoriesQuery = query(
-      collection(db, 'categories'),
-      where('user_id', '==', user.uid)
-    );
+    const unsubscribeUser = onSnapshot(doc(db, 'users', user.uid), (snapshot) => {
+      setPartitioned(PARTITIONED_READ_LAYOUTS.includes(snapshot.data()?.data_layout));
+    });
+
+    return () => {
+      unsubscribeUser();
+      setPartitioned(null);
+    };
+  }, [user]);
+
+  useEffect(() => {
+    if (!user || partitioned === null) return;
+
+    // One listener per sharded category on its `available_shards` subcollection
+    const shardListeners = new Map<string, Unsubscribe>();
+
+    // Create a query to get categories for the current user, from wherever the user's layout reads them
+    const categoriesQuery: Query = partitioned
+      ? collection(db, 'users', user.uid, 'categories')
+      : query(collection(db, 'categories'), where('user_id', '==', user.uid));
 
     // Subscribe to Firestore updates for categories
     const unsubscribeCategories = onSnapshot(categoriesQuery, (snapshot) => {
-      const fetchedCategories: Category[] = snapshot.docs.map((doc) => ({
-        id: doc.id,
-        ...doc.data(),
-      } as Category));
-
-      // Sort categories: Unallocated Funds at top, rest alphabetically
-      const sortedCategories = [...fetchedCategories].sort((a, b) => {
-        // Always put Unallocated Funds at the top
-        if (a.is_unallocated_funds) return -1;
-        if (b.is_unallocated_funds) return 1;
-        
-        // Otherwise sort alphabetically by name
-        return a.name.toLowerCase().localeCompare(b.name.toLowerCase());
+      const shardedIds = new Set<string>();
+      setFetchedCategories(snapshot.docs.map((categoryDoc) => {
+        const data = categoryDoc.data();
+        if (data.available_shards) {
+          shardedIds.add(categoryDoc.id);
+          if (!shardListeners.has(categoryDoc.id)) {
+            shardListeners.set(categoryDoc.id, onSnapshot(collection(categoryDoc.ref, 'available_shards'), (shards) => {
+              const cents = shards.docs.reduce((sum, shard) => sum + (shard.data().available_cents ?? 0), 0);
+              setShardCents((previous) => ({ ...previous, [categoryDoc.id]: cents }));
+            }));
+          }
+        }
+        // Amounts are stored in integer cents; documents not yet migrated still hold dollars
+        return {
+          id: categoryDoc.id,
+          ...data,
+          available: (data.available_cents ?? 0) / 100 + (data.available ?? 0),
+          goal_amount: data.goal_amount_cents != null ? data.goal_amount_cents / 100 : data.goal_amount,
+        } as Category;
+      }));
+
+      // Stop listening to the shards of deleted categories
+      shardListeners.forEach((unsubscribe, categoryId) => {
+        if (!shardedIds.has(categoryId)) {
+          unsubscribe();
+          shardListeners.delete(categoryId);
+        }
       });
-      
-      setCategories(sortedCategories);
-      
-      // Find the unallocated funds category
-      const unallocated = fetchedCategories.find(category => category.is_unallocated_funds) || null;
-      setUnallocatedFunds(unallocated);
-      
+
       setLoading(false);
     });
 
-    // Create a query to get category groups for the current user
+    // Create a query to get category groups for the current user (category groups are never partitioned)
     const categoryGroupsQuery = query(
       collection(db, 'category_groups'),
       where('user_id', '==', user.uid)
@@ -83,9 +113,9 @@ export const CategoriesProvider: React.FC<{ children: React.ReactNode }> = ({ ch
 
     // Subscribe to Firestore updates for category groups
     const unsubscribeCategoryGroups = onSnapshot(categoryGroupsQuery, (snapshot) => {
-      const fetchedCategoryGroups: CategoryGroup[] = snapshot.docs.map((doc) => ({
-        id: doc.id,
-        ...doc.data(),
+      const fetchedCategoryGroups: CategoryGroup[] = snapshot.docs.map((groupDoc) => ({
+        id: groupDoc.id,
+        ...groupDoc.data(),
       } as CategoryGroup));
 
       // Sort category groups by sort_order, then by name
@@ -104,8 +134,33 @@ export const CategoriesProvider: React.FC<{ children: React.ReactNode }> = ({ ch
     return () => {
       unsubscribeCategories();
       unsubscribeCategoryGroups();
+      shardListeners.forEach((unsubscribe) => unsubscribe());
+      setShardCents({});
     };
-  }, [user]);
+  }, [user, partitioned]);
+
+  // A category's balance is its own amount plus its shards
+  const categories = useMemo(() => {
+    const withShards = fetchedCategories.map((category) => (
+      shardCents[category.id] ? { ...category, available: category.available + shardCents[category.id] / 100 } : category
+    ));
+
+    // Sort categories: Unallocated Funds at top, rest alphabetically
+    return withShards.sort((a, b) => {
+      // Always put Unallocated Funds at the top
+      if (a.is_unallocated_funds) return -1;
+      if (b.is_unallocated_funds) return 1;
+
+      // Otherwise sort alphabetically by name
+      return a.name.toLowerCase().localeCompare(b.name.toLowerCase());
+    });
+  }, [fetchedCategories, shardCents]);
+
+  // Find the unallocated funds category
+  const unallocatedFunds = useMemo(
+    () => categories.find(category => category.is_unallocated_funds) || null,
+    [categories]
+  );
 
   return (
     <CategoriesContext.Provider value={{ categories, categoryGroups, loading, groupsLoading, unallocatedFunds }}>
@@ -1,5 +1,7 @@
 import { useState, useEffect, useCallback } from 'react';
 import { getAllocatedAndSpent } from '@/services/categories';
+import { subscribeToChanges, ChangeEvent } from '@/services/changes';
+import { useCategories } from '@/context/CategoriesProvider';
 
 interface User {
   email: string;
@@ -68,6 +70,41 @@ export function useAllocatedAndSpent(
     }
   }, [fetchAllocatedAndSpent]);
 
+  // Apply transaction changes from the change feed to the totals instead of re-fetching them
+  const { unallocatedFunds } = useCategories();
+  const unallocatedCategoryId = unallocatedFunds?.id;
+  useEffect(() => {
+    if (!user || !startDate || !endDate) return;
+
+    const roundCents = (amount: number) => Math.round(amount * 100) / 100;
+
+    // Adds (sign 1) or removes (sign -1) a transaction's amount from the period's totals
+    const applyTransaction = (transaction: any, sign: number) => {
+      if (!transaction?.category_id || transaction.date < startDate || transaction.date > endDate) return;
+      if (transaction.category_id === unallocatedCategoryId) {
+        setUnallocatedIncome((income) => roundCents(income + sign * transaction.amount));
+        return;
+      }
+      setAllocatedAndSpent((current) => {
+        const totals = current[transaction.category_id] || { allocated: 0, spent: 0 };
+        // Spending is the negated sum of the amounts
+        return { ...current, [transaction.category_id]: { ...totals, spent: roundCents(totals.spent - sign * transaction.amount) } };
+      });
+    };
+
+    const unsubscribe = subscribeToChanges(user.uid, (event: ChangeEvent) => {
+      if (event.type === 'ready' || event.type === 'resync') {
+        fetchAllocatedAndSpent();
+      } else if (event.type === 'transaction') {
+        applyTransaction(event.previous, -1);
+        applyTransaction(event.transaction, 1);
+      } else if (event.type === 'transaction_removed') {
+        applyTransaction(event.previous, -1);
+      }
+    });
+    return () => unsubscribe?.();
+  }, [user, startDate, endDate, unallocatedCategoryId, fetchAllocatedAndSpent]);
+
   const getAllocatedAmount = (categoryId: string) => {
     return allocatedAndSpent[categoryId]?.allocated || 0;
   };
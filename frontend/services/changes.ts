@@ -0,0 +1,37 @@
+// Subscription to the backend's change feed (Server-Sent Events from /changes/stream)
+
+export type ChangeEvent =
+  | { type: 'ready' }
+  | { type: 'resync' }
+  | { type: 'category'; category: any }
+  | { type: 'category_removed'; id: string }
+  | { type: 'transaction'; transaction: any; previous: any | null }
+  | { type: 'transaction_removed'; id: string; previous: any }
+  | { type: 'sync'; sync_run: any };
+
+const EVENT_TYPES = ['ready', 'resync', 'category', 'category_removed', 'transaction', 'transaction_removed', 'sync'];
+
+/**
+ * Calls `onEvent` with each change of the user's data. After `ready` (sent again on every
+ * reconnect) and `resync`, callers should fetch their data again; other events are deltas.
+ * Returns the unsubscribe function, or null where EventSource isn't available (native apps),
+ * in which case callers keep re-fetching after their own mutations.
+ */
+export const subscribeToChanges = (userId: string, onEvent: (event: ChangeEvent) => void): (() => void) | null => {
+  if (typeof EventSource === 'undefined') {
+    return null;
+  }
+
+  const prefix = process.env.EXPO_PUBLIC_CHANGES_PREFIX ?? '/changes';
+  const source = new EventSource(`${process.env.EXPO_PUBLIC_API_URL}${prefix}/stream?user_id=${encodeURIComponent(userId)}`);
+  const handle = (message: MessageEvent) => {
+    try {
+      onEvent(JSON.parse(message.data));
+    } catch (error) {
+      console.error('Failed to handle change event', error);
+    }
+  };
+  EVENT_TYPES.forEach((type) => source.addEventListener(type, handle as EventListener));
+
+  return () => source.close();
+};
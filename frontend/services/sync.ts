@@ -0,0 +1,137 @@
+// Delta sync: the user's documents changed since a version (POST /sync/get-changes)
+
+export type Changes = {
+  version: number;
+  resync: boolean;
+  has_more: boolean;
+  categories: any[];
+  category_groups: any[];
+  transactions: any[];
+  deleted: { collection: 'categories' | 'category_groups' | 'transactions'; id: string; version: number }[];
+};
+
+export const getChanges = async (userId: string, since: number): Promise<Changes> => {
+  const prefix = process.env.EXPO_PUBLIC_SYNC_PREFIX ?? '/sync';
+  const response = await fetch(`${process.env.EXPO_PUBLIC_API_URL}${prefix}/get-changes`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({
+      user_id: userId,
+      since,
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error('Failed to fetch changes');
+  }
+
+  return response.json();
+};
+
+/**
+ * Pulls every change since `since`, page by page, calling `apply` with each page (documents and
+ * deletions are applied by their `version`, oldest first). Returns the version to pass next time;
+ * with `resync` set (`since` of 0, or too old) nothing was applied and the local copy must be
+ * fetched again from scratch before storing that version.
+ */
+export const pullChanges = async (
+  userId: string,
+  since: number,
+  apply: (changes: Changes) => void,
+): Promise<{ version: number; resync: boolean }> => {
+  let version = since;
+  while (true) {
+    const changes = await getChanges(userId, version);
+    if (changes.resync) {
+      return { version: changes.version, resync: true };
+    }
+    apply(changes);
+    version = changes.version;
+    if (!changes.has_more) {
+      return { version, resync: false };
+    }
+  }
+};
+
+// Cold start: the user's whole state in one request (POST /sync/get-snapshot), in a columnar encoding
+
+type Table = Record<string, any[]>;
+
+export type Snapshot = {
+  version: number;
+  start_date: string;
+  user: { email: string; preferences: any; unallocated_category_id: string | null };
+  category_groups: Table;
+  categories: Table;
+  plaid_items: any[];
+  transactions: Table[];
+  strings: string[];
+};
+
+export const getSnapshot = async (userId: string, months?: number): Promise<Snapshot> => {
+  const prefix = process.env.EXPO_PUBLIC_SYNC_PREFIX ?? '/sync';
+  const response = await fetch(`${process.env.EXPO_PUBLIC_API_URL}${prefix}/get-snapshot`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({
+      user_id: userId,
+      ...(months ? { months } : {}),
+    }),
+  });
+
+  if (!response.ok) {
+    throw new Error('Failed to fetch snapshot');
+  }
+
+  return response.json();
+};
+
+const addDays = (isoDate: string, days: number) => {
+  const date = new Date(`${isoDate}T00:00:00Z`);
+  date.setUTCDate(date.getUTCDate() + days);
+  return date.toISOString().slice(0, 10);
+};
+
+/**
+ * Decodes a snapshot into objects shaped like the regular endpoints' responses (amounts in
+ * dollars), plus the version to pull changes from.
+ */
+export const decodeSnapshot = (snapshot: Snapshot) => {
+  const text = (index: number) => (index >= 0 ? snapshot.strings[index] : null);
+  const groups = snapshot.category_groups;
+  const categories = snapshot.categories;
+
+  return {
+    version: snapshot.version,
+    user: snapshot.user,
+    plaidItems: snapshot.plaid_items,
+    categoryGroups: groups.id.map((id: string, row: number) => ({
+      id,
+      name: text(groups.name[row]),
+      sort_order: groups.sort_order[row],
+    })),
+    categories: categories.id.map((id: string, row: number) => ({
+      id,
+      name: text(categories.name[row]),
+      group_id: categories.group[row] >= 0 ? groups.id[categories.group[row]] : null,
+      available: categories.available_cents[row] / 100,
+      goal_amount: categories.goal_cents[row] === null ? null : categories.goal_cents[row] / 100,
+      is_unallocated_funds: categories.is_unallocated_funds[row] === 1,
+    })),
+    transactions: snapshot.transactions.flatMap((chunk) => chunk.id.map((id: string, row: number) => ({
+      id,
+      date: addDays(snapshot.start_date, chunk.date[row]),
+      amount: chunk.amount_cents[row] / 100,
+      category_id: chunk.category[row] >= 0 ? categories.id[chunk.category[row]] : null,
+      name: text(chunk.name[row]),
+      merchant_name: text(chunk.merchant_name[row]),
+      account_name: text(chunk.account_name[row]),
+      institution_name: text(chunk.institution_name[row]),
+      pending: chunk.pending[row] === 1,
+    }))),
+  };
+};